@@ -0,0 +1,92 @@
+"""
+In-process caching helpers
+Bounded TTL cache used to memoize slow external lookups (Climatiq, Gemini, Supabase)
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU-bounded mapping whose entries expire `ttl` seconds after being set."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        # Fills in flight per key, and how often each of those keys was invalidated
+        # meanwhile; a fill only stores its value if no delete() or clear() ran during it
+        self._fills: Dict[Hashable, int] = {}
+        self._versions: Dict[Hashable, int] = {}
+        self._epoch = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        if key in self._fills:
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._epoch += 1
+
+    async def get_or_set(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the cached value for `key`, awaiting `factory()` on a miss.
+
+        Concurrent misses for the same key wait on one lock so the factory
+        runs once. Exceptions from the factory propagate and are not cached,
+        and neither is a value whose key was deleted while it was being built.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                value = self.get(key, _MISSING)
+                if value is _MISSING:
+                    value = await self._fill(key, factory)
+                return value
+        finally:
+            if not lock.locked():
+                self._locks.pop(key, None)
+
+    async def _fill(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `factory()` and store its value unless `key` was invalidated meanwhile."""
+        self._fills[key] = self._fills.get(key, 0) + 1
+        version, epoch = self._versions.get(key, 0), self._epoch
+        try:
+            value = await factory()
+            if self._versions.get(key, 0) == version and self._epoch == epoch:
+                self.set(key, value)
+            return value
+        finally:
+            self._fills[key] -= 1
+            if not self._fills[key]:
+                del self._fills[key]
+                self._versions.pop(key, None)
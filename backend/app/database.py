@@ -1,6 +1,18 @@
-from supabase import create_client, Client
+import httpx
+from supabase import create_client, Client, ClientOptions
 from app.config import get_settings
 
 settings = get_settings()
 
-supabase: Client = create_client(settings.supabase_url, settings.supabase_key)
+# One pooled HTTP/2 client for every PostgREST call, so requests reuse warm connections
+_http_client = httpx.Client(
+    http2=True,
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=60),
+)
+
+supabase: Client = create_client(
+    settings.supabase_url,
+    settings.supabase_key,
+    options=ClientOptions(httpx_client=_http_client, postgrest_client_timeout=10),
+)
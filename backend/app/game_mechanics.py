@@ -1,42 +1,75 @@
+import math
+from bisect import bisect_left
+from typing import Iterable, List, Tuple
 
 XP_MULTIPLIER = 60
 
 def calculate_level(total_xp: int) -> int:
-    """Calculate level from total XP. Each level requires level * XP_MULTIPLIER XP."""
-    level = 1
-    xp_needed = 0
-    
-    while xp_needed <= total_xp:
-        level += 1
-        xp_needed += level * XP_MULTIPLIER
-    
-    return level - 1
+    """Calculate level from total XP. Each level requires level * XP_MULTIPLIER XP.
+
+    Inverts get_level_threshold: the highest level L with
+    XP_MULTIPLIER * (L * (L + 1) / 2 - 1) <= total_xp.
+    """
+    if total_xp < 0:
+        return 0
+    n = math.isqrt(8 * (int(total_xp) // XP_MULTIPLIER + 1) + 1)
+    return (n - 1) // 2
 
 
 def get_level_threshold(level: int) -> int:
     """Get the XP threshold for a given level."""
-    total = 0
-    for i in range(2, level + 1):
-        total += i * XP_MULTIPLIER
-    return total
+    if level < 2:
+        return 0
+    return XP_MULTIPLIER * (level * (level + 1) // 2 - 1)
+
+
+def get_level_progress(total_xp: int) -> Tuple[int, int, int]:
+    """Return (level, XP earned within that level, XP left to the next level)."""
+    level = calculate_level(total_xp)
+    level_threshold = get_level_threshold(level)
+    next_level_threshold = get_level_threshold(level + 1)
+    return level, total_xp - level_threshold, next_level_threshold - total_xp
+
+
+# Last level of each plant stage; levels past the final entry are the max stage.
+_PLANT_STAGE_END_LEVELS = (2, 4, 7, 10, 15, 20)
+_STAGE_BY_LEVEL = tuple(
+    bisect_left(_PLANT_STAGE_END_LEVELS, level) + 1
+    for level in range(_PLANT_STAGE_END_LEVELS[-1] + 2)
+)
 
 
 def get_plant_stage(level: int) -> int:
     """Determine plant stage based on level."""
-    if level <= 2:
-        return 1
-    elif level <= 4:
-        return 2
-    elif level <= 7:
-        return 3
-    elif level <= 10:
-        return 4
-    elif level <= 15:
-        return 5
-    elif level <= 20:
-        return 6
-    else:
-        return 7
+    return _STAGE_BY_LEVEL[min(max(level, 0), len(_STAGE_BY_LEVEL) - 1)]
+
+
+# Indexed by plant stage (1-7); index 0 is unused
+_PLANT_STAGE_NAMES = (
+    "Seed",
+    "Seed",
+    "Sprout",
+    "Seedling",
+    "Young Tree",
+    "Mature Tree",
+    "Ancient Tree",
+    "Forest Guardian"
+)
+
+
+def get_plant_stage_name(stage: int) -> str:
+    """Display name for a plant stage (unknown stages show as a seed)."""
+    if isinstance(stage, int) and 0 < stage < len(_PLANT_STAGE_NAMES):
+        return _PLANT_STAGE_NAMES[stage]
+    return "Seed"
+
+
+_CATEGORY_XP_BONUSES = {
+    "transportation": 10,
+    "food": 5,
+    "energy": 5,
+    "shopping": 5
+}
 
 
 def calculate_xp(co2_saved_kg: float, category: str) -> int:
@@ -46,17 +79,31 @@ def calculate_xp(co2_saved_kg: float, category: str) -> int:
     base_xp = 10
     co2_xp = min(int(co2_saved_kg * 5), 40)
     
-    category_bonuses = {
-        "transportation": 10,
-        "food": 5,
-        "energy": 5,
-        "shopping": 5
-    }
-    
-    total_xp = base_xp + co2_xp + category_bonuses.get(category, 0)
+    total_xp = base_xp + co2_xp + _CATEGORY_XP_BONUSES.get(category, 0)
     return min(total_xp, 50)  # Cap at 50
 
 
+def calculate_xp_batch(co2_saved_kg: Iterable[float], categories: Iterable[str]) -> List[int]:
+    """Calculate XP for many activities at once (see calculate_xp)."""
+    bonuses = _CATEGORY_XP_BONUSES
+    return [
+        min(10 + min(int(co2 * 5), 40) + bonuses.get(category, 0), 50)
+        for co2, category in zip(co2_saved_kg, categories)
+    ]
+
+
+def calculate_level_batch(total_xp: Iterable[int]) -> List[int]:
+    """Calculate levels for many XP totals at once (see calculate_level)."""
+    return list(map(calculate_level, total_xp))
+
+
+def get_plant_stage_batch(levels: Iterable[int]) -> List[int]:
+    """Determine plant stages for many levels at once (see get_plant_stage)."""
+    table = _STAGE_BY_LEVEL
+    last = len(table) - 1
+    return [table[min(max(level, 0), last)] for level in levels]
+
+
 def get_plant_stage_levels() -> dict:
     """Return level thresholds for plant stages."""
     return {
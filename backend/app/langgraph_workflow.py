@@ -9,210 +9,259 @@ This workflow:
 5. Formats output for database storage
 """
 
-from typing import TypedDict, List, Dict, Any, Annotated
-from langgraph.graph import StateGraph, END
-from langchain_google_genai import ChatGoogleGenerativeAI
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Annotated, Optional
+from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import SystemMessage, HumanMessage
+import asyncio
+import heapq
+import re
+import time
 import httpx
-import json
+import orjson
+from types import MappingProxyType
 from app.config import get_settings
+from app.cache import TTLCache
+from app.services.llm import with_model
 
 settings = get_settings()
 
-
-class WorkflowState(TypedDict):
+# Shared Climatiq client so onboarding requests reuse pooled keep-alive connections
+_climatiq_client = httpx.AsyncClient(
+    base_url="https://api.climatiq.io",
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    timeout=3.0,
+    headers={
+        "Authorization": f"Bearer {settings.climatiq_api_key}",
+        "Content-Type": "application/json"
+    }
+)
+
+_MILES_TO_KM = 1.60934
+# Round trip, 20 work days a month
+_MONTHLY_COMMUTE_KM_PER_MILE = 2 * 20 * _MILES_TO_KM
+
+# Map survey commute options to Climatiq activity types (None = zero emissions)
+_CAR_ACTIVITY_ID = "passenger_vehicle-vehicle_type_car-fuel_source_na-engine_size_na-vehicle_age_na-vehicle_weight_na"
+_COMMUTE_ACTIVITY_IDS = MappingProxyType({
+    "I drive alone": _CAR_ACTIVITY_ID,
+    "I carpool with others": _CAR_ACTIVITY_ID,
+    "Public transportation (bus, train, subway)": "passenger_train-route_type_commuter_rail",
+    "I bike": None,
+    "I walk": None,
+    "I work/study from home": None,
+    "Mix of multiple methods": _CAR_ACTIVITY_ID
+})
+_FLIGHT_ACTIVITY_ID = "passenger_flight-route_type_domestic-aircraft_type_na-distance_na-class_na-rf_included"
+
+# Estimated miles flown per year for each survey frequency bucket
+_FLIGHT_MILES = MappingProxyType({
+    "Never or almost never": 0,
+    "1-2 times": 2000,  # ~1 round trip domestic
+    "3-5 times": 5000,
+    "6-10 times": 10000,
+    "More than 10 times": 15000
+})
+
+# Fallback estimates used when Climatiq is unavailable
+# Monthly kg CO2e per diet, based on literature
+_DIET_CO2 = MappingProxyType({
+    "I eat meat with most meals": 250,
+    "I eat meat several times a week": 180,
+    "I eat meat occasionally (1-2x/week)": 120,
+    "Pescatarian (fish but no meat)": 90,
+    "Vegetarian": 60,
+    "Vegan": 40
+})
+
+# kg CO2 per mile by commute method
+_COMMUTE_CO2_PER_MILE = MappingProxyType({
+    "I drive alone": 0.404,
+    "I carpool with others": 0.202,  # Divided by 2
+    "Public transportation (bus, train, subway)": 0.14,
+    "I bike": 0,
+    "I walk": 0,
+    "I work/study from home": 0,
+    "Mix of multiple methods": 0.25
+})
+
+# kg CO2 per flight frequency bucket
+_FLIGHT_CO2 = MappingProxyType({
+    "Never or almost never": 0,
+    "1-2 times": 400,
+    "3-5 times": 1000,
+    "6-10 times": 2000,
+    "More than 10 times": 3000
+})
+
+# Invariant part of every estimate request; callers fill in activity_id and parameters
+_EMISSION_FACTOR_TEMPLATE = MappingProxyType({
+    "source": "EPA",
+    "region": "US",
+    "year": "2024"
+})
+
+# Circuit breaker: after 3 consecutive failures skip Climatiq for 60s and use the estimators
+_BREAKER_THRESHOLD = 3
+_BREAKER_COOLDOWN_SECONDS = 60.0
+_breaker = {"failures": 0, "open_until": 0.0}
+
+# Emission factors don't change intra-day, so successful estimates are kept for 24h
+_climatiq_cache = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+
+
+async def close_climatiq_client() -> None:
+    """Close the shared Climatiq client (called on app shutdown)."""
+    await _climatiq_client.aclose()
+
+
+@dataclass(slots=True)
+class WorkflowState:
     """State maintained throughout the workflow"""
     user_id: str
     survey_data: Dict[str, Any]
-    baseline_co2_kg: float
-    profile_type: str
-    opportunity_areas: List[str]
-    missions: List[Dict[str, Any]]
-    error: str | None
+    baseline_co2_kg: float = 0.0
+    profile_type: str = "BEGINNER"
+    opportunity_areas: List[str] = field(default_factory=list)
+    missions: List[Dict[str, Any]] = field(default_factory=list)
+    error: str | None = None
 
 
-async def calculate_co2_footprint(state: WorkflowState) -> WorkflowState:
+async def calculate_co2_footprint(state: WorkflowState) -> Dict[str, Any]:
     """
     Calculate CO2 footprint using Climatiq.io API based on survey responses.
     
-    Falls back to estimated calculations if API call fails.
+    Falls back to estimated calculations if API call fails. Returns only the
+    baseline update since this node runs in parallel with analyze_survey.
     """
-    survey = state["survey_data"]
+    survey = state.survey_data
     
     try:
         # Use Climatiq.io API for accurate calculations
-        async with httpx.AsyncClient() as client:
-            total_co2 = 0.0
-            
-            # Transportation emissions
-            if survey.get("commute_method") and survey.get("commute_distance"):
-                commute_emissions = await _calculate_transportation_emissions(
-                    client, survey["commute_method"], survey.get("commute_distance", 0)
-                )
-                total_co2 += commute_emissions
-            
-            # Flight emissions
-            if survey.get("flight_frequency"):
-                flight_emissions = await _calculate_flight_emissions(
-                    client, survey["flight_frequency"]
-                )
-                total_co2 += flight_emissions
-            
-            # Food emissions
-            if survey.get("diet_type"):
-                food_emissions = await _calculate_food_emissions(
-                    client, survey["diet_type"]
-                )
-                total_co2 += food_emissions
-            
-            state["baseline_co2_kg"] = round(total_co2, 2)
-            
+        # (request coroutine, fallback estimate) per category, sent concurrently
+        estimates = []
+        
+        # Transportation emissions
+        if survey.get("commute_method") and survey.get("commute_distance"):
+            commute_method = survey["commute_method"]
+            commute_distance = survey.get("commute_distance", 0)
+            estimates.append((
+                _calculate_transportation_emissions(commute_method, commute_distance),
+                lambda: _estimate_transport_co2(commute_method, commute_distance)
+            ))
+        
+        # Flight emissions
+        if survey.get("flight_frequency"):
+            flight_frequency = survey["flight_frequency"]
+            estimates.append((
+                _calculate_flight_emissions(flight_frequency),
+                lambda: _estimate_flight_co2(flight_frequency)
+            ))
+        
+        results = await asyncio.gather(
+            *(request for request, _ in estimates),
+            return_exceptions=True
+        )
+        
+        # Food emissions are a local lookup, no API call needed
+        total_co2 = _calculate_food_emissions(survey["diet_type"]) if survey.get("diet_type") else 0.0
+        for (_, fallback), result in zip(estimates, results):
+            if isinstance(result, Exception):
+                print(f"Climatiq API error: {result}. Using estimated calculation.")
+                result = fallback()
+            total_co2 += result
+        
+        state.baseline_co2_kg = round(total_co2, 2)
+        
     except Exception as e:
         print(f"Climatiq API error: {e}. Using estimated calculations.")
         # Fallback to estimated calculations
-        state["baseline_co2_kg"] = _estimate_co2_footprint(survey)
+        state.baseline_co2_kg = _estimate_co2_footprint(survey)
     
-    return state
+    return {"baseline_co2_kg": state.baseline_co2_kg}
+
+
+async def _request_estimate(activity_id: str, parameters: Dict[str, Any]) -> float:
+    """POST an estimate to Climatiq. Raises on transport errors, non-200 responses and an open breaker."""
+    if time.monotonic() < _breaker["open_until"]:
+        raise RuntimeError("Climatiq circuit breaker is open")
+    
+    payload = {
+        "emission_factor": {**_EMISSION_FACTOR_TEMPLATE, "activity_id": activity_id},
+        "parameters": parameters
+    }
+    try:
+        response = await _climatiq_client.post("/data/v1/estimate", content=orjson.dumps(payload))
+        response.raise_for_status()
+    except Exception:
+        _breaker["failures"] += 1
+        if _breaker["failures"] >= _BREAKER_THRESHOLD:
+            _breaker["open_until"] = time.monotonic() + _BREAKER_COOLDOWN_SECONDS
+            print(f"⚠️ Climatiq failed {_breaker['failures']} times in a row, skipping it for {_BREAKER_COOLDOWN_SECONDS:.0f}s")
+        raise
+    
+    _breaker["failures"] = 0
+    return response.json().get("co2e", 0.0)
 
 
 async def _calculate_transportation_emissions(
-    client: httpx.AsyncClient, 
     commute_method: str, 
     distance_miles: int
 ) -> float:
     """Calculate transportation emissions via Climatiq API"""
     
-    # Map survey options to Climatiq activity types
-    activity_map = {
-        "I drive alone": "passenger_vehicle-vehicle_type_car-fuel_source_na-engine_size_na-vehicle_age_na-vehicle_weight_na",
-        "I carpool with others": "passenger_vehicle-vehicle_type_car-fuel_source_na-engine_size_na-vehicle_age_na-vehicle_weight_na",
-        "Public transportation (bus, train, subway)": "passenger_train-route_type_commuter_rail",
-        "I bike": None,  # Zero emissions
-        "I walk": None,  # Zero emissions
-        "I work/study from home": None,  # Zero emissions
-        "Mix of multiple methods": "passenger_vehicle-vehicle_type_car-fuel_source_na-engine_size_na-vehicle_age_na-vehicle_weight_na"
-    }
-    
-    activity_id = activity_map.get(commute_method)
+    activity_id = _COMMUTE_ACTIVITY_IDS.get(commute_method)
     
     if not activity_id:
         return 0.0  # Zero emissions for bike/walk/home
     
-    # Convert miles to km (Climatiq uses metric)
-    distance_km = distance_miles * 1.60934
-    
-    # Calculate monthly emissions (assuming 20 work days/month, round trip)
-    monthly_distance_km = distance_km * 2 * 20
+    # Monthly distance in km (Climatiq uses metric), rounded to 5 km so
+    # nearby commutes share a cached estimate
+    monthly_distance_km = round(distance_miles * _MONTHLY_COMMUTE_KM_PER_MILE / 5) * 5
     
     try:
-        response = await client.post(
-            "https://api.climatiq.io/data/v1/estimate",
-            headers={
-                "Authorization": f"Bearer {settings.climatiq_api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "emission_factor": {
-                    "activity_id": activity_id,
-                    "source": "EPA",
-                    "region": "US",
-                    "year": "2024"
-                },
-                "parameters": {
-                    "distance": monthly_distance_km,
-                    "distance_unit": "km"
-                }
-            },
-            timeout=10.0
+        # Climatiq returns kg CO2e
+        return await _climatiq_cache.get_or_set(
+            ("transport", activity_id, monthly_distance_km),
+            lambda: _request_estimate(activity_id, {
+                "distance": monthly_distance_km,
+                "distance_unit": "km"
+            })
         )
-        
-        if response.status_code == 200:
-            data = response.json()
-            # Climatiq returns kg CO2e
-            return data.get("co2e", 0.0)
-        else:
-            # Fallback estimation
-            return _estimate_transport_co2(commute_method, distance_miles)
             
     except Exception as e:
         print(f"Climatiq transport API error: {e}")
         return _estimate_transport_co2(commute_method, distance_miles)
 
 
-async def _calculate_flight_emissions(
-    client: httpx.AsyncClient, 
-    flight_frequency: str
-) -> float:
+async def _calculate_flight_emissions(flight_frequency: str) -> float:
     """Calculate flight emissions via Climatiq API"""
     
-    # Map frequency to estimated miles
-    flight_miles_map = {
-        "Never or almost never": 0,
-        "1-2 times": 2000,  # ~1 round trip domestic
-        "3-5 times": 5000,
-        "6-10 times": 10000,
-        "More than 10 times": 15000
-    }
-    
-    miles = flight_miles_map.get(flight_frequency, 0)
+    miles = _FLIGHT_MILES.get(flight_frequency, 0)
     
     if miles == 0:
         return 0.0
     
-    # Convert to km
-    km = miles * 1.60934
-    
     try:
-        response = await client.post(
-            "https://api.climatiq.io/data/v1/estimate",
-            headers={
-                "Authorization": f"Bearer {settings.climatiq_api_key}",
-                "Content-Type": "application/json"
-            },
-            json={
-                "emission_factor": {
-                    "activity_id": "passenger_flight-route_type_domestic-aircraft_type_na-distance_na-class_na-rf_included",
-                    "source": "EPA",
-                    "region": "US",
-                    "year": "2024"
-                },
-                "parameters": {
-                    "distance": km,
-                    "distance_unit": "km",
-                    "passengers": 1
-                }
-            },
-            timeout=10.0
+        # Only a handful of frequency buckets exist, so this is effectively a memo
+        return await _climatiq_cache.get_or_set(
+            ("flight", flight_frequency),
+            lambda: _request_estimate(_FLIGHT_ACTIVITY_ID, {
+                "distance": miles * _MILES_TO_KM,
+                "distance_unit": "km",
+                "passengers": 1
+            })
         )
-        
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("co2e", 0.0)
-        else:
-            return _estimate_flight_co2(flight_frequency)
             
     except Exception as e:
         print(f"Climatiq flight API error: {e}")
         return _estimate_flight_co2(flight_frequency)
 
 
-async def _calculate_food_emissions(
-    client: httpx.AsyncClient, 
-    diet_type: str
-) -> float:
+def _calculate_food_emissions(diet_type: str) -> float:
     """Estimate food emissions based on diet type"""
-    
-    # Monthly kg CO2e estimates based on literature
-    diet_emissions_map = {
-        "I eat meat with most meals": 250,
-        "I eat meat several times a week": 180,
-        "I eat meat occasionally (1-2x/week)": 120,
-        "Pescatarian (fish but no meat)": 90,
-        "Vegetarian": 60,
-        "Vegan": 40
-    }
-    
-    return diet_emissions_map.get(diet_type, 150)
+    return _DIET_CO2.get(diet_type, 150)
 
 
 def _estimate_co2_footprint(survey: Dict[str, Any]) -> float:
@@ -232,309 +281,258 @@ def _estimate_co2_footprint(survey: Dict[str, Any]) -> float:
     
     # Food
     if survey.get("diet_type"):
-        diet_map = {
-            "I eat meat with most meals": 250,
-            "I eat meat several times a week": 180,
-            "I eat meat occasionally (1-2x/week)": 120,
-            "Pescatarian (fish but no meat)": 90,
-            "Vegetarian": 60,
-            "Vegan": 40
-        }
-        total += diet_map.get(survey["diet_type"], 150)
+        total += _calculate_food_emissions(survey["diet_type"])
     
     return round(total, 2)
 
 
 def _estimate_transport_co2(commute_method: str, distance_miles: int) -> float:
     """Fallback transport estimation"""
-    # kg CO2 per mile estimates
-    emissions_per_mile = {
-        "I drive alone": 0.404,
-        "I carpool with others": 0.202,  # Divided by 2
-        "Public transportation (bus, train, subway)": 0.14,
-        "I bike": 0,
-        "I walk": 0,
-        "I work/study from home": 0,
-        "Mix of multiple methods": 0.25
-    }
-    
-    rate = emissions_per_mile.get(commute_method, 0.25)
+    rate = _COMMUTE_CO2_PER_MILE.get(commute_method, 0.25)
     # Monthly: distance × 2 (round trip) × 20 days
     return rate * distance_miles * 2 * 20
 
 
 def _estimate_flight_co2(flight_frequency: str) -> float:
     """Fallback flight estimation"""
-    flight_co2_map = {
-        "Never or almost never": 0,
-        "1-2 times": 400,
-        "3-5 times": 1000,
-        "6-10 times": 2000,
-        "More than 10 times": 3000
-    }
-    return flight_co2_map.get(flight_frequency, 0)
+    return _FLIGHT_CO2.get(flight_frequency, 0)
+
+
+# (beginner, intermediate, expert) score deltas per survey answer
+_TIME_COMMITMENT_SCORES = MappingProxyType({
+    "5-10 minutes (just quick wins)": (3, 0, 0),
+    "15-30 minutes (a few small changes)": (0, 3, 0),
+    "30-60 minutes (multiple actions)": (0, 3, 0),
+    "1+ hours (significant lifestyle changes)": (0, 0, 3)
+})
+_CARBON_AWARENESS_SCORES = MappingProxyType({
+    "I have no idea what my carbon footprint is": (2, 0, 0),
+    "I have a rough sense but haven't measured it": (0, 2, 0),
+    "I've calculated it before": (0, 0, 2),
+    "I actively track and try to reduce it": (0, 0, 2)
+})
+_ACHIEVABLE_CHANGES_SCORES = MappingProxyType({
+    "Tiny habits I can do daily (unplug charger, use reusable cup)": (1, 0, 0),
+    "Small weekly actions (meatless Monday, walk instead of drive)": (0, 1, 0),
+    "Monthly commitments (buy secondhand, meal prep)": (0, 1, 0),
+    "Bigger lifestyle shifts (change commute, diet changes)": (0, 0, 1),
+    "I'm ready for all of it!": (0, 0, 1)
+})
+_NO_SCORE = (0, 0, 0)
 
 
 def classify_user_profile(state: WorkflowState) -> WorkflowState:
     """
     Classify user as BEGINNER, INTERMEDIATE, or EXPERT based on survey responses.
     """
-    survey = state["survey_data"]
+    survey = state.survey_data
     
     # Factors for classification
-    time_commitment = survey.get("time_commitment", "")
-    carbon_awareness = survey.get("carbon_awareness", "")
-    achievable_changes = survey.get("achievable_changes", "")
     current_habits = survey.get("current_habits", [])
     
     # Count current sustainable habits
     habit_count = len(current_habits) if isinstance(current_habits, list) else 0
     
-    # Classify based on multiple factors
-    beginner_score = 0
-    intermediate_score = 0
-    expert_score = 0
-    
-    # Time commitment scoring
-    if "5-10 minutes" in time_commitment:
-        beginner_score += 3
-    elif "15-30 minutes" in time_commitment or "30-60 minutes" in time_commitment:
-        intermediate_score += 3
-    elif "1+ hours" in time_commitment:
-        expert_score += 3
-    
-    # Awareness scoring
-    if "no idea" in carbon_awareness:
-        beginner_score += 2
-    elif "rough sense" in carbon_awareness:
-        intermediate_score += 2
-    elif "calculated it" in carbon_awareness or "actively track" in carbon_awareness:
-        expert_score += 2
+    # Time commitment, awareness and achievable changes scoring
+    time_b, time_i, time_e = _TIME_COMMITMENT_SCORES.get(survey.get("time_commitment"), _NO_SCORE)
+    aware_b, aware_i, aware_e = _CARBON_AWARENESS_SCORES.get(survey.get("carbon_awareness"), _NO_SCORE)
+    change_b, change_i, change_e = _ACHIEVABLE_CHANGES_SCORES.get(survey.get("achievable_changes"), _NO_SCORE)
+    
+    beginner_score = time_b + aware_b + change_b
+    intermediate_score = time_i + aware_i + change_i
+    expert_score = time_e + aware_e + change_e
     
     # Current habits
-    if habit_count == 0 or (habit_count == 1 and "None of these yet" in str(current_habits)):
+    if habit_count == 0 or (habit_count == 1 and current_habits[0] == "None of these yet"):
         beginner_score += 2
     elif habit_count <= 3:
         intermediate_score += 2
     else:
         expert_score += 2
     
-    # Achievable changes
-    if "Tiny habits" in achievable_changes:
-        beginner_score += 1
-    elif "Small weekly" in achievable_changes or "Monthly commitments" in achievable_changes:
-        intermediate_score += 1
-    elif "Bigger lifestyle" in achievable_changes or "ready for all" in achievable_changes:
-        expert_score += 1
-    
-    # Determine final classification
-    max_score = max(beginner_score, intermediate_score, expert_score)
-    if max_score == expert_score:
-        state["profile_type"] = "EXPERT"
-    elif max_score == intermediate_score:
-        state["profile_type"] = "INTERMEDIATE"
-    else:
-        state["profile_type"] = "BEGINNER"
+    # Determine final classification (ties favour the more advanced profile)
+    state.profile_type = max(
+        (("EXPERT", expert_score), ("INTERMEDIATE", intermediate_score), ("BEGINNER", beginner_score)),
+        key=lambda profile: profile[1]
+    )[0]
     
     return state
 
 
+# Opportunity categories, indexed by the category ids used in _OPPORTUNITY_RULES
+_OPPORTUNITY_CATEGORIES = ("transportation", "food", "shopping", "energy")
+
+# (survey field, matching answers or predicate, category id, score delta)
+_OPPORTUNITY_RULES = (
+    # Transportation impact
+    ("commute_method", frozenset({"I drive alone", "Mix of multiple methods"}), 0, 3),
+    ("commute_distance", lambda distance: (distance or 0) > 10, 0, 2),
+    ("flight_frequency", frozenset({"More than 10 times"}), 0, 2),
+    # Food impact
+    ("diet_type", frozenset({"I eat meat with most meals"}), 1, 3),
+    ("eating_out_frequency", frozenset({"Daily or almost daily", "4-6 times per week"}), 1, 2),
+    ("cooking_habits", frozenset({"I don't cook at all", "Rarely, I mostly eat out or order in"}), 1, 1),
+    # Shopping impact
+    ("clothing_frequency", frozenset({"Monthly or more often"}), 2, 2),
+    ("purchase_behavior", frozenset({"Buy it new immediately"}), 2, 2),
+    ("shopping_location", frozenset({"Mostly online (Amazon, etc.)"}), 2, 1),
+    # Energy impact
+    ("energy_control", frozenset({"Full control (own home, pay utilities)", "Some control (rent, pay utilities)"}), 3, 3),
+    ("housing_type", frozenset({"House (I own or rent)"}), 3, 2)
+)
+
+
 def identify_opportunities(state: WorkflowState) -> WorkflowState:
     """
     Identify top 3 opportunity areas based on CO2 impact and user lifestyle.
     """
-    survey = state["survey_data"]
-    opportunities = []
+    survey = state.survey_data
     
     # Calculate impact potential for each category
-    impact_scores = {}
+    impact_scores = [0] * len(_OPPORTUNITY_CATEGORIES)
+    for survey_field, matcher, category_id, delta in _OPPORTUNITY_RULES:
+        value = survey.get(survey_field)
+        matched = value in matcher if isinstance(matcher, frozenset) else matcher(value)
+        if matched:
+            impact_scores[category_id] += delta
     
-    # Transportation impact
-    transport_score = 0
-    if survey.get("commute_method") in ["I drive alone", "Mix of multiple methods"]:
-        transport_score += 3
-    if survey.get("commute_distance", 0) > 10:
-        transport_score += 2
-    if "More than" in survey.get("flight_frequency", ""):
-        transport_score += 2
-    impact_scores["transportation"] = transport_score
-    
-    # Food impact
-    food_score = 0
-    if "meat with most meals" in survey.get("diet_type", ""):
-        food_score += 3
-    if "Daily" in survey.get("eating_out_frequency", "") or "4-6 times" in survey.get("eating_out_frequency", ""):
-        food_score += 2
-    if "don't cook" in survey.get("cooking_habits", "") or "Rarely" in survey.get("cooking_habits", ""):
-        food_score += 1
-    impact_scores["food"] = food_score
-    
-    # Shopping impact
-    shopping_score = 0
-    if "Monthly" in survey.get("clothing_frequency", ""):
-        shopping_score += 2
-    if "Buy it new immediately" == survey.get("purchase_behavior"):
-        shopping_score += 2
-    if "Mostly online" in survey.get("shopping_location", ""):
-        shopping_score += 1
-    impact_scores["shopping"] = shopping_score
-    
-    # Energy impact
-    energy_score = 0
-    if "Full control" in survey.get("energy_control", "") or "Some control" in survey.get("energy_control", ""):
-        energy_score += 3
-    if "House" in survey.get("housing_type", ""):
-        energy_score += 2
-    impact_scores["energy"] = energy_score
-    
-    # Sort by score and get top 3
-    sorted_areas = sorted(impact_scores.items(), key=lambda x: x[1], reverse=True)
-    state["opportunity_areas"] = [area for area, score in sorted_areas[:3] if score > 0]
+    # Top 3 by score (ties keep category order)
+    top_ids = heapq.nlargest(3, range(len(impact_scores)), key=impact_scores.__getitem__)
+    state.opportunity_areas = [_OPPORTUNITY_CATEGORIES[i] for i in top_ids if impact_scores[i] > 0]
     
     # Ensure at least one opportunity
-    if not state["opportunity_areas"]:
-        state["opportunity_areas"] = ["transportation", "food", "energy"]
+    if not state.opportunity_areas:
+        state.opportunity_areas = ["transportation", "food", "energy"]
     
     return state
 
 
+def analyze_survey(state: WorkflowState) -> Dict[str, Any]:
+    """
+    Classify the user's profile and pick their opportunity areas in one graph step.
+    Returns only the fields it owns since it runs in parallel with calculate_co2.
+    """
+    identify_opportunities(classify_user_profile(state))
+    return {"profile_type": state.profile_type, "opportunity_areas": state.opportunity_areas}
+
+
+# Shared Gemini client, built once at import instead of per onboarding
+_mission_llm = with_model("gemini-2.5-flash-preview-09-2025", temperature=0.7)
+
+# Invariant part of the mission prompt; kept byte-identical across requests so Gemini can reuse its prompt cache
+_STATIC_SYSTEM = SystemMessage(content="""You are a sustainability coach. From the user's profile and onboarding survey, generate 8-12 personalized carbon reduction missions.
+
+Missions must be:
+- Specific and actionable ("try one meatless lunch this week", not "reduce meat")
+- Highest-ROI for their profile and feasible for their situation (no biking for a 30-mile commute, no meal prep for non-cooks)
+- Matched to their time commitment and motivation (show $ savings if money-motivated)
+- 60% easy (10-20 XP), 30% medium (30-50 XP), 10% challenging (60-100 XP)
+- Never extreme (going vegan, selling the car, moving house, switching utility)
+
+Good: "Unplug your phone charger before bed tonight", "Combine two errands into one trip"
+Bad: "Go vegetarian", "Start biking to work", "Never buy clothes again"
+
+Respond with only a JSON array of objects:
+{"title": str, "description": "2-3 sentences", "category": "transportation|food|energy|shopping", "co2_saved_kg": float, "money_saved": float, "xp_reward": int, "tips": [2-3 str], "mission_type": "one_time|repeatable|streak"}
+category is the area of life; mission_type is how often it can be done. Do not mix them up.""")
+
+_VALID_MISSION_TYPES = frozenset({"one_time", "repeatable", "streak"})
+_VALID_CATEGORIES = frozenset({"transportation", "food", "energy", "shopping"})
+
+# Parsed LLM missions keyed on profile, opportunities, baseline and canonical survey
+_missions_cache = TTLCache(maxsize=256, ttl=6 * 60 * 60)
+
+
 async def generate_missions(state: WorkflowState) -> WorkflowState:
     """
     Generate 8-12 personalized missions using Gemini 2.5 Flash.
     """
     
-    # Initialize Gemini model
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash-preview-09-2025",
-        api_key=settings.google_api_key,
-        temperature=0.7,
+    user_context = f"""Profile: {state.profile_type}
+Baseline CO2: {state.baseline_co2_kg} kg/month
+Top opportunities: {', '.join(state.opportunity_areas)}
+Survey: {orjson.dumps(state.survey_data).decode()}"""
+    
+    # Identical onboarding answers produce identical missions, so skip the LLM on a repeat
+    cache_key = (
+        state.profile_type,
+        tuple(sorted(state.opportunity_areas)),
+        state.baseline_co2_kg,
+        orjson.dumps(state.survey_data, option=orjson.OPT_SORT_KEYS),
     )
-    
-    # Prepare the prompt with user context
-    system_prompt = """You are an AI sustainability coach analyzing a user's onboarding survey to create a personalized carbon reduction plan.
-
-INPUT: User survey responses including transportation habits, diet, shopping behavior, energy usage, current habits, time commitment, and motivation.
-
-YOUR TASK:
-1. Generate 8-12 personalized missions that are:
-   - SPECIFIC and ACTIONABLE (not "reduce meat" but "try one meatless meal this week")
-   - FEASIBLE given their constraints (don't suggest biking if they commute 30 miles)
-   - MATCHED to time commitment (quick wins for busy users)
-   - ALIGNED with motivation (show $ savings if money-motivated)
-   - DISTRIBUTED: 60% easy (10-20 XP), 30% medium (30-50 XP), 10% challenging (60-100 XP)
-
-2. For each mission include:
-   - Title (short, clear action)
-   - Description (2-3 sentences explaining what to do)
-   - Category (transportation/food/energy/shopping)
-   - Estimated CO2 saved (kg)
-   - Money saved ($ if applicable)
-   - XP reward
-   - 2-3 helpful tips
-   - Mission type (one_time/repeatable/streak)
-
-CONSTRAINTS:
-- Never suggest extreme changes (going vegan, selling car, moving houses)
-- Respect their current situation (don't suggest meal prep if they never cook)
-- Focus on highest ROI actions for their profile
-- Make missions feel achievable, not overwhelming
-
-OUTPUT FORMAT: JSON array of mission objects.
-
-EXAMPLE GOOD MISSIONS:
-- "Unplug your phone charger before bed tonight"
-- "Try a plant-based lunch option once this week"
-- "Combine two errands into one trip"
-- "Use a reusable water bottle today"
-
-EXAMPLE BAD MISSIONS:
-- "Go vegetarian"
-- "Start biking to work"
-- "Never buy clothes again"
-- "Switch to renewable energy"
-"""
-    
-    user_context = f"""
-User Profile:
-- Profile Type: {state['profile_type']}
-- Baseline CO2: {state['baseline_co2_kg']} kg/month
-- Top Opportunities: {', '.join(state['opportunity_areas'])}
-
-Survey Responses:
-{json.dumps(state['survey_data'], indent=2)}
-
-Generate 8-12 personalized missions as a JSON array. Each mission object should have:
-{{
-  "title": "...",
-  "description": "...",
-  "category": "transportation|food|energy|shopping",  // CATEGORY = what area of life (transportation, food, etc)
-  "co2_saved_kg": 0.0,
-  "money_saved": 0.0,
-  "xp_reward": 0,
-  "tips": ["...", "...", "..."],
-  "mission_type": "one_time|repeatable|streak"  // MISSION_TYPE = how often user can do it (one_time, repeatable, streak). NOT the category!
-}}
-
-IMPORTANT: 
-- "category" must be one of: transportation, food, energy, shopping
-- "mission_type" must be one of: one_time, repeatable, streak
-- These are DIFFERENT fields! Do not confuse them!
-"""
+    cached = _missions_cache.get(cache_key)
+    if cached is not None:
+        state.missions = [dict(mission) for mission in cached]
+        state.error = None
+        return state
     
     try:
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_context)
-        ]
+        messages = [_STATIC_SYSTEM, HumanMessage(content=user_context)]
         
-        response = await llm.ainvoke(messages)
+        # Stream the response and stop reading once the JSON block is closed
+        content = ""
+        payload = None
+        async for chunk in _mission_llm.astream(messages):
+            content += chunk.content
+            if "`" not in chunk.content:
+                continue
+            payload = _extract_fenced_json(content)
+            if payload is not None:
+                break
         
-        # Parse the response
-        content = response.content
-        
-        # Extract JSON from markdown code blocks if present
-        if "```json" in content:
-            json_start = content.find("```json") + 7
-            json_end = content.find("```", json_start)
-            content = content[json_start:json_end].strip()
-        elif "```" in content:
-            json_start = content.find("```") + 3
-            json_end = content.find("```", json_start)
-            content = content[json_start:json_end].strip()
-        
-        missions = json.loads(content)
+        # Fall back to the outermost [...] if it wasn't wrapped in a code block
+        missions = orjson.loads(payload if payload is not None else _extract_json_array(content))
         
         # Validate missions
         if not isinstance(missions, list) or len(missions) < 8:
             raise ValueError("Invalid missions format or too few missions")
         
-        # Validate and sanitize each mission
-        valid_mission_types = ["one_time", "repeatable", "streak"]
-        valid_categories = ["transportation", "food", "energy", "shopping"]
+        # Sanitize each mission: bad mission_type -> "one_time", bad category -> top opportunity area
+        default_category = state.opportunity_areas[0] if state.opportunity_areas else "energy"
+        fixed_types = fixed_categories = 0
         
         for mission in missions:
-            # Ensure mission_type is valid (default to "one_time" if invalid)
-            if mission.get("mission_type") not in valid_mission_types:
-                print(f"Invalid mission_type '{mission.get('mission_type')}' for mission '{mission.get('title')}', defaulting to 'one_time'")
+            if mission.get("mission_type") not in _VALID_MISSION_TYPES:
                 mission["mission_type"] = "one_time"
-            
-            # Ensure category is valid (default to first opportunity area if invalid)
-            if mission.get("category") not in valid_categories:
-                print(f"Invalid category '{mission.get('category')}' for mission '{mission.get('title')}', defaulting to '{state['opportunity_areas'][0]}'")
-                mission["category"] = state['opportunity_areas'][0] if state['opportunity_areas'] else "energy"
+                fixed_types += 1
+            if mission.get("category") not in _VALID_CATEGORIES:
+                mission["category"] = default_category
+                fixed_categories += 1
         
-        state["missions"] = missions
-        state["error"] = None
+        if fixed_types or fixed_categories:
+            print(f"Sanitized {len(missions)} missions: {fixed_types} invalid mission_type(s) -> 'one_time', {fixed_categories} invalid category(ies) -> '{default_category}'")
+        
+        _missions_cache.set(cache_key, tuple(dict(mission) for mission in missions))
+        state.missions = missions
+        state.error = None
         
     except Exception as e:
         print(f"Error generating missions: {e}")
-        state["error"] = str(e)
+        state.error = str(e)
         # Provide fallback missions
-        state["missions"] = _generate_fallback_missions(state)
+        state.missions = _generate_fallback_missions(state)
     
     return state
 
 
+_JSON_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+
+def _extract_fenced_json(content: str) -> Optional[str]:
+    """Return the body of the first complete ```json (or ```) block, or None."""
+    match = _JSON_FENCE_RE.search(content)
+    return match.group(1).strip() if match else None
+
+
+def _extract_json_array(content: str) -> str:
+    """Slice bare model output down to its outermost JSON array."""
+    start = content.find("[")
+    end = content.rfind("]")
+    if start == -1 or end < start:
+        return content
+    return content[start:end + 1]
+
+
 def _generate_fallback_missions(state: WorkflowState) -> List[Dict[str, Any]]:
     """Generate basic fallback missions if LLM fails"""
     return [
@@ -591,15 +589,14 @@ def create_mission_workflow():
     
     # Add nodes
     workflow.add_node("calculate_co2", calculate_co2_footprint)
-    workflow.add_node("classify_profile", classify_user_profile)
-    workflow.add_node("identify_opportunities", identify_opportunities)
+    workflow.add_node("analyze", analyze_survey)
     workflow.add_node("generate_missions", generate_missions)
     
-    # Define edges (flow)
-    workflow.set_entry_point("calculate_co2")
-    workflow.add_edge("calculate_co2", "classify_profile")
-    workflow.add_edge("classify_profile", "identify_opportunities")
-    workflow.add_edge("identify_opportunities", "generate_missions")
+    # Define edges (flow): Climatiq and survey analysis are independent, so
+    # run them in parallel and join before mission generation
+    workflow.add_edge(START, "calculate_co2")
+    workflow.add_edge(START, "analyze")
+    workflow.add_edge(["calculate_co2", "analyze"], "generate_missions")
     workflow.add_edge("generate_missions", END)
     
     return workflow.compile()
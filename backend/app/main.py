@@ -1,8 +1,25 @@
+import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from app.routers import example, survey, missions, activities, receipts, shopping, impact
+from app.langgraph_workflow import close_climatiq_client
+from app.services.climatiq_service import climatiq_service
 
-app = FastAPI()
+# App loggers (receipts, shopping, Climatiq and Gemini services) log progress at DEBUG; only INFO and up is emitted by default
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:     %(name)s - %(message)s")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release pooled outbound connections on shutdown
+    await close_climatiq_client()
+    await climatiq_service.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -17,6 +34,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Mission lists repeat the same keys per item and compress well; small bodies aren't worth it
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 app.include_router(example.router)
 app.include_router(survey.router)
 app.include_router(missions.router)
@@ -1,20 +1,60 @@
 from fastapi import APIRouter, HTTPException, Header
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, timezone
 from app.database import supabase
 from app.routers.survey import get_user_id_from_token
-from langchain_google_genai import ChatGoogleGenerativeAI
+from app.routers.impact import invalidate_impact_cache
+from app.routers.missions import invalidate_profile_cache, wait_for_pending_write
+from app.services.llm import with_temperature
 from langchain_core.messages import SystemMessage, HumanMessage
 from app.config import get_settings
+from app.cache import TTLCache
+import asyncio
 import httpx
-import json
+import orjson
+import re
 
 
-from app.game_mechanics import calculate_level, get_level_threshold, get_plant_stage, calculate_xp
+from app.game_mechanics import get_level_progress, get_plant_stage, calculate_xp
 
 settings = get_settings()
 
+# Parsed Gemini results keyed on normalized activity text, so repeat inputs skip the LLM
+_activity_parse_cache = TTLCache(maxsize=2048, ttl=24 * 60 * 60)
+_NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+# Freeform submissions per (user_id, day) seen by this process; the database stays the source of truth
+_DAILY_FREEFORM_LIMIT = 20
+_daily_freeform_counts = TTLCache(maxsize=100_000, ttl=24 * 60 * 60)
+
+# Shared Gemini client so activity parses reuse one connection pool
+_activity_parser_llm = with_temperature(0.3)
+
+# Eco-action analyzer instructions; a single constant prefix so repeated calls hit Gemini's implicit prompt cache
+_ACTIVITY_PARSER_SYSTEM = SystemMessage(content="""You are an eco-action analyzer. Given a user's description of a sustainable action, 
+extract structured information.
+
+Return ONLY valid JSON with this exact structure:
+{
+  "summary": "Brief, clear description (max 50 chars)",
+  "category": "transportation|food|energy|shopping",
+  "emoji": "Appropriate emoji (🚌🥗⚡🛍️)",
+  "climatiq_estimate": {
+    "activity_type": "transportation|food|energy|shopping",
+    "details": {}
+  },
+  "confidence": 0-100
+}
+
+Examples:
+- "took the bus to work" → {"summary": "Bus commute", "category": "transportation", "emoji": "🚌", "climatiq_estimate": {"activity_type": "transportation", "details": {"mode": "bus", "distance_km": 10}}, "confidence": 90}
+- "ate a vegan lunch" → {"summary": "Plant-based meal", "category": "food", "emoji": "🥗", "climatiq_estimate": {"activity_type": "food", "details": {"meal_type": "lunch", "is_plant_based": true}}, "confidence": 85}
+
+If not an eco-friendly action, set confidence < 50.
+Return ONLY the JSON, no other text.""")
+
 router = APIRouter(
     prefix="/activities",
     tags=["activities"],
@@ -55,34 +95,42 @@ async def submit_freeform_activity(
         if len(activity_text) > 200:
             raise HTTPException(status_code=400, detail="Activity description too long (max 200 characters)")
         
-        # Check daily limit (max 20 freeform activities per day)
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        daily_count_response = supabase.table("user_activities")\
-            .select("id", count="exact")\
-            .eq("user_id", user_id)\
-            .eq("activity_type", "freeform")\
-            .gte("created_at", today_start.isoformat())\
-            .execute()
+        # Daily limit (max 20 freeform activities per day) and duplicates within 4 hours, in one query
+        now = datetime.now(timezone.utc)
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        four_hours_ago = now - timedelta(hours=4)
         
-        if daily_count_response.count and daily_count_response.count >= 20:
+        # Users already at the cap are rejected without touching the database
+        daily_key = (user_id, today_start.date())
+        if _daily_freeform_counts.get(daily_key, 0) >= _DAILY_FREEFORM_LIMIT:
             raise HTTPException(status_code=429, detail="Daily activity limit reached (20 per day)")
         
-        # Check for duplicate recent activities (within 4 hours)
-        four_hours_ago = datetime.now() - timedelta(hours=4)
-        recent_activities = supabase.table("user_activities")\
-            .select("user_input")\
-            .eq("user_id", user_id)\
-            .eq("activity_type", "freeform")\
-            .gte("created_at", four_hours_ago.isoformat())\
-            .execute()
-        
-        if recent_activities.data:
-            for activity in recent_activities.data:
-                if activity.get("user_input", "").lower() == activity_text.lower():
-                    raise HTTPException(status_code=400, detail="Similar activity already logged recently")
+        # Parse with Gemini 2.0 Flash Lite while the limit/duplicate checks run
+        gemini_task = asyncio.create_task(parse_activity_with_gemini(activity_text))
+        try:
+            status_response = await asyncio.to_thread(
+                supabase.rpc("freeform_submission_status", {
+                    "uid": user_id,
+                    "input_lower": activity_text.lower(),
+                    "day_start": today_start.isoformat(),
+                    "duplicate_since": four_hours_ago.isoformat()
+                }).execute
+            )
+            submission_status = status_response.data[0] if status_response.data else {}
+            daily_count = submission_status.get("daily_count", 0)
+            _daily_freeform_counts.set(daily_key, daily_count)
+            
+            if daily_count >= _DAILY_FREEFORM_LIMIT:
+                raise HTTPException(status_code=429, detail="Daily activity limit reached (20 per day)")
+            
+            if submission_status.get("is_duplicate"):
+                raise HTTPException(status_code=400, detail="Similar activity already logged recently")
+        except BaseException:
+            # Don't spend Gemini quota on a submission we're rejecting
+            gemini_task.cancel()
+            raise
         
-        # Parse with Gemini 2.0 Flash Lite
-        gemini_result = await parse_activity_with_gemini(activity_text)
+        gemini_result = await gemini_task
         
         if gemini_result["confidence"] < 50:
             raise HTTPException(
@@ -120,17 +168,13 @@ async def submit_freeform_activity(
             "emoji": gemini_result["emoji"],
         }
         
-        activity_response = supabase.table("user_activities").insert(activity_data).execute()
-        
-        if not activity_response.data:
-            raise HTTPException(status_code=500, detail="Failed to save activity")
-        
-        # Update user profile stats
-        await update_user_stats(user_id, xp_earned, co2_saved, 0, money_saved)
+        # Store activity and update user profile stats in one round trip
+        activity = await record_activity(user_id, activity_data)
+        _daily_freeform_counts.set(daily_key, daily_count + 1)
         
         return ActivityResponse(
             success=True,
-            activity=activity_response.data[0],
+            activity=activity,
             message=f"Great job! You earned {xp_earned} XP and saved {co2_saved:.1f}kg CO2!"
         )
         
@@ -155,11 +199,13 @@ async def complete_mission(
         user_id = get_user_id_from_token(authorization)
         
         # Get mission details
-        mission_response = supabase.table("user_missions")\
-            .select("*")\
-            .eq("id", request.mission_id)\
-            .eq("user_id", user_id)\
-            .execute()
+        mission_response = await asyncio.to_thread(
+            supabase.table("user_missions")
+            .select("title, category, xp_reward, co2_saved_kg, money_saved, status")
+            .eq("id", request.mission_id)
+            .eq("user_id", user_id)
+            .execute
+        )
         
         if not mission_response.data:
             raise HTTPException(status_code=404, detail="Mission not found")
@@ -184,26 +230,22 @@ async def complete_mission(
             "emoji": get_category_emoji(mission["category"]),
         }
         
-        activity_response = supabase.table("user_activities").insert(activity_data).execute()
+        # Store activity and update user stats
+        activity = await record_activity(user_id, activity_data, missions_completed=1)
         
         # Update mission status
-        supabase.table("user_missions")\
-            .update({"status": "completed", "completed_at": datetime.now().isoformat()})\
-            .eq("id", request.mission_id)\
-            .execute()
-        
-        # Update user stats
-        await update_user_stats(
-            user_id,
-            mission["xp_reward"],
-            mission.get("co2_saved_kg", 0),
-            1,  # missions_completed
-            mission.get("money_saved", 0)
+        await asyncio.to_thread(
+            supabase.table("user_missions")
+            .update({"status": "completed", "completed_at": datetime.now(timezone.utc).isoformat()})
+            .eq("id", request.mission_id)
+            .execute
         )
+        # Projections read the available missions, so drop any cached before the status changed
+        invalidate_impact_cache(user_id)
         
         return ActivityResponse(
             success=True,
-            activity=activity_response.data[0],
+            activity=activity,
             message=f"Mission completed! +{mission['xp_reward']} XP"
         )
         
@@ -228,18 +270,24 @@ async def get_activity_feed(
     try:
         user_id = get_user_id_from_token(authorization)
         
+        # Entries from receipt scans and completed lists are inserted after those responses
+        await wait_for_pending_write(user_id)
+        
         # Fetch activities
-        activities_response = supabase.table("user_activities")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .order("created_at", desc=True)\
-            .range(offset, offset + limit - 1)\
-            .execute()
+        activities_response = await asyncio.to_thread(
+            supabase.table("user_activities")
+            .select("id, activity_type, ai_summary, emoji, xp_earned, co2_saved_kg, money_saved, created_at", count="exact")
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .range(offset, offset + limit - 1)
+            .execute
+        )
         
         # Format activities for frontend
+        now = datetime.now(timezone.utc)
         formatted_activities = []
         for activity in activities_response.data:
-            time_ago = get_time_ago(activity["created_at"])
+            time_ago = get_time_ago(activity["created_at"], now)
             formatted_activities.append({
                 "id": activity["id"],
                 "type": activity["activity_type"],
@@ -252,10 +300,14 @@ async def get_activity_feed(
                 "created_at": activity["created_at"]
             })
         
+        # Total across all pages, returned by the same request as the rows
+        total_count = activities_response.count or 0
+        
         return {
             "success": True,
             "activities": formatted_activities,
-            "total_count": len(activities_response.data)
+            "total_count": total_count,
+            "has_more": offset + limit < total_count
         }
         
     except HTTPException:
@@ -271,54 +323,25 @@ async def parse_activity_with_gemini(user_input: str) -> Dict[str, Any]:
     """
     Use Gemini 2.0 Flash Lite to parse and categorize user activity.
     """
-    system_prompt = """You are an eco-action analyzer. Given a user's description of a sustainable action, 
-extract structured information.
-
-Return ONLY valid JSON with this exact structure:
-{
-  "summary": "Brief, clear description (max 50 chars)",
-  "category": "transportation|food|energy|shopping",
-  "emoji": "Appropriate emoji (🚌🥗⚡🛍️)",
-  "climatiq_estimate": {
-    "activity_type": "transportation|food|energy|shopping",
-    "details": {}
-  },
-  "confidence": 0-100
-}
-
-Examples:
-- "took the bus to work" → {"summary": "Bus commute", "category": "transportation", "emoji": "🚌", "climatiq_estimate": {"activity_type": "transportation", "details": {"mode": "bus", "distance_km": 10}}, "confidence": 90}
-- "ate a vegan lunch" → {"summary": "Plant-based meal", "category": "food", "emoji": "🥗", "climatiq_estimate": {"activity_type": "food", "details": {"meal_type": "lunch", "is_plant_based": true}}, "confidence": 85}
-
-If not an eco-friendly action, set confidence < 50.
-Return ONLY the JSON, no other text."""
-
     user_message = f'User input: "{user_input}"'
 
-    try:
-        # Initialize Gemini model
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-lite",
-            api_key=settings.google_api_key,
-            temperature=0.3,
-        )
+    async def invoke_gemini() -> Dict[str, Any]:
+        messages = [_ACTIVITY_PARSER_SYSTEM, HumanMessage(content=user_message)]
         
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=user_message)
-        ]
+        response = await _activity_parser_llm.ainvoke(messages)
         
-        response = await llm.ainvoke(messages)
-        result_text = response.content.strip()
+        # Take the outermost {...} so code fences or stray prose around it don't matter
+        match = _JSON_OBJECT_RE.search(response.content)
+        if not match:
+            raise ValueError("No JSON object in Gemini response")
         
-        # Clean up markdown code blocks if present
-        if result_text.startswith("```"):
-            result_text = result_text.split("```")[1]
-            if result_text.startswith("json"):
-                result_text = result_text[4:]
-        
-        result = json.loads(result_text)
-        return result
+        return orjson.loads(match.group(0))
+
+    try:
+        return await _activity_parse_cache.get_or_set(
+            _normalize_activity_text(user_input),
+            invoke_gemini
+        )
         
     except Exception as e:
         print(f"Gemini parsing error: {e}")
@@ -332,51 +355,62 @@ Return ONLY the JSON, no other text."""
         }
 
 
+def _normalize_activity_text(text: str) -> str:
+    """Lowercase and collapse punctuation/whitespace so trivially different inputs share a cache entry."""
+    return _NON_WORD_RE.sub(" ", text.lower()).strip()
+
+
+# kg CO2 per km for a car trip, and for the alternatives users log instead
+_CAR_CO2_PER_KM = 0.25
+_ALTERNATIVE_CO2_PER_KM = {
+    "bus": 0.05,
+    "bicycle": 0.0,
+    "walk": 0.0,
+    "train": 0.04,
+    "carpool": 0.125
+}
+
+
+def _transportation_co2_saved(details: Dict[str, Any]) -> float:
+    # Estimate: Car vs alternative
+    alt_emissions = _ALTERNATIVE_CO2_PER_KM.get(details.get("mode", "bus"), 0.1)
+    return (_CAR_CO2_PER_KM - alt_emissions) * details.get("distance_km", 10)
+
+
+def _food_co2_saved(details: Dict[str, Any]) -> float:
+    # Average meat meal vs plant meal
+    return 1.8 if details.get("is_plant_based", True) else 0.0
+
+
+def _energy_co2_saved(details: Dict[str, Any]) -> float:
+    # Phantom power reduction
+    return details.get("hours", 4) * 0.05
+
+
+def _shopping_co2_saved(details: Dict[str, Any]) -> float:
+    # Reusable bag, secondhand, etc.
+    return 0.5
+
+
+_CO2_SAVED_BY_ACTIVITY_TYPE = {
+    "transportation": _transportation_co2_saved,
+    "food": _food_co2_saved,
+    "energy": _energy_co2_saved,
+    "shopping": _shopping_co2_saved,
+}
+
+
 async def calculate_co2_with_climatiq(climatiq_estimate: Dict, user_id: str) -> float:
     """
     Calculate CO2 savings using Climatiq API based on activity type.
     """
-    activity_type = climatiq_estimate.get("activity_type")
-    details = climatiq_estimate.get("details", {})
-    
     # Simplified CO2 estimates (you can enhance with actual Climatiq API calls)
-    co2_saved = 0.0
-    
-    if activity_type == "transportation":
-        mode = details.get("mode", "bus")
-        distance_km = details.get("distance_km", 10)
-        
-        # Estimate: Car vs alternative
-        car_emissions_per_km = 0.25  # kg CO2
-        alternative_emissions = {
-            "bus": 0.05,
-            "bicycle": 0.0,
-            "walk": 0.0,
-            "train": 0.04,
-            "carpool": 0.125
-        }
-        
-        alt_emissions = alternative_emissions.get(mode, 0.1)
-        co2_saved = (car_emissions_per_km - alt_emissions) * distance_km
-        
-    elif activity_type == "food":
-        is_plant_based = details.get("is_plant_based", True)
-        if is_plant_based:
-            co2_saved = 1.8  # Average meat meal vs plant meal
-    
-    elif activity_type == "energy":
-        hours = details.get("hours", 4)
-        co2_saved = hours * 0.05  # Phantom power reduction
-    
-    elif activity_type == "shopping":
-        co2_saved = 0.5  # Reusable bag, secondhand, etc.
+    estimator = _CO2_SAVED_BY_ACTIVITY_TYPE.get(climatiq_estimate.get("activity_type"))
+    co2_saved = estimator(climatiq_estimate.get("details") or {}) if estimator else 0.0
     
     return max(co2_saved, 0.1)  # Minimum 0.1kg
 
 
-
-
-
 def estimate_money_saved(category: str, co2_saved_kg: float) -> float:
     """
     Estimate money saved based on category.
@@ -393,99 +427,98 @@ def estimate_money_saved(category: str, co2_saved_kg: float) -> float:
     return 0.0
 
 
+async def record_activity(user_id: str, activity_data: Dict[str, Any], missions_completed: int = 0) -> Dict[str, Any]:
+    """
+    Insert an activity and apply its XP, CO2, money and streak to the user's
+    profile atomically via the submit_activity RPC, then store the level and
+    plant stage derived from the new total. Returns the stored activity.
+    """
+    response = await asyncio.to_thread(
+        supabase.rpc("submit_activity", {
+            "uid": user_id,
+            "activity": activity_data,
+            "missions_completed": missions_completed
+        }).execute
+    )
+    
+    result = response.data
+    if not result or not result.get("activity"):
+        raise HTTPException(status_code=500, detail="Failed to save activity")
+    
+    profile = result.get("profile")
+    if profile is None:
+        print(f"No profile found for user {user_id}")
+    else:
+        # The RPC only adds to the totals; the level and plant stage come from game_mechanics
+        profile = await _apply_level_progress(user_id, profile)
+        old_level = result.get("previous_level") or 1
+        if profile["current_level"] > old_level:
+            print(f"🎉 Level up! {old_level} → {profile['current_level']}, Plant stage: {profile['plant_stage']}")
+        print(f"✅ Recorded activity for user {user_id}: XP {profile['total_xp']} (+{activity_data['xp_earned']}), Level: {profile['current_level']}")
+    
+    invalidate_impact_cache(user_id)
+    invalidate_profile_cache(user_id)
+    return result["activity"]
+
+
+async def _apply_level_progress(user_id: str, profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Store the level, XP progress and plant stage for the profile's total_xp.
+    
+    The update only applies while total_xp is still that total, so when awards
+    overlap the level written is always the one for the latest total.
+    """
+    new_level, xp_in_level, xp_to_next = get_level_progress(profile["total_xp"])
+    level_data = {
+        "current_level": new_level,
+        "xp_current_level": xp_in_level,
+        "xp_to_next_level": xp_to_next,
+        "plant_stage": get_plant_stage(new_level),
+    }
+    await asyncio.to_thread(
+        supabase.table("user_profiles")
+        .update(level_data)
+        .eq("user_id", user_id)
+        .eq("total_xp", profile["total_xp"])
+        .execute
+    )
+    return {**profile, **level_data}
+
+
 async def update_user_stats(user_id: str, xp: int, co2: float, missions: int, money: float):
     """
     Update user profile stats after activity.
+    
+    The totals and streak are added by the award_xp RPC in one locked update,
+    so awards running at the same time for one user don't lose each other's XP.
     """
     try:
-        # Get current profile
-        profile_response = supabase.table("user_profiles")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .execute()
+        response = await asyncio.to_thread(
+            supabase.rpc("award_xp", {
+                "uid": user_id,
+                "xp": xp,
+                "co2": co2,
+                "missions_completed": missions,
+                "money": money
+            }).execute
+        )
         
-        if not profile_response.data:
+        result = response.data or {}
+        profile = result.get("profile")
+        if profile is None:
             print(f"No profile found for user {user_id}")
             return
         
-        profile = profile_response.data[0]
-        
-        # Calculate new totals
-        old_total_xp = profile.get("total_xp", 0)
-        new_total_xp = old_total_xp + xp
-        new_level = calculate_level(new_total_xp)
-        old_level = profile.get("current_level", 1)
-        
-        # Calculate XP in current level
-        level_threshold = get_level_threshold(new_level)
-        xp_in_level = new_total_xp - level_threshold
-        next_level_threshold = get_level_threshold(new_level + 1)
-        xp_to_next = next_level_threshold - new_total_xp
-        
-        # Update profile
-        
-        # Calculate streak
-        today = date.today()
-        last_activity_str = profile.get("last_activity_date")
-        current_streak = profile.get("current_streak_days", 0)
-        longest_streak = profile.get("longest_streak_days", 0)
-        
-        if last_activity_str:
-            try:
-                # Handle both "YYYY-MM-DD" and full ISO timestamps if legacy data exists
-                if "T" in last_activity_str:
-                    last_activity_date = datetime.fromisoformat(last_activity_str).date()
-                else:
-                    last_activity_date = date.fromisoformat(last_activity_str)
-                    
-                if last_activity_date == today:
-                    # Already active today, streak doesn't change
-                    pass
-                elif last_activity_date == today - timedelta(days=1):
-                    # Consecutive day, increment streak
-                    current_streak += 1
-                else:
-                    # Missed a day (or more), reset streak
-                    current_streak = 1
-            except ValueError:
-                # If date format is bad, reset streak
-                current_streak = 1
-        else:
-            # First activity
-            current_streak = 1
-            
-        # Update longest streak
-        if current_streak > longest_streak:
-            longest_streak = current_streak
-            
-        # Update profile
-        update_data = {
-            "total_xp": new_total_xp,
-            "current_level": new_level,
-            "xp_current_level": xp_in_level,
-            "xp_to_next_level": xp_to_next,
-            "total_co2_saved": profile.get("total_co2_saved", 0) + co2,
-            "total_missions_completed": profile.get("total_missions_completed", 0) + missions,
-            "total_money_saved": profile.get("total_money_saved", 0) + money,
-            "last_activity_date": today.isoformat(),
-            "current_streak_days": current_streak,
-            "longest_streak_days": longest_streak,
-        }
+        profile = await _apply_level_progress(user_id, profile)
         
-        # Always update plant stage to ensure consistency with game mechanics
-        new_plant_stage = get_plant_stage(new_level)
-        update_data["plant_stage"] = new_plant_stage
+        old_level = result.get("previous_level") or 1
+        if profile["current_level"] > old_level:
+            print(f"🎉 Level up! {old_level} → {profile['current_level']}, Plant stage: {profile['plant_stage']}")
         
-        if new_level > old_level:
-            print(f"🎉 Level up! {old_level} → {new_level}, Plant stage: {new_plant_stage}")
-        
-        print(f"Updating user stats: XP {old_total_xp} → {new_total_xp} (+{xp}), Level: {new_level}, CO2: +{co2}kg")
-        
-        supabase.table("user_profiles")\
-            .update(update_data)\
-            .eq("user_id", user_id)\
-            .execute()
+        print(f"Updated user stats: XP {profile['total_xp']} (+{xp}), Level: {profile['current_level']}, CO2: +{co2}kg")
         
+        invalidate_impact_cache(user_id)
+        invalidate_profile_cache(user_id)
         print(f"✅ Successfully updated profile for user {user_id}")
         
     except Exception as e:
@@ -497,22 +530,27 @@ async def update_user_stats(user_id: str, xp: int, co2: float, missions: int, mo
 
 
 
+_CATEGORY_EMOJIS = {
+    'transportation': '🚌',
+    'food': '🥗',
+    'energy': '⚡',
+    'shopping': '🛍️',
+}
+
+
 def get_category_emoji(category: str) -> str:
     """Get emoji for category."""
-    emojis = {
-        'transportation': '🚌',
-        'food': '🥗',
-        'energy': '⚡',
-        'shopping': '🛍️',
-    }
-    return emojis.get(category, '🌱')
+    return _CATEGORY_EMOJIS.get(category, '🌱')
 
 
-def get_time_ago(timestamp_str: str) -> str:
-    """Convert timestamp to human-readable time ago."""
+def get_time_ago(timestamp_str: str, now: Optional[datetime] = None) -> str:
+    """Convert timestamp to human-readable time ago. Naive timestamps are treated as UTC."""
     try:
         timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        now = datetime.now(timestamp.tzinfo)
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        if now is None:
+            now = datetime.now(timezone.utc)
         diff = now - timestamp
         
         if diff.days > 1:
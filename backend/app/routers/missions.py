@@ -1,27 +1,140 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+import asyncio
+import logging
+import orjson
 from app.database import supabase
+from app.cache import TTLCache
 from app.langgraph_workflow import mission_workflow, WorkflowState
-from app.routers.survey import get_user_id_from_token
-from app.game_mechanics import get_plant_stage, get_plant_stage_levels, get_level_threshold, calculate_level
+from app.routers.survey import current_user_id, SurveyRequest, missing_surveys, wait_for_survey_write
+from app.routers.impact import invalidate_impact_cache
+from app.game_mechanics import get_plant_stage, get_plant_stage_name, get_plant_stage_levels, get_level_threshold, get_level_progress
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(
     prefix="/missions",
     tags=["missions"],
     responses={404: {"description": "Not found"}},
+    default_response_class=ORJSONResponse,
 )
 
+# Keep proxies (e.g. nginx) from caching or buffering the event stream so events arrive as they're sent
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Only the survey answers themselves; metadata columns (id, user_id, timestamps) aren't fetched
+_SURVEY_ANSWER_COLUMNS = ", ".join(SurveyRequest.model_fields)
+
+# user_profiles rows (or None) per user, shared by /profile and /stats
+_profile_cache = TTLCache(maxsize=4096, ttl=60)
+
+# Fully derived /stats payloads, invalidated together with the profile row
+_stats_cache = TTLCache(maxsize=4096, ttl=60)
+
+
+def invalidate_profile_cache(user_id: str) -> None:
+    """Drop a user's cached profile row and stats after the profile has been written."""
+    _profile_cache.delete(user_id)
+    _stats_cache.delete(user_id)
+
+
+class PendingWrite:
+    """A background write readers wait on; error is set if it didn't land."""
+    
+    def __init__(self):
+        self.written = asyncio.Event()
+        self.error: Optional[Exception] = None
+
+
+# Writes still running in the background (mission generations, XP rewards), so reads right after them don't race.
+# Failed generation writes stay here until the next /generate, so reads report the failure instead of old missions
+_pending_writes: Dict[str, List[PendingWrite]] = {}
+
+# Longest a read waits on one background write before going ahead without it
+_PENDING_WRITE_TIMEOUT_S = 30
+
+
+def begin_pending_write(user_id: str) -> PendingWrite:
+    """Register a background write for this user; pass it to finish_pending_write when it's done."""
+    pending = PendingWrite()
+    _pending_writes.setdefault(user_id, []).append(pending)
+    return pending
+
+
+def finish_pending_write(user_id: str, pending: PendingWrite, error: Optional[Exception] = None) -> None:
+    """
+    Release readers waiting on a write registered with begin_pending_write.
+    
+    With an error the write stays registered, so readers get a 503 until it's cleared.
+    """
+    pending.error = error
+    pending.written.set()
+    if error is not None:
+        return
+    
+    user_writes = _pending_writes.get(user_id)
+    if user_writes is not None and pending in user_writes:
+        user_writes.remove(pending)
+        if not user_writes:
+            del _pending_writes[user_id]
+
+
+def _clear_failed_writes(user_id: str) -> None:
+    """Forget failed writes for this user, once a new generation replaces them."""
+    user_writes = [pending for pending in _pending_writes.get(user_id, ()) if pending.error is None]
+    if user_writes:
+        _pending_writes[user_id] = user_writes
+    else:
+        _pending_writes.pop(user_id, None)
+
+
+async def wait_for_pending_write(user_id: str) -> None:
+    """Block until every in-flight background write for this user has landed (or timed out); 503 if one failed."""
+    for pending in list(_pending_writes.get(user_id, ())):
+        try:
+            await asyncio.wait_for(pending.written.wait(), timeout=_PENDING_WRITE_TIMEOUT_S)
+        except asyncio.TimeoutError:
+            logger.warning("Pending write for %s still running after %ss; reading without it", user_id, _PENDING_WRITE_TIMEOUT_S)
+        if pending.error is not None:
+            raise HTTPException(status_code=503, detail="Saving your missions failed, please generate them again")
+
+
+async def _get_profile(user_id: str) -> Optional[Dict[str, Any]]:
+    """Fetch a user's profile row, served from the short-lived cache when possible."""
+    await wait_for_pending_write(user_id)
+    
+    async def fetch_profile() -> Optional[Dict[str, Any]]:
+        response = await asyncio.to_thread(
+            supabase.table("user_profiles").select("*").eq("user_id", user_id).maybe_single().execute
+        )
+        # maybe_single() yields no response at all when the row doesn't exist
+        return response.data if response is not None else None
+    
+    return await _profile_cache.get_or_set(user_id, fetch_profile)
+
+
+class Mission(BaseModel):
+    title: str
+    description: str
+    category: str
+    co2_saved_kg: Optional[float] = None
+    money_saved: Optional[float] = None
+    xp_reward: int
+    mission_type: str
+    tips: List[str] = []
+
 
 class MissionGenerateResponse(BaseModel):
     success: bool
     user_profile: Dict[str, Any]
-    missions: List[Dict[str, Any]]
+    missions: List[Mission]
     message: Optional[str] = None
 
 
 @router.post("/generate", response_model=MissionGenerateResponse)
-async def generate_missions(authorization: str = Header(None)):
+async def generate_missions(background_tasks: BackgroundTasks, user_id: str = Depends(current_user_id)):
     """
     Generate personalized missions for a user based on their survey responses.
     
@@ -29,37 +142,11 @@ async def generate_missions(authorization: str = Header(None)):
     1. Get user ID from auth token
     2. Fetch survey data from Supabase
     3. Run LangGraph workflow to generate missions
-    4. Store user profile and missions in Supabase
-    5. Return results
+    4. Return results
+    5. Store user profile and missions in Supabase (background task, after the response is sent)
     """
     try:
-        # Get user ID from token
-        user_id = get_user_id_from_token(authorization)
-        
-        # Fetch survey data
-        survey_response = supabase.table("survey_responses").select("*").eq("user_id", user_id).execute()
-        
-        if not survey_response.data:
-            raise HTTPException(
-                status_code=404, 
-                detail="Survey not found. Please complete the survey first."
-            )
-        
-        survey_data = survey_response.data[0]
-        
-        # Remove metadata fields for cleaner data
-        survey_cleaned = {k: v for k, v in survey_data.items() if k not in ["id", "user_id", "created_at", "updated_at"]}
-        
-        # Initialize workflow state
-        initial_state: WorkflowState = {
-            "user_id": user_id,
-            "survey_data": survey_cleaned,
-            "baseline_co2_kg": 0.0,
-            "profile_type": "BEGINNER",
-            "opportunity_areas": [],
-            "missions": [],
-            "error": None
-        }
+        initial_state = await _load_initial_state(user_id)
         
         # Run the LangGraph workflow
         result = await mission_workflow.ainvoke(initial_state)
@@ -68,58 +155,8 @@ async def generate_missions(authorization: str = Header(None)):
             print(f"Workflow error: {result['error']}")
             # Continue with fallback missions
         
-        # Store user profile in Supabase
-        profile_data = {
-            "user_id": user_id,
-            "profile_type": result["profile_type"],
-            "baseline_co2_kg": result["baseline_co2_kg"],
-            "opportunity_areas": result["opportunity_areas"],
-            # Initialize XP and leveling
-            "total_xp": 0,
-            "current_level": 1,
-            "xp_current_level": 0,
-            "xp_to_next_level": 100,
-            # Initialize plant
-            "plant_stage": 1,
-            "plant_type": "oak",
-            # Initialize stats (will be updated as missions complete)
-            "total_co2_saved": 0.0,
-            "total_missions_completed": 0,
-            "total_money_saved": 0.0,
-            # Initialize streak
-            "current_streak_days": 0,
-            "longest_streak_days": 0
-        }
-        
-        profile_response = supabase.table("user_profiles").upsert(
-            profile_data,
-            on_conflict="user_id"
-        ).execute()
-        
-        # Store missions in Supabase
-        missions_to_insert = []
-        for mission in result["missions"]:
-            mission_data = {
-                "user_id": user_id,
-                "title": mission["title"],
-                "description": mission["description"],
-                "category": mission["category"],
-                "co2_saved_kg": mission.get("co2_saved_kg"),
-                "money_saved": mission.get("money_saved"),
-                "xp_reward": mission["xp_reward"],
-                "mission_type": mission["mission_type"],
-                "tips": mission.get("tips", []),
-                "status": "available"
-            }
-            missions_to_insert.append(mission_data)
-        
-        # Delete existing missions for this user first
-        supabase.table("user_missions").delete().eq("user_id", user_id).execute()
-        
-        # Insert new missions
-        missions_response = supabase.table("user_missions").insert(missions_to_insert).execute()
-        
-        return MissionGenerateResponse(
+        # Validate the response before registering the write, so a bad mission can't leave it pending
+        response = MissionGenerateResponse(
             success=True,
             user_profile={
                 "profile_type": result["profile_type"],
@@ -130,6 +167,17 @@ async def generate_missions(authorization: str = Header(None)):
             message="Missions generated successfully"
         )
         
+        # The response doesn't depend on the writes; readers wait on _pending_writes instead
+        _clear_failed_writes(user_id)
+        pending = begin_pending_write(user_id)
+        try:
+            background_tasks.add_task(_persist_generation, user_id, result, pending)
+        except Exception:
+            finish_pending_write(user_id, pending)
+            raise
+        
+        return response
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -142,16 +190,154 @@ async def generate_missions(authorization: str = Header(None)):
         )
 
 
+@router.post("/generate/stream")
+async def generate_missions_stream(user_id: str = Depends(current_user_id)):
+    """
+    Same as /generate, but streams Server-Sent Events as each workflow step
+    finishes so the client can show progress while Gemini runs.
+    
+    Events: {"type": "step", "node": ...} per finished node, then
+    {"type": "complete", "user_profile": ..., "missions": ...} once stored.
+    """
+    initial_state = await _load_initial_state(user_id)
+    
+    async def event_stream():
+        result = None
+        try:
+            async for mode, chunk in mission_workflow.astream(initial_state, stream_mode=["updates", "values"]):
+                if mode == "values":
+                    result = chunk
+                    continue
+                for node in chunk:
+                    yield f"data: {orjson.dumps({'type': 'step', 'node': node}).decode()}\n\n"
+            
+            if result.get("error"):
+                print(f"Workflow error: {result['error']}")
+            
+            await _store_generation(user_id, result)
+            # Stored in full, so an earlier failed /generate no longer stands
+            _clear_failed_writes(user_id)
+            
+            complete_event = {
+                "type": "complete",
+                "user_profile": {
+                    "profile_type": result["profile_type"],
+                    "baseline_co2_kg": result["baseline_co2_kg"],
+                    "opportunity_areas": result["opportunity_areas"]
+                },
+                "missions": result["missions"]
+            }
+            yield f"data: {orjson.dumps(complete_event).decode()}\n\n"
+            
+        except Exception as e:
+            print(f"Error streaming mission generation: {e}")
+            import traceback
+            traceback.print_exc()
+            yield f"data: {orjson.dumps({'type': 'error', 'message': str(e)}).decode()}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
+
+async def _load_initial_state(user_id: str) -> WorkflowState:
+    """Fetch the user's survey answers and build the workflow's starting state."""
+    await wait_for_survey_write(user_id)
+    if missing_surveys.get(user_id):
+        raise HTTPException(
+            status_code=404, 
+            detail="Survey not found. Please complete the survey first."
+        )
+    
+    survey_response = await asyncio.to_thread(
+        supabase.table("survey_responses").select(_SURVEY_ANSWER_COLUMNS).eq("user_id", user_id).maybe_single().execute
+    )
+    
+    if survey_response is None or not survey_response.data:
+        missing_surveys.set(user_id, True)
+        raise HTTPException(
+            status_code=404, 
+            detail="Survey not found. Please complete the survey first."
+        )
+    
+    return WorkflowState(user_id=user_id, survey_data=survey_response.data)
+
+
+async def _store_generation(user_id: str, result: Dict[str, Any]) -> None:
+    """Persist a finished workflow run: reset the user's profile and replace their missions."""
+    # Store user profile in Supabase
+    profile_data = {
+        "user_id": user_id,
+        "profile_type": result["profile_type"],
+        "baseline_co2_kg": result["baseline_co2_kg"],
+        "opportunity_areas": result["opportunity_areas"],
+        # Initialize XP and leveling
+        "total_xp": 0,
+        "current_level": 1,
+        "xp_current_level": 0,
+        "xp_to_next_level": 100,
+        # Initialize plant
+        "plant_stage": 1,
+        "plant_type": "oak",
+        # Initialize stats (will be updated as missions complete)
+        "total_co2_saved": 0.0,
+        "total_missions_completed": 0,
+        "total_money_saved": 0.0,
+        # Initialize streak
+        "current_streak_days": 0,
+        "longest_streak_days": 0
+    }
+    
+    # Store missions in Supabase
+    missions_to_insert = [
+        {
+            "user_id": user_id,
+            "title": mission["title"],
+            "description": mission["description"],
+            "category": mission["category"],
+            "co2_saved_kg": mission.get("co2_saved_kg"),
+            "money_saved": mission.get("money_saved"),
+            "xp_reward": mission["xp_reward"],
+            "mission_type": mission["mission_type"],
+            "tips": mission.get("tips") or [],
+            "status": "available"
+        }
+        for mission in result["missions"]
+    ]
+    
+    # Upsert the profile while atomically replacing the user's missions; the two are independent
+    await asyncio.gather(
+        asyncio.to_thread(
+            supabase.table("user_profiles").upsert(profile_data, on_conflict="user_id").execute
+        ),
+        asyncio.to_thread(
+            supabase.rpc("replace_user_missions", {
+                "p_user_id": user_id,
+                "p_missions": missions_to_insert
+            }).execute
+        )
+    )
+    invalidate_impact_cache(user_id)
+    invalidate_profile_cache(user_id)
+
+
+async def _persist_generation(user_id: str, result: Dict[str, Any], pending: PendingWrite) -> None:
+    """Background task for /generate: store the run, then release any readers waiting on it."""
+    try:
+        await _store_generation(user_id, result)
+    except Exception as e:
+        logger.exception("❌ Error storing generated missions for %s", user_id)
+        finish_pending_write(user_id, pending, e)
+    else:
+        finish_pending_write(user_id, pending)
+
 @router.get("/")
-async def get_user_missions(authorization: str = Header(None)):
+async def get_user_missions(user_id: str = Depends(current_user_id)):
     """
     Get all missions for the authenticated user.
     """
     try:
-        user_id = get_user_id_from_token(authorization)
+        await wait_for_pending_write(user_id)
         
         # Fetch missions
-        response = supabase.table("user_missions").select("*").eq("user_id", user_id).execute()
+        response = await asyncio.to_thread(supabase.table("user_missions").select("*").eq("user_id", user_id).execute)
         
         return {
             "success": True,
@@ -165,22 +351,20 @@ async def get_user_missions(authorization: str = Header(None)):
 
 
 @router.get("/profile")
-async def get_user_profile(authorization: str = Header(None)):
+async def get_user_profile(user_id: str = Depends(current_user_id)):
     """
     Get the user's profile analysis.
     """
     try:
-        user_id = get_user_id_from_token(authorization)
-        
         # Fetch profile
-        response = supabase.table("user_profiles").select("*").eq("user_id", user_id).execute()
+        profile = await _get_profile(user_id)
         
-        if not response.data:
+        if profile is None:
             raise HTTPException(status_code=404, detail="Profile not found")
         
         return {
             "success": True,
-            "profile": response.data[0]
+            "profile": profile
         }
         
     except HTTPException:
@@ -190,138 +374,158 @@ async def get_user_profile(authorization: str = Header(None)):
 
 
 @router.get("/stats")
-async def get_user_stats(authorization: str = Header(None)):
+async def get_user_stats(user_id: str = Depends(current_user_id)):
     """
     Get comprehensive user statistics for the dashboard.
     Includes XP, level, plant info, lifetime stats, and equivalents.
     """
     try:
-        user_id = get_user_id_from_token(authorization)
-        
-        # Fetch profile
-        profile_response = supabase.table("user_profiles").select("*").eq("user_id", user_id).execute()
-        
-        if not profile_response.data:
-            # Return default stats if profile doesn't exist yet
-            return {
-                "success": True,
-                "stats": {
-                    "xp": {
-                        "total_xp": 0,
-                        "current_level": 1,
-                        "xp_current_level": 0,
-                        "xp_to_next_level": 100,
-                        "level_progress_percent": 0
-                    },
-                    "plant": {
-                        "stage": 1,
-                        "type": "oak",
-                        "stage_name": "Seed",
-                        "xp_to_next_stage": 300
-                    },
-                    "impact": {
-                        "total_co2_saved": 0.0,
-                        "total_missions_completed": 0,
-                        "total_money_saved": 0.0,
-                        "current_streak_days": 0,
-                        "longest_streak_days": 0
-                    },
-                    "equivalents": {
-                        "trees_planted": 0.0,
-                        "miles_not_driven": 0.0,
-                        "led_hours": 0.0
-                    }
-                }
-            }
-        
-        profile = profile_response.data[0]
+        await wait_for_pending_write(user_id)
+        return await _stats_cache.get_or_set(user_id, lambda: _build_user_stats(user_id))
         
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error fetching stats: {e}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
 
+
+@router.get("/dashboard")
+async def get_dashboard(user_id: str = Depends(current_user_id)):
+    """
+    Get the dashboard's stats and missions in one call.
+    The profile and its missions come back from a single embedded PostgREST query.
+    """
+    try:
+        await wait_for_pending_write(user_id)
+        
+        response = await asyncio.to_thread(
+            supabase.table("user_profiles")
+            .select("*, missions(*)")
+            .eq("user_id", user_id)
+            .maybe_single()
+            .execute
+        )
         
-        # Calculate equivalents
-        co2_saved = profile.get("total_co2_saved", 0.0)
-        trees_planted = round(co2_saved / 22.0, 1)  # ~22kg CO2 per tree/year
-        miles_not_driven = round(co2_saved / 0.404, 1)  # ~0.404kg CO2 per mile
-        led_hours = round(co2_saved / 0.006, 0)  # ~0.006kg CO2 per LED hour
+        profile = response.data if response is not None else None
+        missions = (profile.pop("missions", None) or []) if profile else []
         
-        # Map plant stage to name
-        plant_stage_names = {
-            1: "Seed",
-            2: "Sprout",
-            3: "Seedling",
-            4: "Young Tree",
-            5: "Mature Tree",
-            6: "Ancient Tree",
-            7: "Forest Guardian"
+        return {
+            **_stats_from_profile(profile),
+            "missions": missions
         }
         
-        # Calculate plant stage dynamically from level (Source of Truth)
-        total_xp = profile.get("total_xp", 0)
-        
-        # Recalculate level and XP progress from scratch to ensure consistency
-        current_level = calculate_level(total_xp)
-        level_threshold = get_level_threshold(current_level)
-        next_level_threshold = get_level_threshold(current_level + 1)
-        
-        xp_current_in_level = total_xp - level_threshold
-        xp_to_next_level = next_level_threshold - total_xp
-        level_progress_percent = int((xp_current_in_level / (next_level_threshold - level_threshold)) * 100) if (next_level_threshold - level_threshold) > 0 else 0
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error fetching dashboard: {e}")
+        raise HTTPException(status_code=500, detail=f"Error fetching dashboard: {str(e)}")
 
-        
-        # Force calculation of stage to fix any DB desync
-        current_plant_stage = get_plant_stage(current_level)
-        
-        # Level thresholds for plant stages
-        plant_stage_levels = get_plant_stage_levels()
-        
-        # Find next plant stage level
-        # This returns the LAST level of the current stage
-        current_stage_end_level = plant_stage_levels.get(current_plant_stage, 999)
-        
-        # Calculate total XP needed for next stage (which starts at end_level + 1)
-        if current_stage_end_level == 999:
-             xp_to_next_plant_stage = 0
-        else:
-             target_level = current_stage_end_level + 1
-             xp_needed_total = get_level_threshold(target_level)
-             xp_to_next_plant_stage = max(0, xp_needed_total - total_xp)
-        
+
+async def _build_user_stats(user_id: str) -> Dict[str, Any]:
+    """Derive the dashboard stats payload from the user's profile row."""
+    # Fetch profile
+    profile = await _get_profile(user_id)
+    return _stats_from_profile(profile)
+
+
+def _stats_from_profile(profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the /stats payload for a profile row (or the defaults when there is none)."""
+    if profile is None:
+        # Return default stats if profile doesn't exist yet
         return {
             "success": True,
             "stats": {
                 "xp": {
-                    "total_xp": total_xp,
-                    "current_level": current_level,
-                    "xp_current_level": xp_current_in_level,
-                    "xp_to_next_level": xp_to_next_level,
-                    "level_progress_percent": level_progress_percent
+                    "total_xp": 0,
+                    "current_level": 1,
+                    "xp_current_level": 0,
+                    "xp_to_next_level": 100,
+                    "level_progress_percent": 0
                 },
                 "plant": {
-                    "stage": current_plant_stage,
-                    "type": profile.get("plant_type", "oak"),
-                    "stage_name": plant_stage_names.get(current_plant_stage, "Seed"),
-                    "xp_to_next_stage": xp_to_next_plant_stage
+                    "stage": 1,
+                    "type": "oak",
+                    "stage_name": "Seed",
+                    "xp_to_next_stage": 300
                 },
                 "impact": {
-                    "total_co2_saved": profile.get("total_co2_saved", 0.0),
-                    "total_missions_completed": profile.get("total_missions_completed", 0),
-                    "total_money_saved": profile.get("total_money_saved", 0.0),
-                    "current_streak_days": profile.get("current_streak_days", 0),
-                    "longest_streak_days": profile.get("longest_streak_days", 0)
+                    "total_co2_saved": 0.0,
+                    "total_missions_completed": 0,
+                    "total_money_saved": 0.0,
+                    "current_streak_days": 0,
+                    "longest_streak_days": 0
                 },
                 "equivalents": {
-                    "trees_planted": trees_planted,
-                    "miles_not_driven": miles_not_driven,
-                    "led_hours": led_hours
+                    "trees_planted": 0.0,
+                    "miles_not_driven": 0.0,
+                    "led_hours": 0.0
                 }
             }
         }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        print(f"Error fetching stats: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Error fetching stats: {str(e)}")
+    
+    # Calculate equivalents
+    co2_saved = profile.get("total_co2_saved", 0.0)
+    trees_planted = round(co2_saved / 22.0, 1)  # ~22kg CO2 per tree/year
+    miles_not_driven = round(co2_saved / 0.404, 1)  # ~0.404kg CO2 per mile
+    led_hours = round(co2_saved / 0.006, 0)  # ~0.006kg CO2 per LED hour
+    
+    # Calculate plant stage dynamically from level (Source of Truth)
+    total_xp = profile.get("total_xp", 0)
+    
+    # Recalculate level and XP progress from scratch to ensure consistency
+    current_level, xp_current_in_level, xp_to_next_level = get_level_progress(total_xp)
+    level_span = xp_current_in_level + xp_to_next_level
+    level_progress_percent = int((xp_current_in_level / level_span) * 100) if level_span > 0 else 0
 
+    
+    # Force calculation of stage to fix any DB desync
+    current_plant_stage = get_plant_stage(current_level)
+    
+    # Level thresholds for plant stages
+    plant_stage_levels = get_plant_stage_levels()
+    
+    # Find next plant stage level
+    # This returns the LAST level of the current stage
+    current_stage_end_level = plant_stage_levels.get(current_plant_stage, 999)
+    
+    # Calculate total XP needed for next stage (which starts at end_level + 1)
+    if current_stage_end_level == 999:
+         xp_to_next_plant_stage = 0
+    else:
+         target_level = current_stage_end_level + 1
+         xp_needed_total = get_level_threshold(target_level)
+         xp_to_next_plant_stage = max(0, xp_needed_total - total_xp)
+    
+    return {
+        "success": True,
+        "stats": {
+            "xp": {
+                "total_xp": total_xp,
+                "current_level": current_level,
+                "xp_current_level": xp_current_in_level,
+                "xp_to_next_level": xp_to_next_level,
+                "level_progress_percent": level_progress_percent
+            },
+            "plant": {
+                "stage": current_plant_stage,
+                "type": profile.get("plant_type", "oak"),
+                "stage_name": get_plant_stage_name(current_plant_stage),
+                "xp_to_next_stage": xp_to_next_plant_stage
+            },
+            "impact": {
+                "total_co2_saved": profile.get("total_co2_saved", 0.0),
+                "total_missions_completed": profile.get("total_missions_completed", 0),
+                "total_money_saved": profile.get("total_money_saved", 0.0),
+                "current_streak_days": profile.get("current_streak_days", 0),
+                "longest_streak_days": profile.get("longest_streak_days", 0)
+            },
+            "equivalents": {
+                "trees_planted": trees_planted,
+                "miles_not_driven": miles_not_driven,
+                "led_hours": led_hours
+            }
+        }
+    }
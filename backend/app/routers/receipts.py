@@ -1,13 +1,25 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from typing import List, Dict, Any
+from datetime import datetime, timezone
+import asyncio
+import bisect
+import logging
+import uuid
 from app.database import supabase
-from app.routers.survey import get_user_id_from_token
+from app.cache import TTLCache
+from app.routers.survey import current_user_id
+from app.routers.activities import update_user_stats
+from app.routers.missions import PendingWrite, begin_pending_write, finish_pending_write
 from app.services.gemini_receipt_parser import gemini_receipt_parser
 from app.services.climatiq_service import climatiq_service
 from app.services.gemini_alternatives import gemini_alternatives_service
 
+logger = logging.getLogger(__name__)
+
+# /details payloads per (user_id, receipt_id); scans and their items aren't modified after creation
+_receipt_details_cache = TTLCache(maxsize=10_000, ttl=60)
+
 router = APIRouter(
     prefix="/receipts",
     tags=["receipts"],
@@ -31,7 +43,7 @@ class SaveCommitmentsRequest(BaseModel):
 @router.post("/scan")
 async def scan_receipt(
     request: ScanReceiptRequest,
-    authorization: str = Header(None)
+    user_id: str = Depends(current_user_id)
 ):
     """
     Scan a receipt image using Google Cloud Vision API
@@ -39,16 +51,15 @@ async def scan_receipt(
     Returns:
         receipt_scan_id and extracted items
     """
-    print("=== Starting receipt scan ===")
+    logger.info("=== Starting receipt scan ===")
     
     try:
-        user_id = get_user_id_from_token(authorization)
-        print(f"User ID: {user_id}")
+        logger.debug("User ID: %s", user_id)
         
         # Extract text from receipt using Vision API
-        print("Calling Gemini to parse receipt image")
+        logger.debug("Calling Gemini to parse receipt image")
         extracted_data = await gemini_receipt_parser.parse_receipt(request.image_base64)
-        print(f"Gemini parsing completed: {len(extracted_data['items'])} items found")
+        logger.debug("Gemini parsing completed: %s items found", len(extracted_data['items']))
         
         # Create receipt scan record
         receipt_data = {
@@ -60,18 +71,18 @@ async def scan_receipt(
             "xp_earned": 50  # Base XP for scanning
         }
         
-        print("Creating receipt_scans record in database")
-        receipt_response = supabase.table("receipt_scans").insert(receipt_data).execute()
+        logger.debug("Creating receipt_scans record in database")
+        receipt_response = await asyncio.to_thread(supabase.table("receipt_scans").insert(receipt_data).execute)
         
         if not receipt_response.data:
-            print("Failed to create receipt scan record")
+            logger.warning("Failed to create receipt scan record")
             raise HTTPException(status_code=500, detail="Failed to save receipt scan")
         
         receipt_scan = receipt_response.data[0]
         receipt_scan_id = receipt_scan["id"]
         
-        print(f"Receipt scan created with ID: {receipt_scan_id}")
-        print("=== Receipt scan complete ===")
+        logger.debug("Receipt scan created with ID: %s", receipt_scan_id)
+        logger.info("=== Receipt scan complete ===")
         
         return {
             "success": True,
@@ -85,14 +96,14 @@ async def scan_receipt(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in receipt scan: {str(e)}")
+        logger.error("❌ Error in receipt scan: %s", e)
         raise HTTPException(status_code=500, detail=f"Error scanning receipt: {str(e)}")
 
 
 @router.post("/analyze")
 async def analyze_receipt(
     request: AnalyzeReceiptRequest,
-    authorization: str = Header(None)
+    user_id: str = Depends(current_user_id)
 ):
     """
     Analyze receipt items for carbon footprint and alternatives
@@ -104,17 +115,17 @@ async def analyze_receipt(
     4. Calculate total CO2 and comparison metric
     5. Award XP to user
     """
-    print(f"=== Starting receipt analysis for {request.receipt_scan_id} ===")
+    logger.info("=== Starting receipt analysis for %s ===", request.receipt_scan_id)
     
     try:
-        user_id = get_user_id_from_token(authorization)
-        
         # Get receipt scan record
-        receipt_response = supabase.table("receipt_scans")\
-            .select("*")\
-            .eq("id", request.receipt_scan_id)\
-            .eq("user_id", user_id)\
-            .execute()
+        receipt_response = await asyncio.to_thread(
+            supabase.table("receipt_scans")
+            .select("*")
+            .eq("id", request.receipt_scan_id)
+            .eq("user_id", user_id)
+            .execute
+        )
         
         if not receipt_response.data:
             raise HTTPException(status_code=404, detail="Receipt scan not found")
@@ -125,7 +136,7 @@ async def analyze_receipt(
         # For now, we'll need the items to be sent in the request
         # Let's modify this to accept items in the request
         
-        print("Receipt analysis complete - this endpoint needs items data")
+        logger.debug("Receipt analysis complete - this endpoint needs items data")
         
         # Return placeholder for now
         return {
@@ -136,7 +147,7 @@ async def analyze_receipt(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in receipt analysis: {str(e)}")
+        logger.error("❌ Error in receipt analysis: %s", e)
         raise HTTPException(status_code=500, detail=f"Error analyzing receipt: {str(e)}")
 
 
@@ -144,157 +155,108 @@ async def analyze_receipt(
 @router.post("/scan-and-analyze")
 async def scan_and_analyze_receipt(
     request: ScanReceiptRequest,
-    authorization: str = Header(None)
+    background_tasks: BackgroundTasks,
+    user_id: str = Depends(current_user_id)
 ):
     """
     Complete receipt processing: scan, analyze, and return full results
     """
-    print("=== Starting full receipt scan and analysis ===")
+    logger.info("=== Starting full receipt scan and analysis ===")
     
     try:
-        user_id = get_user_id_from_token(authorization)
-        print(f"User ID: {user_id}")
+        logger.debug("User ID: %s", user_id)
         
         # Step 1: Extract text from receipt using Gemini
-        print("Step 1: Calling Gemini to parse receipt image")
+        logger.debug("Step 1: Calling Gemini to parse receipt image")
         extracted_data = await gemini_receipt_parser.parse_receipt(request.image_base64)
-        print(f"Gemini parsing completed: {len(extracted_data['items'])} items found")
+        logger.debug("Gemini parsing completed: %s items found", len(extracted_data['items']))
         
         if not extracted_data["items"]:
             raise HTTPException(status_code=400, detail="No items found on receipt")
         
-        # Step 2: Create receipt scan record
-        print("Step 2: Creating receipt_scans record")
+        # Step 2: Reserve the receipt scan ID; the row is written once its totals are known
+        receipt_scan_id = str(uuid.uuid4())
+        logger.debug("Step 2: Receipt scan ID: %s", receipt_scan_id)
+        
+        # Step 3: Analyze each distinct item once; duplicate lines on the receipt share the result.
+        # Gemini lookups are bounded by _item_analysis_slots
+        distinct_names = {}
+        for item in extracted_data["items"]:
+            distinct_names.setdefault(item["name"].strip().lower(), item["name"])
+        logger.debug("Step 3: Analyzing %s items (%s distinct)", len(extracted_data['items']), len(distinct_names))
+        
+        # Carbon for every distinct item in one batch, then impact level + alternatives per item
+        item_names = list(distinct_names.values())
+        carbon_by_item = await climatiq_service.calculate_items_carbon(item_names, "food")
+        analyses = await asyncio.gather(*(
+            analyze_item_name(item_name, carbon_kg, idx, len(item_names))
+            for idx, (item_name, carbon_kg) in enumerate(zip(item_names, carbon_by_item))
+        ))
+        analysis_by_name = dict(zip(distinct_names, analyses))
+        
+        results = [
+            receipt_item_row(receipt_scan_id, item, analysis_by_name[item["name"].strip().lower()])
+            for item in extracted_data["items"]
+        ]
+        
+        total_co2 = sum(carbon_kg for carbon_kg, _ in results)
+        logger.debug("Step 4: All items analyzed. Total CO2: %s kg", total_co2)
+        
+        # Check previous commitments for every suggested alternative at once
+        previous_commitments = await find_previous_commitments(
+            user_id,
+            [item_data["alternative_name"] for _, item_data in results if item_data["has_alternative"]]
+        )
+        logger.debug("Previous commitments matched: %s", len(previous_commitments))
+        
+        # Step 4: Get comparison metric (computed locally, no API call)
+        logger.debug("Step 5: Getting comparison metric")
+        comparison_metric = climatiq_service.get_comparison_metric(total_co2)
+        logger.debug("Comparison: %s", comparison_metric)
+        
+        # Step 5: Create the receipt scan with its totals and all of its items in one transaction
+        logger.debug("Step 6: Saving receipt scan and items")
         receipt_data = {
+            "id": receipt_scan_id,
             "user_id": user_id,
             "store_name": extracted_data.get("store_name"),
             "scan_date": extracted_data.get("scan_date"),
             "total_items": len(extracted_data["items"]),
+            "total_co2_kg": round(total_co2, 2),
+            "comparison_metric": comparison_metric,
             "xp_earned": 50  # Base XP
         }
         
-        receipt_response = supabase.table("receipt_scans").insert(receipt_data).execute()
-        receipt_scan = receipt_response.data[0]
-        receipt_scan_id = receipt_scan["id"]
-        print(f"Receipt scan created: {receipt_scan_id}")
-        
-        # Step 3: Analyze each item
-        print(f"Step 3: Analyzing {len(extracted_data['items'])} items")
-        analyzed_items = []
-        total_co2 = 0.0
-        
-        for idx, item in enumerate(extracted_data["items"]):
-            print(f"Analyzing item {idx + 1}/{len(extracted_data['items'])}: {item['name']}")
-            
-            # Calculate carbon footprint with Climatiq
-            print(f"  -> Calling Climatiq API for carbon calculation")
-            carbon_kg = await climatiq_service.calculate_item_carbon(
-                item["name"],
-                "food"  # Category
-            )
-            print(f"  -> Carbon footprint: {carbon_kg} kg CO2")
-            
-            total_co2 += carbon_kg
-            
-            # Determine impact level
-            if carbon_kg >= 10:
-                impact_level = "high"
-            elif carbon_kg >= 2:
-                impact_level = "medium"
-            else:
-                impact_level = "low"
-            
-            # Get sustainable alternative from Gemini
-            print(f"  -> Calling Gemini API for alternative suggestion")
-            alternative = await gemini_alternatives_service.get_sustainable_alternative(
-                item["name"],
-                carbon_kg
-            )
-            print(f"  -> Alternative: {alternative.get('alternative_name', 'None')}")
-            
-            has_alternative = alternative.get("alternative_name") is not None
-            
-            # Check previous commitments for this alternative
-            commitment_check = None
-            if has_alternative:
-                print(f"  -> Checking previous commitments")
-                commitment_check = await check_previous_commitment(
-                    user_id,
-                    alternative["alternative_name"]
+        items_response = await asyncio.to_thread(
+            supabase.rpc("create_receipt_scan", {
+                "p_scan": receipt_data,
+                "p_items": [item_data for _, item_data in results]
+            }).execute
+        )
+        analyzed_items = [
+            {
+                **stored_item,
+                "had_previous_commitment": (
+                    previous_commitments.get(alternative_key(stored_item["alternative_name"]))
+                    if stored_item["has_alternative"] else None
                 )
-                print(f"  -> Previous commitment: {commitment_check}")
-            
-            # Store item in database
-            item_data = {
-                "receipt_scan_id": receipt_scan_id,
-                "item_name": item["name"],
-                "price": item.get("price"),
-                "carbon_footprint_kg": round(carbon_kg, 2),
-                "impact_level": impact_level,
-                "has_alternative": has_alternative,
-                "alternative_name": alternative.get("alternative_name"),
-                "alternative_carbon_kg": alternative.get("alternative_carbon_kg"),
-                "carbon_savings_percent": alternative.get("carbon_savings_percent"),
-                "price_difference": None,  # Gemini won't provide specific amounts
-                "alternative_note": alternative.get("note")
             }
-            
-            item_response = supabase.table("receipt_items").insert(item_data).execute()
-            stored_item = item_response.data[0]
-            
-            # Add to results
-            analyzed_items.append({
-                **stored_item,
-                "had_previous_commitment": commitment_check
-            })
-        
-        print(f"Step 4: All items analyzed. Total CO2: {total_co2} kg")
-        
-        # Step 4: Get comparison metric from Climatiq
-        print("Step 5: Getting comparison metric")
-        comparison_metric = await climatiq_service.get_comparison_metric(total_co2)
-        print(f"Comparison: {comparison_metric}")
-        
-        # Step 5: Update receipt scan with totals
-        print("Step 6: Updating receipt scan with totals")
-        update_data = {
-            "total_co2_kg": round(total_co2, 2),
-            "comparison_metric": comparison_metric
-        }
-        
-        supabase.table("receipt_scans")\
-            .update(update_data)\
-            .eq("id", receipt_scan_id)\
-            .execute()
-        
-        # Step 6: Award XP to user
-        print("Step 7: Awarding XP to user profile")
-        await award_receipt_xp(user_id, 50)  # Base XP for scanning
-        print("XP awarded successfully")
-        
-        # Step 7: Log activity to feed
-        print("Step 8: Logging activity to feed")
-        activity_data = {
-            "user_id": user_id,
-            "activity_type": "freeform",
-            "user_input": f"🧾 Scanned receipt from {extracted_data.get('store_name', 'store')}",
-            "ai_summary": f"Scanned {len(analyzed_items)} items and analyzed carbon footprint",
-            "detected_category": "shopping",
-            "xp_earned": 50,
-            "co2_saved_kg": 0,
-            "money_saved": None,
-            "emoji": "🧾",
-        }
-        supabase.table("user_activities").insert(activity_data).execute()
-        print("Activity logged successfully")
-        
-        # Check if user completed previous commitments for bonus XP
-        commitment_bonus_awarded = await check_and_award_commitment_bonus(
+            for stored_item in items_response.data
+        ]
+        
+        # Step 6: Award XP, log the activity and settle commitment bonuses after responding.
+        # The bonus is awarded whenever an item matched a previous commitment, so it's known now.
+        # Stats, profile and feed reads wait on the pending write until the rewards have landed
+        commitment_bonus_awarded = any(item["had_previous_commitment"] for item in analyzed_items)
+        background_tasks.add_task(
+            finalize_receipt_rewards,
             user_id,
-            analyzed_items
+            extracted_data.get("store_name", "store"),
+            analyzed_items,
+            begin_pending_write(user_id)
         )
         
-        print("=== Receipt scan and analysis complete ===")
+        logger.info("=== Receipt scan and analysis complete ===")
         
         return {
             "success": True,
@@ -312,28 +274,28 @@ async def scan_and_analyze_receipt(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in receipt scan and analysis: {str(e)}")
+        logger.error("❌ Error in receipt scan and analysis: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing receipt: {str(e)}")
 
 
 @router.get("/history")
 async def get_receipt_history(
-    authorization: str = Header(None),
+    user_id: str = Depends(current_user_id),
     limit: int = 10
 ):
     """
     Get user's recent receipt scans
     """
     try:
-        user_id = get_user_id_from_token(authorization)
-        
         # Fetch receipt scans
-        receipts_response = supabase.table("receipt_scans")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .order("created_at", desc=True)\
-            .limit(limit)\
-            .execute()
+        receipts_response = await asyncio.to_thread(
+            supabase.table("receipt_scans")
+            .select("*")
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .limit(limit)
+            .execute
+        )
         
         return {
             "success": True,
@@ -343,104 +305,110 @@ async def get_receipt_history(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error fetching receipt history: {str(e)}")
+        logger.error("❌ Error fetching receipt history: %s", e)
         raise HTTPException(status_code=500, detail=f"Error fetching history: {str(e)}")
 
 
 @router.get("/{receipt_id}/details")
 async def get_receipt_details(
     receipt_id: str,
-    authorization: str = Header(None)
+    user_id: str = Depends(current_user_id)
 ):
     """
     Get detailed information about a specific receipt including all items
     """
     try:
-        user_id = get_user_id_from_token(authorization)
-        
-        # Get receipt
-        receipt_response = supabase.table("receipt_scans")\
-            .select("*")\
-            .eq("id", receipt_id)\
-            .eq("user_id", user_id)\
-            .execute()
-        
-        if not receipt_response.data:
-            raise HTTPException(status_code=404, detail="Receipt not found")
-        
-        receipt = receipt_response.data[0]
-        
-        # Get all items for this receipt
-        items_response = supabase.table("receipt_items")\
-            .select("*")\
-            .eq("receipt_scan_id", receipt_id)\
-            .execute()
-        
-        return {
-            "success": True,
-            "receipt": receipt,
-            "items": items_response.data
-        }
+        return await _receipt_details_cache.get_or_set(
+            (user_id, receipt_id),
+            lambda: _fetch_receipt_details(user_id, receipt_id)
+        )
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error fetching receipt details: {str(e)}")
+        logger.error("❌ Error fetching receipt details: %s", e)
         raise HTTPException(status_code=500, detail=f"Error fetching details: {str(e)}")
 
 
+async def _fetch_receipt_details(user_id: str, receipt_id: str) -> Dict[str, Any]:
+    """Load a receipt and its items for /details"""
+    # Get receipt with all of its items embedded (one PostgREST query via the receipt_scan_id FK)
+    receipt_response = await asyncio.to_thread(
+        supabase.table("receipt_scans")
+        .select("*, receipt_items(*)")
+        .eq("id", receipt_id)
+        .eq("user_id", user_id)
+        .maybe_single()
+        .execute
+    )
+    
+    if receipt_response is None or not receipt_response.data:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    
+    receipt = receipt_response.data
+    items = receipt.pop("receipt_items", None) or []
+    
+    return {
+        "success": True,
+        "receipt": receipt,
+        "items": items
+    }
+
+
 @router.post("/commitments")
 async def save_commitments(
     request: SaveCommitmentsRequest,
-    authorization: str = Header(None)
+    user_id: str = Depends(current_user_id)
 ):
     """
     Save user commitments to try sustainable alternatives
     Awards bonus XP if 3+ commitments made
     """
-    print(f"=== Saving commitments for receipt {request.receipt_scan_id} ===")
+    logger.info("=== Saving commitments for receipt %s ===", request.receipt_scan_id)
     
     try:
-        user_id = get_user_id_from_token(authorization)
-        print(f"User {user_id} saving {len(request.commitments)} commitments")
+        logger.debug("User %s saving %s commitments", user_id, len(request.commitments))
         
         # Validate receipt belongs to user
-        receipt_response = supabase.table("receipt_scans")\
-            .select("id")\
-            .eq("id", request.receipt_scan_id)\
-            .eq("user_id", user_id)\
-            .execute()
+        receipt_response = await asyncio.to_thread(
+            supabase.table("receipt_scans")
+            .select("id")
+            .eq("id", request.receipt_scan_id)
+            .eq("user_id", user_id)
+            .execute
+        )
         
         if not receipt_response.data:
             raise HTTPException(status_code=404, detail="Receipt not found")
         
-        # Save each commitment
-        commitments_saved = 0
-        for commitment_data in request.commitments:
-            commitment = {
+        # Save all commitments in one insert
+        commitments = [
+            {
                 "user_id": user_id,
                 "receipt_scan_id": request.receipt_scan_id,
                 "item_id": commitment_data["item_id"],
                 "commitment_text": commitment_data["commitment_text"],
                 "is_completed": False
             }
-            
-            print(f"Saving commitment: {commitment['commitment_text']}")
-            supabase.table("user_commitments").insert(commitment).execute()
-            commitments_saved += 1
+            for commitment_data in request.commitments
+        ]
         
-        print(f"Successfully saved {commitments_saved} commitments")
+        if commitments:
+            await asyncio.to_thread(supabase.table("user_commitments").insert(commitments).execute)
+        commitments_saved = len(commitments)
+        
+        logger.debug("Successfully saved %s commitments", commitments_saved)
         
         # Award bonus XP if 3+ commitments
         bonus_xp_awarded = False
         if commitments_saved >= 3:
-            print("3+ commitments made, awarding bonus XP")
+            logger.debug("3+ commitments made, awarding bonus XP")
             await award_receipt_xp(user_id, 50)  # Bonus XP
             bonus_xp_awarded = True
-            print("Bonus XP awarded")
+            logger.debug("Bonus XP awarded")
         
         # Log commitment activity to feed
-        print("Logging commitment activity to feed")
+        logger.debug("Logging commitment activity to feed")
         activity_data = {
             "user_id": user_id,
             "activity_type": "freeform",
@@ -452,10 +420,10 @@ async def save_commitments(
             "money_saved": None,
             "emoji": "🌱",
         }
-        supabase.table("user_activities").insert(activity_data).execute()
-        print("Commitment activity logged successfully")
+        await asyncio.to_thread(supabase.table("user_activities").insert(activity_data).execute)
+        logger.debug("Commitment activity logged successfully")
         
-        print("=== Commitments saved successfully ===")
+        logger.info("=== Commitments saved successfully ===")
         
         return {
             "success": True,
@@ -467,33 +435,129 @@ async def save_commitments(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error saving commitments: {str(e)}")
+        logger.error("❌ Error saving commitments: %s", e)
         raise HTTPException(status_code=500, detail=f"Error saving commitments: {str(e)}")
 
 
 # Helper Functions
 
-async def check_previous_commitment(user_id: str, alternative_name: str) -> Optional[Dict]:
+# kg CO2 at which an item becomes medium / high impact
+_IMPACT_THRESHOLDS = (2.0, 10.0)
+_IMPACT_LEVELS = ("low", "medium", "high")
+
+# Stand-in for the Gemini suggestion on low-impact items (same shape, no alternative)
+_LOW_IMPACT_ALTERNATIVE = {
+    "alternative_name": None,
+    "alternative_carbon_kg": None,
+    "carbon_savings_percent": None,
+    "price_note": None,
+    "note": "Already a low-carbon choice - nice pick!"
+}
+
+# Caps in-flight per-item Gemini work across all receipts to respect upstream rate limits
+_item_analysis_slots = asyncio.Semaphore(8)
+
+
+async def analyze_item_name(
+    item_name: str,
+    carbon_kg: float,
+    idx: int,
+    total_items: int
+) -> tuple[float, str, Dict[str, Any]]:
+    """
+    Analyze one distinct receipt item given its carbon footprint: impact level and suggested alternative
+    
+    Returns:
+        (carbon_kg, impact_level, alternative)
     """
-    Check if user has previously committed to this alternative
+    async with _item_analysis_slots:
+        logger.debug("Analyzing item %s/%s: %s (%s kg CO2)", idx + 1, total_items, item_name, carbon_kg)
+        
+        # Determine impact level
+        impact_level = _IMPACT_LEVELS[bisect.bisect_right(_IMPACT_THRESHOLDS, carbon_kg)]
+        
+        # Low-impact items have nothing meaningfully greener to swap to, so skip Gemini for them
+        if impact_level == "low":
+            return carbon_kg, impact_level, _LOW_IMPACT_ALTERNATIVE
+        
+        # Get sustainable alternative from Gemini (the prompt needs carbon_kg)
+        logger.debug("  -> Calling Gemini API for alternative suggestion")
+        alternative = await gemini_alternatives_service.get_sustainable_alternative(
+            item_name,
+            carbon_kg
+        )
+        logger.debug("  -> Alternative: %s", alternative.get('alternative_name', 'None'))
+    
+    return carbon_kg, impact_level, alternative
+
+
+def receipt_item_row(
+    receipt_scan_id: str,
+    item: Dict[str, Any],
+    analysis: tuple[float, str, Dict[str, Any]]
+) -> tuple[float, Dict[str, Any]]:
+    """
+    Build the receipt_items row for one receipt line from its item's analysis
+    
+    Returns:
+        (carbon_kg, receipt_items row to insert)
+    """
+    carbon_kg, impact_level, alternative = analysis
+    has_alternative = alternative.get("alternative_name") is not None
+    
+    # Row for receipt_items (inserted with the rest of the receipt by the caller)
+    item_data = {
+        "receipt_scan_id": receipt_scan_id,
+        "item_name": item["name"],
+        "price": item.get("price"),
+        "carbon_footprint_kg": round(carbon_kg, 2),
+        "impact_level": impact_level,
+        "has_alternative": has_alternative,
+        "alternative_name": alternative.get("alternative_name"),
+        "alternative_carbon_kg": alternative.get("alternative_carbon_kg"),
+        "carbon_savings_percent": alternative.get("carbon_savings_percent"),
+        "price_difference": None,  # Gemini won't provide specific amounts
+        "alternative_note": alternative.get("note")
+    }
+    
+    return carbon_kg, item_data
+
+
+def alternative_key(alternative_name: str) -> str:
+    """Normalize an alternative name the same way user_commitments.alternative_key is stored"""
+    return alternative_name.strip().lower()
+
+
+async def find_previous_commitments(user_id: str, alternative_names: List[str]) -> Dict[str, Dict]:
+    """
+    Find the user's most recent commitment for each of these alternatives in one query
+    
+    Returns:
+        Dict of alternative_key -> newest matching commitment (alternatives without one are omitted)
     """
+    keys = list({alternative_key(name) for name in alternative_names})
+    if not keys:
+        return {}
+    
     try:
-        # Query commitments for this alternative
-        commitment_response = supabase.table("user_commitments")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .ilike("commitment_text", f"%{alternative_name}%")\
-            .order("created_at", desc=True)\
-            .limit(1)\
-            .execute()
-        
-        if commitment_response.data:
-            return commitment_response.data[0]
-        return None
+        commitment_response = await asyncio.to_thread(
+            supabase.table("user_commitments")
+            .select("*")
+            .eq("user_id", user_id)
+            .in_("alternative_key", keys)
+            .order("created_at", desc=True)
+            .execute
+        )
+        
+        # Rows are newest first, so keep the first one seen per key
+        commitments = {}
+        for commitment in commitment_response.data:
+            commitments.setdefault(commitment["alternative_key"], commitment)
+        return commitments
         
     except Exception as e:
-        print(f"❌ Error checking previous commitment: {e}")
-        return None
+        logger.error("❌ Error checking previous commitments: %s", e)
+        return {}
 
 
 async def check_and_award_commitment_bonus(user_id: str, items: List[Dict]) -> bool:
@@ -501,43 +565,76 @@ async def check_and_award_commitment_bonus(user_id: str, items: List[Dict]) -> b
     Check if user followed through on commitments and award bonus XP
     """
     try:
-        bonus_awarded = False
-        
-        for item in items:
-            if item.get("had_previous_commitment"):
-                # User committed to this alternative before and now bought it!
-                commitment = item["had_previous_commitment"]
-                
-                # Mark commitment as completed
-                supabase.table("user_commitments")\
-                    .update({"is_completed": True, "completed_at": datetime.now().isoformat()})\
-                    .eq("id", commitment["id"])\
-                    .execute()
-                
-                # Award bonus XP (once per receipt)
-                if not bonus_awarded:
-                    print(f"User followed through on commitment! Awarding bonus XP")
-                    await award_receipt_xp(user_id, 50)
-                    bonus_awarded = True
-        
-        return bonus_awarded
+        # Commitments the user committed to before and has now bought (several items can share one)
+        completed_ids = list({
+            item["had_previous_commitment"]["id"]
+            for item in items
+            if item.get("had_previous_commitment")
+        })
+        
+        if not completed_ids:
+            return False
+        
+        # Mark them all completed in one update and award the bonus XP (once per receipt)
+        logger.debug("User followed through on %s commitment(s)! Awarding bonus XP", len(completed_ids))
+        completed_at = datetime.now(timezone.utc).isoformat()
+        await asyncio.gather(
+            asyncio.to_thread(
+                supabase.table("user_commitments")
+                .update({"is_completed": True, "completed_at": completed_at})
+                .in_("id", completed_ids)
+                .execute
+            ),
+            award_receipt_xp(user_id, 50)
+        )
+        return True
         
     except Exception as e:
-        print(f"❌ Error checking commitment bonus: {e}")
+        logger.error("❌ Error checking commitment bonus: %s", e)
         return False
 
 
+async def finalize_receipt_rewards(user_id: str, store_name: str, analyzed_items: List[Dict], pending: PendingWrite):
+    """
+    Post-response side effects of a receipt scan: base XP, activity feed entry, commitment bonus
+    
+    Releases readers waiting on the user's pending write once everything has landed.
+    """
+    try:
+        logger.debug("Awarding receipt XP and logging activity to feed")
+        activity_data = {
+            "user_id": user_id,
+            "activity_type": "freeform",
+            "user_input": f"🧾 Scanned receipt from {store_name}",
+            "ai_summary": f"Scanned {len(analyzed_items)} items and analyzed carbon footprint",
+            "detected_category": "shopping",
+            "xp_earned": 50,
+            "co2_saved_kg": 0,
+            "money_saved": None,
+            "emoji": "🧾",
+        }
+        await asyncio.gather(
+            award_receipt_xp(user_id, 50),  # Base XP for scanning
+            asyncio.to_thread(supabase.table("user_activities").insert(activity_data).execute)
+        )
+        
+        # Check if user completed previous commitments for bonus XP
+        await check_and_award_commitment_bonus(user_id, analyzed_items)
+        
+    except Exception as e:
+        logger.error("❌ Error finalizing receipt rewards: %s", e)
+    finally:
+        finish_pending_write(user_id, pending)
+
+
 async def award_receipt_xp(user_id: str, xp_amount: int):
     """
     Award XP to user profile for receipt scanning
     """
     try:
-        # Import the helper from activities router
-        from app.routers.activities import update_user_stats
-        
         # Award XP (0 CO2, 0 missions, 0 money since those are tracked separately)
         await update_user_stats(user_id, xp_amount, 0, 0, 0)
         
     except Exception as e:
-        print(f"❌ Error awarding XP: {e}")
+        logger.error("❌ Error awarding XP: %s", e)
         raise
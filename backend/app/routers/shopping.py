@@ -1,12 +1,22 @@
-import json
-from fastapi import APIRouter, HTTPException, Header
+import orjson
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any
 from datetime import datetime
 from app.database import supabase
-from app.routers.survey import get_user_id_from_token
+from app.routers.survey import current_user_id
+from app.routers.activities import update_user_stats
+from app.routers.missions import PendingWrite, begin_pending_write, finish_pending_write
 from app.services.shopping_agent import shopping_agent
 
+logger = logging.getLogger(__name__)
+
+# Keep proxies (e.g. nginx) from caching or buffering the event stream so events arrive as they're sent
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
 router = APIRouter(
     prefix="/shopping",
     tags=["shopping"],
@@ -25,20 +35,16 @@ class SaveListRequest(BaseModel):
 @router.post("/generate-list")
 async def generate_shopping_list(
     request: GenerateListRequest,
-    authorization: str = Header(None)
+    user_id: str = Depends(current_user_id)
 ):
     """
     Generate a personalized shopping list using the AI agent with streaming
     """
-    from fastapi.responses import StreamingResponse
-    import asyncio
-    
-    print("🛒 === Starting shopping list generation (STREAMING) ===")
+    logger.info("🛒 === Starting shopping list generation (STREAMING) ===")
     
     try:
-        user_id = get_user_id_from_token(authorization)
-        print(f"User ID: {user_id}")
-        print(f"User input: {request.user_input}")
+        logger.debug("User ID: %s", user_id)
+        logger.debug("User input: %s", request.user_input)
         
         async def event_stream():
             """Stream agent iterations and final result"""
@@ -46,7 +52,7 @@ async def generate_shopping_list(
             
             async for event in shopping_agent.run_streaming(request.user_input, user_id):
                 # Send event to frontend
-                yield f"data: {json.dumps(event)}\n\n"
+                yield f"data: {orjson.dumps(event).decode()}\n\n"
                 
                 # Store final result
                 if event.get("type") == "complete":
@@ -54,7 +60,7 @@ async def generate_shopping_list(
             
             # Save to database after streaming completes
             if final_data:
-                print("Saving shopping list to database...")
+                logger.debug("Saving shopping list to database...")
                 list_data = {
                     "user_id": user_id,
                     "user_input": request.user_input,
@@ -64,11 +70,7 @@ async def generate_shopping_list(
                     "agent_iterations": final_data["iterations"]
                 }
                 
-                list_response = supabase.table("shopping_lists").insert(list_data).execute()
-                shopping_list_id = list_response.data[0]["id"] if list_response.data else None
-                
-                # Log to activity feed
-                print("Logging to activity feed...")
+                # Activity feed entry
                 activity_data = {
                     "user_id": user_id,
                     "activity_type": "freeform",
@@ -80,46 +82,48 @@ async def generate_shopping_list(
                     "money_saved": None,
                     "emoji": "🛒",
                 }
-                supabase.table("user_activities").insert(activity_data).execute()
                 
-                # Award XP
-                print("Awarding XP...")
-                from app.routers.activities import update_user_stats
-                await update_user_stats(user_id, 25, final_data["estimated_co2_saved"], 0, 0)
+                # The list insert, activity log and XP award don't depend on each other, so run them together
+                logger.debug("Saving list, logging activity and awarding XP...")
+                list_response, _, _ = await asyncio.gather(
+                    asyncio.to_thread(supabase.table("shopping_lists").insert(list_data).execute),
+                    asyncio.to_thread(supabase.table("user_activities").insert(activity_data).execute),
+                    update_user_stats(user_id, 25, final_data["estimated_co2_saved"], 0, 0)
+                )
+                shopping_list_id = list_response.data[0]["id"] if list_response.data else None
                 
                 # Send final completion event with ID
-                yield f"data: {json.dumps({'type': 'saved', 'shopping_list_id': shopping_list_id})}\n\n"
+                yield f"data: {orjson.dumps({'type': 'saved', 'shopping_list_id': shopping_list_id}).decode()}\n\n"
             
-            print("=== Shopping list generation complete! ===")
+            logger.info("=== Shopping list generation complete! ===")
         
-        return StreamingResponse(event_stream(), media_type="text/event-stream")
+        return StreamingResponse(event_stream(), media_type="text/event-stream", headers=_SSE_HEADERS)
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error generating shopping list: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Error generating shopping list: %s", e)
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
 @router.post("/complete-shopping")
 async def complete_shopping(
     request: SaveListRequest,
-    authorization: str = Header(None)
+    background_tasks: BackgroundTasks,
+    user_id: str = Depends(current_user_id)
 ):
     """
     Mark shopping list as completed and award XP
     """
     try:
-        user_id = get_user_id_from_token(authorization)
-        
         # Get shopping list
-        list_response = supabase.table("shopping_lists")\
-            .select("*")\
-            .eq("id", request.shopping_list_id)\
-            .eq("user_id", user_id)\
-            .execute()
+        list_response = await asyncio.to_thread(
+            supabase.table("shopping_lists")
+            .select("*")
+            .eq("id", request.shopping_list_id)
+            .eq("user_id", user_id)
+            .execute
+        )
         
         if not list_response.data:
             raise HTTPException(status_code=404, detail="Shopping list not found")
@@ -127,16 +131,19 @@ async def complete_shopping(
         shopping_list = list_response.data[0]
         
         # Mark as completed
-        supabase.table("shopping_lists")\
-            .update({"completed_at": datetime.now().isoformat()})\
-            .eq("id", request.shopping_list_id)\
-            .execute()
+        await asyncio.to_thread(
+            supabase.table("shopping_lists")
+            .update({"completed_at": datetime.now().isoformat()})
+            .eq("id", request.shopping_list_id)
+            .execute
+        )
         
         # Award XP (100 XP for completing shopping)
         xp_earned = 100
         co2_saved = shopping_list.get("estimated_co2_saved", 0)
         
-        # Log to activity feed
+        # Log to activity feed and award XP once the response is sent; stats, profile and
+        # feed reads wait on the pending write until both have landed
         activity_data = {
             "user_id": user_id,
             "activity_type": "freeform",
@@ -148,11 +155,13 @@ async def complete_shopping(
             "money_saved": None,
             "emoji": "✅",
         }
-        supabase.table("user_activities").insert(activity_data).execute()
-        
-        # Award XP
-        from app.routers.activities import update_user_stats
-        await update_user_stats(user_id, xp_earned, co2_saved, 0, 0)
+        background_tasks.add_task(
+            finalize_shopping_rewards,
+            user_id,
+            activity_data,
+            co2_saved,
+            begin_pending_write(user_id)
+        )
         
         return {
             "success": True,
@@ -163,27 +172,44 @@ async def complete_shopping(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error completing shopping: {str(e)}")
+        logger.error("❌ Error completing shopping: %s", e)
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+async def finalize_shopping_rewards(user_id: str, activity_data: Dict[str, Any], co2_saved: float, pending: PendingWrite):
+    """
+    Post-response side effects of completing a list: activity feed entry and XP
+    
+    Releases readers waiting on the user's pending write once both have landed.
+    """
+    try:
+        await asyncio.gather(
+            asyncio.to_thread(supabase.table("user_activities").insert(activity_data).execute),
+            update_user_stats(user_id, activity_data["xp_earned"], co2_saved, 0, 0)
+        )
+    except Exception as e:
+        logger.error("❌ Error finalizing shopping rewards: %s", e)
+    finally:
+        finish_pending_write(user_id, pending)
+
+
 @router.get("/history")
 async def get_shopping_history(
-    authorization: str = Header(None),
+    user_id: str = Depends(current_user_id),
     limit: int = 10
 ):
     """
     Get user's shopping list history
     """
     try:
-        user_id = get_user_id_from_token(authorization)
-        
-        lists = supabase.table("shopping_lists")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .order("created_at", desc=True)\
-            .limit(limit)\
-            .execute()
+        lists = await asyncio.to_thread(
+            supabase.table("shopping_lists")
+            .select("*")
+            .eq("user_id", user_id)
+            .order("created_at", desc=True)
+            .limit(limit)
+            .execute
+        )
         
         return {
             "success": True,
@@ -193,5 +219,5 @@ async def get_shopping_history(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error fetching history: {str(e)}")
+        logger.error("❌ Error fetching history: %s", e)
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
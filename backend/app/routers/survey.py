@@ -1,18 +1,72 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, BackgroundTasks, Response
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any, Tuple
 from app.database import supabase
+from app.cache import TTLCache
+import asyncio
+import hashlib
 import jwt
+import logging
+import orjson
 from app.config import get_settings
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/survey",
     tags=["survey"],
     responses={404: {"description": "Not found"}},
+    default_response_class=ORJSONResponse,
 )
 
 settings = get_settings()
 
+# Users recently found without a survey, so repeated /missions/generate calls skip the lookup
+missing_surveys = TTLCache(maxsize=4096, ttl=30)
+
+# user_id -> (survey row or None, ETag) for GET /survey/; dropped whenever the user submits
+_survey_cache = TTLCache(maxsize=1024, ttl=60)
+
+class _PendingSurvey:
+    """A survey upsert running in the background; error is set if it didn't land."""
+    
+    def __init__(self):
+        self.written = asyncio.Event()
+        self.error: Optional[Exception] = None
+
+
+# Survey upserts still being written in the background, so reads right after a submit don't race them.
+# Failed upserts stay here until the user resubmits, so reads report the failure instead of a missing survey
+_pending_surveys: Dict[str, _PendingSurvey] = {}
+
+
+async def wait_for_survey_write(user_id: str) -> None:
+    """Block until any in-flight survey upsert for this user has landed; 503 if it failed."""
+    pending = _pending_surveys.get(user_id)
+    if pending is None:
+        return
+    
+    await pending.written.wait()
+    if pending.error is not None:
+        raise HTTPException(status_code=503, detail="Survey save failed, please resubmit")
+
+
+async def _persist_survey(user_id: str, data: Dict[str, Any], pending: _PendingSurvey) -> None:
+    """Background task for POST /survey: upsert the answers, then release any readers waiting on them."""
+    try:
+        await asyncio.to_thread(
+            supabase.table("survey_responses").upsert(data, on_conflict="user_id").execute
+        )
+    except Exception as e:
+        logger.error("❌ Error saving survey for %s: %s", user_id, e)
+        pending.error = e
+    finally:
+        _survey_cache.delete(user_id)
+        pending.written.set()
+        if pending.error is None and _pending_surveys.get(user_id) is pending:
+            del _pending_surveys[user_id]
+
 # Pydantic model for survey request
 class SurveyRequest(BaseModel):
     commute_method: Optional[str] = None
@@ -33,6 +87,37 @@ class SurveyRequest(BaseModel):
     motivation: Optional[str] = None
     achievable_changes: Optional[str] = None
 
+# Token digest -> subject, so clients resending the same token skip the decode.
+# Keyed on a fixed-size digest, so entries never hold the (client-chosen) tokens themselves
+_token_subjects = TTLCache(maxsize=10_000, ttl=5 * 60)
+
+
+def _decode_user_id(token: str) -> Optional[str]:
+    """
+    Read a token's subject, cached per token digest.
+    
+    The signature isn't verified, but jwt.decode still checks the token's
+    structure and header, so malformed tokens raise jwt.DecodeError. Only
+    tokens that decoded to a subject are cached.
+    """
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    user_id = _token_subjects.get(key)
+    if user_id is not None:
+        return user_id
+    
+    decoded = jwt.decode(
+        token,
+        options={
+            "verify_signature": False,
+            "verify_aud": False,
+            "verify_exp": False
+        }
+    )
+    user_id = decoded.get("sub")
+    if user_id:
+        _token_subjects.set(key, user_id)
+    return user_id
+
 def get_user_id_from_token(authorization: str) -> str:
     """Extract user ID from Bearer token"""
     try:
@@ -40,16 +125,7 @@ def get_user_id_from_token(authorization: str) -> str:
             raise HTTPException(status_code=401, detail="Missing or invalid authorization header")
         
         token = authorization.replace("Bearer ", "")
-        
-        decoded = jwt.decode(
-            token, 
-            options={
-                "verify_signature": False,
-                "verify_aud": False,
-                "verify_exp": False
-            }
-        )
-        user_id = decoded.get("sub")
+        user_id = _decode_user_id(token)
         
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token: no user ID found")
@@ -60,14 +136,21 @@ def get_user_id_from_token(authorization: str) -> str:
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Authentication error: {str(e)}")
 
-@router.post("/")
+def current_user_id(authorization: str = Header(None)) -> str:
+    """FastAPI dependency resolving the caller's user ID (evaluated once per request)."""
+    return get_user_id_from_token(authorization)
+
+@router.post("/", status_code=202)
 async def submit_survey(
     survey_data: SurveyRequest,
+    background_tasks: BackgroundTasks,
     authorization: str = Header(None)
 ):
     """
     Submit or update user survey responses.
     Uses upsert to insert new survey or update existing one.
+    
+    The upsert runs after the response is sent; reads of the survey wait for it.
     """
     try:
         # Get user ID from token
@@ -76,19 +159,18 @@ async def submit_survey(
         # Prepare data for database
         data = {
             "user_id": user_id,
-            **survey_data.model_dump(exclude_none=False)
+            **survey_data.model_dump()
         }
         
         # Upsert into database (insert or update based on user_id)
-        response = supabase.table("survey_responses").upsert(
-            data,
-            on_conflict="user_id"
-        ).execute()
+        pending = _pending_surveys[user_id] = _PendingSurvey()
+        background_tasks.add_task(_persist_survey, user_id, data, pending)
+        missing_surveys.delete(user_id)
+        _survey_cache.delete(user_id)
         
         return {
             "success": True,
-            "message": "Survey response saved successfully",
-            "survey_id": response.data[0]["id"] if response.data else None
+            "message": "Survey response received"
         }
         
     except HTTPException:
@@ -96,27 +178,52 @@ async def submit_survey(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving survey: {str(e)}")
 
+async def _fetch_survey(user_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Load a user's survey row along with an ETag derived from its contents."""
+    response = await asyncio.to_thread(
+        supabase.table("survey_responses").select("*").eq("user_id", user_id).maybe_single().execute
+    )
+    
+    if response is None or not response.data:
+        return None, None
+    
+    etag = '"' + hashlib.blake2b(orjson.dumps(response.data, option=orjson.OPT_SORT_KEYS), digest_size=8).hexdigest() + '"'
+    return response.data, etag
+
 @router.get("/")
-async def get_survey(authorization: str = Header(None)):
+async def get_survey(
+    response: Response,
+    authorization: str = Header(None),
+    if_none_match: Optional[str] = Header(None)
+):
     """
     Get user's survey response
+    
+    Sends an ETag with no-cache, so clients revalidate every read with
+    If-None-Match and get a 304 unless the survey changed.
     """
     try:
         # Get user ID from token
         user_id = get_user_id_from_token(authorization)
+        await wait_for_survey_write(user_id)
         
         # Query user's survey
-        response = supabase.table("survey_responses").select("*").eq("user_id", user_id).execute()
+        survey, etag = await _survey_cache.get_or_set(user_id, lambda: _fetch_survey(user_id))
         
-        if not response.data:
+        if survey is None:
             return {
                 "success": False,
                 "message": "No survey found for this user"
             }
         
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if if_none_match == etag:
+            return Response(status_code=304, headers=cache_headers)
+        
+        response.headers.update(cache_headers)
         return {
             "success": True,
-            "data": response.data[0]
+            "data": survey
         }
         
     except HTTPException:
@@ -3,11 +3,32 @@ Climatiq API Service
 Handles carbon footprint calculations and comparison metrics
 """
 
+import asyncio
+import logging
+import random
+import time
 import httpx
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 from app.config import get_settings
+from app.cache import TTLCache
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Transient failures (transport errors, 429, 5xx) get a couple of quick retries with jittered backoff
+_RETRY_ATTEMPTS = 3
+_RETRY_BASE_DELAY_SECONDS = 0.1
+_RETRY_MAX_DELAY_SECONDS = 2.0
+_RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+# Circuit breaker: after 5 lookups in a row exhaust their retries, skip Climatiq for 30s and use the fallback table
+_BREAKER_THRESHOLD = 5
+_BREAKER_COOLDOWN_SECONDS = 30.0
+
+# Comparison-metric conversions, stored as reciprocals so each metric is one multiplication
+_MILES_PER_KG = 1 / 0.42  # ~0.42 kg CO2 per mile driven in a car
+_CHARGES_PER_KG = 1 / 0.008  # ~0.008 kg CO2 per full smartphone charge
+_BREATHING_DAYS_PER_KG = 1 / 0.9  # ~0.9 kg CO2 per day breathing
 
 
 class ClimatiqService:
@@ -19,11 +40,26 @@ class ClimatiqService:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # One pooled HTTP/2 client for the app's lifetime, closed via aclose() on shutdown
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=10.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            http2=True
+        )
+        # (normalized item name, category) -> kg CO2 from the API
+        self._carbon_cache = TTLCache(maxsize=10_000, ttl=24 * 60 * 60)
+        self._breaker_failures = 0
+        self._breaker_open_until = 0.0
     
     async def calculate_item_carbon(self, item_name: str, category: str = "food") -> float:
         """
         Calculate carbon footprint for a grocery item using Climatiq API
         
+        Results are cached per normalized item name, since the same groceries
+        show up on receipt after receipt. Fallback estimates are not cached.
+        
         Args:
             item_name: Name of the item
             category: Category of the item (default: food)
@@ -31,150 +67,205 @@ class ClimatiqService:
         Returns:
             CO2 footprint in kg
         """
-        print(f"🌍 Climatiq: Calculating carbon footprint for: {item_name}")
+        logger.debug("Calculating carbon footprint for: %s", item_name)
         
+        name_norm = item_name.strip().lower()
         try:
-            # Use a simplified approach with emission factors
-            # Map common items to emission factor IDs
-            emission_factor_id = self._get_emission_factor_id(item_name.lower())
-            
-            # Default weight/amount for estimation
-            amount = 1.0
-            
-            # Call Climatiq API
-            print(f"🌍 Climatiq: Calling API with emission factor: {emission_factor_id}")
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/estimate",
-                    headers=self.headers,
-                    json={
-                        "emission_factor": {
-                            "id": emission_factor_id
-                        },
-                        "parameters": {
-                            "weight": amount,
-                            "weight_unit": "kg"
-                        }
-                    },
-                    timeout=10.0
-                )
-                
-                print(f"🌍 Climatiq: API response status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    co2_kg = data.get("co2e", 0)
-                    print(f"✅ Climatiq: Carbon footprint calculated: {co2_kg} kg CO2")
-                    return co2_kg
-                else:
-                    print(f"⚠️ Climatiq: API error {response.status_code}, using fallback estimation")
-                    return self._fallback_estimation(item_name)
-                    
+            return await self._carbon_cache.get_or_set(
+                (name_norm, category),
+                lambda: self._request_item_carbon(name_norm)
+            )
         except Exception as e:
-            print(f"❌ Climatiq: Error calling API: {str(e)}, using fallback")
+            logger.warning("Climatiq API error: %s, using fallback", e)
             return self._fallback_estimation(item_name)
     
+    async def calculate_items_carbon(self, item_names: List[str], category: str = "food") -> List[float]:
+        """
+        Calculate carbon footprints for several items at once
+        
+        Requests overlap on the pooled client instead of running one after another.
+        Each item falls back independently, so one failed lookup doesn't sink the rest.
+        
+        Returns:
+            CO2 footprint in kg per item, in the same order as item_names
+        """
+        return list(await asyncio.gather(*(
+            self.calculate_item_carbon(item_name, category) for item_name in item_names
+        )))
+    
+    async def _request_item_carbon(self, item_name: str) -> float:
+        """Call the Climatiq estimate endpoint; raises if the API doesn't return a result or the breaker is open"""
+        if time.monotonic() < self._breaker_open_until:
+            raise RuntimeError("circuit breaker is open")
+        
+        # Use a simplified approach with emission factors
+        # Map common items to emission factor IDs
+        emission_factor_id = self._get_emission_factor_id(item_name)
+        
+        # Default weight/amount for estimation
+        amount = 1.0
+        
+        # Call Climatiq API
+        logger.debug("Calling API with emission factor: %s", emission_factor_id)
+        
+        try:
+            response = await self._post_estimate({
+                "emission_factor": {
+                    "id": emission_factor_id
+                },
+                "parameters": {
+                    "weight": amount,
+                    "weight_unit": "kg"
+                }
+            })
+        except Exception:
+            self._breaker_failures += 1
+            if self._breaker_failures == _BREAKER_THRESHOLD:
+                self._breaker_open_until = time.monotonic() + _BREAKER_COOLDOWN_SECONDS
+                logger.warning("%s Climatiq lookups failed in a row, circuit open for %.0fs", self._breaker_failures, _BREAKER_COOLDOWN_SECONDS)
+            elif self._breaker_failures > _BREAKER_THRESHOLD:
+                # The half-open probe failed too
+                self._breaker_open_until = time.monotonic() + _BREAKER_COOLDOWN_SECONDS
+            raise
+        
+        if self._breaker_failures >= _BREAKER_THRESHOLD:
+            logger.info("Climatiq API reachable again, circuit closed")
+        self._breaker_failures = 0
+        
+        logger.debug("API response status: %s", response.status_code)
+        
+        if response.status_code != 200:
+            raise RuntimeError(f"API error {response.status_code}")
+        
+        data = response.json()
+        co2_kg = data.get("co2e", 0)
+        logger.debug("Carbon footprint calculated: %s kg CO2", co2_kg)
+        return co2_kg
+    
+    async def _post_estimate(self, payload: Dict) -> httpx.Response:
+        """
+        POST to /estimate, retrying transport errors and 429/5xx responses
+        
+        Other responses (including non-retryable errors) are returned as-is.
+        Raises the last error once the attempts are used up.
+        """
+        for attempt in range(_RETRY_ATTEMPTS):
+            try:
+                response = await self._client.post("/estimate", json=payload)
+                if response.status_code not in _RETRYABLE_STATUS_CODES:
+                    return response
+                error = RuntimeError(f"API error {response.status_code}")
+            except httpx.TransportError as e:
+                error = e
+            
+            if attempt + 1 < _RETRY_ATTEMPTS:
+                # Full jitter, so concurrent lookups don't retry in lockstep
+                await asyncio.sleep(random.uniform(0, min(_RETRY_MAX_DELAY_SECONDS, _RETRY_BASE_DELAY_SECONDS * 2 ** attempt)))
+        
+        raise error
+    
+    async def aclose(self):
+        """Close the pooled HTTP client (called on app shutdown)"""
+        await self._client.aclose()
+    
     def _get_emission_factor_id(self, item_name: str) -> str:
         """
         Map item name to Climatiq emission factor ID
         
         This is a simplified mapping. In production, you'd want a more comprehensive database.
         """
-        # Common food categories from Climatiq's database
-        if any(meat in item_name for meat in ['beef', 'steak', 'burger']):
-            return "consumer_goods-type_meat_products_beef"
-        elif 'chicken' in item_name or 'poultry' in item_name:
-            return "consumer_goods-type_meat_products_poultry"
-        elif 'pork' in item_name:
-            return "consumer_goods-type_meat_products_pork"
-        elif 'fish' in item_name:
-            return "consumer_goods-type_fish_products"
-        elif 'milk' in item_name or 'dairy' in item_name:
-            return "consumer_goods-type_dairy_products"
-        elif any(veg in item_name for veg in ['vegetable', 'carrot', 'broccoli', 'lettuce']):
-            return "consumer_goods-type_vegetables"
-        elif any(fruit in item_name for fruit in ['fruit', 'apple', 'banana', 'orange', 'berry']):
-            return "consumer_goods-type_fruit"
-        else:
-            # Default to general food category
-            return "consumer_goods-type_food_products"
+        return _match_keyword_rule(item_name, _EMISSION_FACTOR_RULES, "consumer_goods-type_food_products")
+    
+    def estimate_item_carbon(self, item_name: str) -> float:
+        """
+        Offline carbon estimate from the keyword table, with no API call
+        
+        Args:
+            item_name: Name of the item
+            
+        Returns:
+            Estimated CO2 footprint in kg
+        """
+        return self._fallback_estimation(item_name)
     
     def _fallback_estimation(self, item_name: str) -> float:
         """
         Fallback carbon estimation when API is unavailable
         Based on typical carbon footprints (kg CO2 per kg of product)
         """
-        item_lower = item_name.lower()
-        
-        # High carbon items
-        if any(meat in item_lower for meat in ['beef', 'steak', 'burger', 'lamb']):
-            return 27.0
-        elif 'cheese' in item_lower:
-            return 13.5
-        elif any(meat in item_lower for meat in ['pork', 'bacon', 'ham']):
-            return 12.0
-        elif 'chicken' in item_lower or 'poultry' in item_lower:
-            return 6.9
-        
-        # Medium carbon items
-        elif 'fish' in item_lower:
-            return 6.0
-        elif 'milk' in item_lower:
-            return 3.2
-        elif 'rice' in item_lower:
-            return 2.7
-        elif 'egg' in item_lower:
-            return 4.8
-        
-        # Low carbon items
-        elif any(veg in item_lower for veg in ['vegetable', 'carrot', 'broccoli', 'lettuce', 'spinach']):
-            return 0.4
-        elif any(fruit in item_lower for fruit in ['banana', 'apple', 'orange', 'berry']):
-            return 0.7
-        elif 'bean' in item_lower or 'lentil' in item_lower:
-            return 0.9
-        
         # Default medium-low
-        return 2.0
+        return _match_keyword_rule(item_name.lower(), _FALLBACK_KG_RULES, 2.0)
     
-    async def get_comparison_metric(self, co2_kg: float) -> str:
+    def get_comparison_metric(self, co2_kg: float) -> str:
         """
         Get human-readable comparison for CO2 amount
         
+        Pure arithmetic on fixed conversion factors, so no API call is made
+        
         Args:
             co2_kg: Amount of CO2 in kilograms
             
         Returns:
             Comparison string (e.g., "driving 68 miles")
         """
-        print(f"🌍 Climatiq: Getting comparison metric for {co2_kg} kg CO2")
+        logger.debug("Getting comparison metric for %s kg CO2", co2_kg)
         
         try:
-            # CO2 per mile driven in a car: ~0.42 kg
-            miles_driven = round(co2_kg / 0.42, 1)
-            
-            # Also calculate other comparisons
-            # Smartphone charging: ~0.008 kg per full charge
-            phone_charges = round(co2_kg / 0.008, 0)
-            
             # Choose most relevant comparison
             if co2_kg > 10:
-                metric = f"driving {miles_driven} miles"
+                metric = f"driving {round(co2_kg * _MILES_PER_KG, 1)} miles"
             elif co2_kg > 1:
-                metric = f"{phone_charges} smartphone charges"
+                metric = f"{round(co2_kg * _CHARGES_PER_KG, 0)} smartphone charges"
             else:
                 # For small amounts, use daily comparison
-                days_breathing = round(co2_kg / 0.9, 1)  # ~0.9 kg CO2 per day breathing
-                metric = f"{days_breathing} days of breathing"
+                metric = f"{round(co2_kg * _BREATHING_DAYS_PER_KG, 1)} days of breathing"
             
-            print(f"✅ Climatiq: Comparison metric: {metric}")
+            logger.debug("Comparison metric: %s", metric)
             return metric
             
         except Exception as e:
-            print(f"❌ Climatiq: Error generating comparison metric: {str(e)}")
+            logger.error("❌ Error generating comparison metric: %s", e)
             return f"{co2_kg} kg CO2"
 
 
+# Keyword rules, checked in order; the first rule with a keyword contained in the
+# (lowercased) item name wins. Substring matching keeps plurals like "bananas" working.
+_EMISSION_FACTOR_RULES = (
+    # Common food categories from Climatiq's database
+    (("beef", "steak", "burger"), "consumer_goods-type_meat_products_beef"),
+    (("chicken", "poultry"), "consumer_goods-type_meat_products_poultry"),
+    (("pork",), "consumer_goods-type_meat_products_pork"),
+    (("fish",), "consumer_goods-type_fish_products"),
+    (("milk", "dairy"), "consumer_goods-type_dairy_products"),
+    (("vegetable", "carrot", "broccoli", "lettuce"), "consumer_goods-type_vegetables"),
+    (("fruit", "apple", "banana", "orange", "berry"), "consumer_goods-type_fruit"),
+)
+
+_FALLBACK_KG_RULES = (
+    # High carbon items
+    (("beef", "steak", "burger", "lamb"), 27.0),
+    (("cheese",), 13.5),
+    (("pork", "bacon", "ham"), 12.0),
+    (("chicken", "poultry"), 6.9),
+    # Medium carbon items
+    (("fish",), 6.0),
+    (("milk",), 3.2),
+    (("rice",), 2.7),
+    (("egg",), 4.8),
+    # Low carbon items
+    (("vegetable", "carrot", "broccoli", "lettuce", "spinach"), 0.4),
+    (("banana", "apple", "orange", "berry"), 0.7),
+    (("bean", "lentil"), 0.9),
+)
+
+
+def _match_keyword_rule(item_lower: str, rules, default):
+    """Return the value of the first rule whose keywords appear in item_lower"""
+    for keywords, value in rules:
+        if any(keyword in item_lower for keyword in keywords):
+            return value
+    return default
+
+
 # Singleton instance
 climatiq_service = ClimatiqService()
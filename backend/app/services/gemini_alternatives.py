@@ -3,23 +3,31 @@ Gemini AI Service for Sustainable Alternatives
 Suggests eco-friendly alternatives for grocery items
 """
 
+import logging
 from typing import Dict, Optional
-from app.config import get_settings
-from langchain_google_genai import ChatGoogleGenerativeAI
+from pydantic import BaseModel
+from app.cache import TTLCache
+from app.services.llm import with_temperature
 from langchain_core.messages import SystemMessage, HumanMessage
-import json
 
-settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class Alternative(BaseModel):
+    """Schema Gemini's reply is constrained to"""
+    alternative_name: Optional[str] = None
+    alternative_carbon_kg: Optional[float] = None
+    carbon_savings_percent: Optional[float] = None
+    price_note: Optional[str] = None
+    note: Optional[str] = None
 
 
 class GeminiAlternativesService:
     def __init__(self):
         """Initialize Gemini AI client"""
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-lite",
-            api_key=settings.google_api_key,
-            temperature=0.3,
-        )
+        self.llm = with_temperature(0.3).with_structured_output(Alternative)
+        # (normalized item name, rounded kg CO2) -> parsed suggestion
+        self._alternative_cache = TTLCache(maxsize=10_000, ttl=24 * 60 * 60)
     
     async def get_sustainable_alternative(
         self, 
@@ -36,11 +44,29 @@ class GeminiAlternativesService:
         Returns:
             Dict with alternative details or None if no better alternative exists
         """
-        print(f"🤖 Gemini: Getting sustainable alternative for: {item_name} ({carbon_kg} kg CO2)")
+        logger.debug("Getting sustainable alternative for: %s (%s kg CO2)", item_name, carbon_kg)
         
         try:
-            # Craft prompt to prevent hallucinating prices
-            prompt = f"""You are a sustainability expert helping people make eco-friendly shopping choices.
+            return await self._alternative_cache.get_or_set(
+                (item_name.strip().lower(), round(carbon_kg, 2)),
+                lambda: self._request_alternative(item_name, carbon_kg)
+            )
+            
+        except Exception as e:
+            logger.error("❌ Error getting alternative: %s", e)
+            # Return a safe default
+            return {
+                "alternative_name": None,
+                "alternative_carbon_kg": None,
+                "carbon_savings_percent": None,
+                "price_note": None,
+                "note": "Unable to find alternative suggestions at this time"
+            }
+    
+    async def _request_alternative(self, item_name: str, carbon_kg: float) -> Dict[str, any]:
+        """Ask Gemini for an alternative; raises if the call fails"""
+        # Craft prompt to prevent hallucinating prices
+        prompt = f"""You are a sustainability expert helping people make eco-friendly shopping choices.
 
 Given this grocery item:
 - Item: {item_name}
@@ -57,55 +83,21 @@ CRITICAL: DO NOT include specific dollar amounts. Only use the exact price note
 
 If the item is already eco-friendly (low carbon) or there's no significantly better alternative:
 - Set alternative_name to null
-- Provide a brief encouraging note
-
-Response format (JSON only, no markdown):
-{{
-  "alternative_name": "product name or null",
-  "alternative_carbon_kg": number or null,
-  "carbon_savings_percent": number or null,
-  "price_note": "one of the phrases above or null",
-  "note": "helpful tip or encouragement"
-}}"""
+- Provide a brief encouraging note"""
 
-            print("🤖 Gemini: Calling API for alternative suggestion...")
-            
-            messages = [
-                SystemMessage(content="You are a sustainability expert. Always respond with valid JSON."),
-                HumanMessage(content=prompt)
-            ]
-            
-            response = await self.llm.ainvoke(messages)
-            text = response.content.strip()
-            
-            # Remove markdown code blocks if present
-            if text.startswith("```json"):
-                text = text[7:]
-            if text.startswith("```"):
-                text = text[3:]
-            if text.endswith("```"):
-                text = text[:-3]
-            text = text.strip()
-            
-            print(f"🤖 Gemini: Response received (length: {len(text)} chars)")
-            
-            # Parse JSON response
-            result = json.loads(text)
-            
-            print(f"🤖 Gemini: Alternative suggestion: {result.get('alternative_name', 'None')}")
-            
-            return result
-            
-        except Exception as e:
-            print(f"❌ Gemini: Error getting alternative: {str(e)}")
-            # Return a safe default
-            return {
-                "alternative_name": None,
-                "alternative_carbon_kg": None,
-                "carbon_savings_percent": None,
-                "price_note": None,
-                "note": "Unable to find alternative suggestions at this time"
-            }
+        logger.debug("Calling Gemini for alternative suggestion")
+        
+        messages = [
+            SystemMessage(content="You are a sustainability expert."),
+            HumanMessage(content=prompt)
+        ]
+        
+        # Structured output: the reply is schema-constrained JSON, already validated
+        alternative = await self.llm.ainvoke(messages)
+        
+        logger.debug("Alternative suggestion: %s", alternative.alternative_name)
+        
+        return alternative.model_dump()
 
 
 # Singleton instance
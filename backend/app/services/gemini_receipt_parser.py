@@ -3,24 +3,33 @@ Gemini Receipt Parser Service
 Parses receipt images using Gemini 2.0 Flash Lite vision capabilities
 """
 
-from typing import Dict, List
-from app.config import get_settings
-from langchain_google_genai import ChatGoogleGenerativeAI
+import logging
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from app.services.llm import gemini_llm
 from langchain_core.messages import SystemMessage, HumanMessage
-import json
 import base64
 
-settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class ReceiptItem(BaseModel):
+    name: str
+    price: Optional[float] = None
+
+
+class Receipt(BaseModel):
+    """Schema Gemini's reply is constrained to"""
+    store_name: Optional[str] = None
+    scan_date: Optional[str] = None
+    items: List[ReceiptItem] = []
 
 
 class GeminiReceiptParser:
     def __init__(self):
         """Initialize Gemini AI client with vision capabilities"""
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-lite",
-            api_key=settings.google_api_key,
-            temperature=0,  # Consistent parsing
-        )
+        # Temperature 0 for consistent parsing
+        self.llm = gemini_llm.with_structured_output(Receipt)
     
     async def parse_receipt(self, image_base64: str) -> Dict:
         """
@@ -32,11 +41,11 @@ class GeminiReceiptParser:
         Returns:
             Dict with store_name, scan_date, and items list
         """
-        print("📸 Gemini Parser: Starting receipt parsing...")
+        logger.debug("Starting receipt parsing")
         
         try:
             # Create prompt for structured receipt parsing
-            prompt = """Analyze this receipt image and extract the following information in JSON format:
+            prompt = """Analyze this receipt image and extract the following information:
 
 1. Store name (if visible)
 2. Purchase date (if visible, format as YYYY-MM-DD)
@@ -46,57 +55,33 @@ For each item:
 - Extract the item name (clean and readable)
 - Extract the price (as a number)
 
-Response format (JSON only, no markdown):
-{
-  "store_name": "Store Name" or null,
-  "scan_date": "YYYY-MM-DD" or null,
-  "items": [
-    {"name": "Item Name", "price": 0.00}
-  ]
-}
-
 IMPORTANT: 
 - Only include items you can clearly read
 - If you can't determine store name or date, set to null
-- Ensure prices are numbers (not strings)
 - Do not include tax, subtotal, or total as items
 """
 
-            print("🤖 Gemini Parser: Sending image to Gemini API...")
+            logger.debug("Sending image to Gemini")
             
             # Create message with image
             messages = [
-                SystemMessage(content="You are a receipt parser. Always respond with valid JSON."),
+                SystemMessage(content="You are a receipt parser."),
                 HumanMessage(content=[
                     {"type": "text", "text": prompt},
                     {"type": "image_url", "image_url": f"data:image/jpeg;base64,{image_base64}"}
                 ])
             ]
             
-            response = await self.llm.ainvoke(messages)
-            text = response.content.strip()
-            
-            # Remove markdown code blocks if present
-            if text.startswith("```json"):
-                text = text[7:]
-            if text.startswith("```"):
-                text = text[3:]
-            if text.endswith("```"):
-                text = text[:-3]
-            text = text.strip()
-            
-            print(f"🤖 Gemini Parser: Response received (length: {len(text)} chars)")
-            
-            # Parse JSON response
-            result = json.loads(text)
+            # Structured output: the reply is schema-constrained JSON, already validated
+            receipt = await self.llm.ainvoke(messages)
             
-            print(f"🤖 Gemini Parser: Parsed {len(result.get('items', []))} items")
-            print(f"🤖 Gemini Parser: Store: {result.get('store_name', 'Unknown')}")
+            logger.debug("Parsed %s items", len(receipt.items))
+            logger.debug("Store: %s", receipt.store_name or "Unknown")
             
-            return result
+            return receipt.model_dump()
             
         except Exception as e:
-            print(f"❌ Gemini Parser: Error parsing receipt: {str(e)}")
+            logger.error("❌ Error parsing receipt: %s", e)
             # Return minimal valid response
             return {
                 "store_name": None,
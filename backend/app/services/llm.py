@@ -0,0 +1,25 @@
+"""
+Shared Gemini chat model
+One ChatGoogleGenerativeAI (and so one google-genai client and connection pool) behind every Gemini caller
+"""
+
+from langchain_google_genai import ChatGoogleGenerativeAI
+from app.config import get_settings
+
+settings = get_settings()
+
+gemini_llm = ChatGoogleGenerativeAI(
+    model="gemini-2.0-flash-lite",
+    api_key=settings.google_api_key,
+    temperature=0,
+)
+
+
+def with_temperature(temperature: float) -> ChatGoogleGenerativeAI:
+    """Copy of gemini_llm at a different temperature; the copy shares its underlying client"""
+    return gemini_llm.model_copy(update={"temperature": temperature})
+
+
+def with_model(model: str, temperature: float) -> ChatGoogleGenerativeAI:
+    """Copy of gemini_llm for another Gemini model; the copy shares its underlying client"""
+    return gemini_llm.model_copy(update={"model": model, "temperature": temperature})
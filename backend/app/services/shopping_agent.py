@@ -1,23 +1,138 @@
-from typing import Dict, List, Any, Optional
-from app.config import get_settings
+from typing import AsyncIterator, Dict, List, Any, Literal, Optional
+from pydantic import BaseModel, Field
 from app.database import supabase
-from langchain_google_genai import ChatGoogleGenerativeAI
+from app.cache import TTLCache
+from app.services.llm import with_model
+from app.services.climatiq_service import climatiq_service
 from langchain_core.messages import SystemMessage, HumanMessage
 from datetime import datetime
-import json
+import asyncio
+import hashlib
+import orjson
 
-settings = get_settings()
+# Seasonal produce depends only on (location, month); thoughts are keyed on a hash of their full prompt
+_seasonal_produce_cache = TTLCache(maxsize=1024, ttl=60 * 60)
+_thought_cache = TTLCache(maxsize=1024, ttl=60 * 60)
+# Generated lists keyed on a fingerprint of the request and the data behind it (see _shopping_list_fingerprint)
+_shopping_list_cache = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+
+# Lookups every shopping list draws on, in the order the agent should make them
+_DATA_GATHERING_ACTIONS = (
+    ("query_past_receipts", {"limit": 10}),
+    ("query_commitments", {}),
+    ("search_seasonal_produce", {}),
+    ("query_user_profile", {}),
+)
+
+# Observation text kept on each iteration record that's streamed and saved with the list
+_MAX_RECORDED_OBSERVATION_CHARS = 800
+
+# Receipt scans the past-receipts tool summarizes per agent run
+_AGENT_RECEIPT_LIMIT = 10
+
+# Static instructions go in constant system messages ahead of the per-call details,
+# so every iteration shares the same prefix and can hit Gemini's implicit prompt cache
+_THINK_SYSTEM = SystemMessage(content="""You are an AI shopping assistant agent. Based on the context, decide what you need to think about next.
+
+IMPORTANT: The user will NOT provide a detailed shopping list. Your job is to suggest sustainable items based on:
+- Their purchase history
+- Their commitments to alternatives
+- Seasonal produce
+- General sustainable shopping principles
+
+What should you think about next? Consider:
+- What information do you still need from their history/commitments?
+- Have you gathered enough data to make recommendations?
+- Should you generate the shopping list now?
+
+Respond with ONE clear thought (max 1 sentence, ~10 words).""")
+
+_DECIDE_SYSTEM = SystemMessage(content="""Based on your thinking, choose the BEST tool to use next.
+
+Available tools:
+1. query_past_receipts - Get user's purchase history
+2. query_commitments - Check sustainable alternatives they committed to
+3. search_seasonal_produce - Find what's in season (LLM call)
+4. query_user_profile - Get user preferences
+5. calculate_carbon_impact - Estimate CO2 for items
+6. generate_shopping_list - Create the final shopping list
+
+Purchase history, commitments, profile and seasonal produce are already gathered; only query one again if its lookup failed.
+
+Choose wisely - you have limited iterations!""")
+
+_SHOPPING_LIST_SYSTEM = SystemMessage(content="""Generate a personalized sustainable shopping list based on the context you are given.
+
+For each item give its name, a category, what they used to buy (for swaps), why you recommend it,
+the estimated kg CO2 saved and an appropriate emoji.
+
+Include 8-12 items. Prioritize commitment reminders, then seasonal items, then smart swaps.""")
+
+
+class ActionInput(BaseModel):
+    items: List[str] = Field(default_factory=list, description="Item names, only for calculate_carbon_impact")
+
+
+class AgentDecision(BaseModel):
+    action: Literal[
+        "query_past_receipts",
+        "query_commitments",
+        "search_seasonal_produce",
+        "query_user_profile",
+        "calculate_carbon_impact",
+        "generate_shopping_list",
+    ]
+    input: ActionInput = Field(default_factory=ActionInput)
+
+
+class ShoppingListItem(BaseModel):
+    name: str
+    category: Literal["commitment_reminder", "seasonal", "smart_swap", "other"]
+    original_item: Optional[str] = Field(None, description="What they used to buy (for swaps)")
+    reason: str
+    carbon_saved_kg: float = 0.0
+    emoji: str
+
+
+class ShoppingList(BaseModel):
+    items: List[ShoppingListItem]
 
 
 class ShoppingAgent:
     def __init__(self):
         """Initialize agent with Gemini 2.5 Flash Preview"""
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash-preview-09-2025",
-            api_key=settings.google_api_key,
-            temperature=0.7,
-        )
-        self.max_iterations = 6
+        self.llm = with_model("gemini-2.5-flash-preview-09-2025", temperature=0.7)
+        # Structured output for the steps whose replies get parsed
+        self._decision_llm = self.llm.with_structured_output(AgentDecision)
+        self._list_llm = self.llm.with_structured_output(ShoppingList)
+        self.max_iterations = 5
+    
+    async def _prefetch_context(self, user_id: str, location: str, context: Dict) -> List[Dict]:
+        """
+        Run the independent data-gathering tools concurrently before the agent loop
+        
+        Returns them as iteration records so the prompts and the saved
+        agent_iterations see them like any other tool call.
+        """
+        calls = [
+            ("query_past_receipts", {"limit": 10}, self._query_past_receipts(user_id, context)),
+            ("query_commitments", {}, self._query_commitments(user_id, context)),
+            ("search_seasonal_produce", {"location": location}, self._search_seasonal_produce(location)),
+            # Last, since its XP and CO2 totals change every run and would end the stable prefix early
+            ("query_user_profile", {}, self._query_user_profile(user_id, context)),
+        ]
+        observations = await asyncio.gather(*(call for _, _, call in calls))
+        
+        return [
+            {
+                "iteration": 0,
+                "thinking": "Gathering purchase history, commitments, profile and seasonal produce",
+                "action": action,
+                "action_input": action_input,
+                "observation": observation
+            }
+            for (action, action_input, _), observation in zip(calls, observations)
+        ]
         
     async def run_streaming(self, user_input: str, user_id: str):
         """
@@ -34,45 +149,75 @@ class ShoppingAgent:
             "location": "Texas"  # Default location
         }
         
+        # The lookups don't depend on each other, so fetch them all up front in one round-trip
+        yield {
+            "type": "thinking",
+            "iteration": 0,
+            "thinking": "Looking at your purchase history, commitments and what's in season"
+        }
+        context["past_iterations"] = iterations
+        context["full_observations"] = []
+        context["iteration_log_text"] = ""
+        for prefetched in await self._prefetch_context(user_id, context["location"], context):
+            _record_iteration(context, prefetched)
+            yield {"type": "observation", **prefetched}
+        
         for i in range(self.max_iterations):
             print(f"\n{'='*60}")
             print(f"🤖 Agent Iteration {i+1}/{self.max_iterations}")
             print(f"{'='*60}")
             
-            # THINK
-            thinking = await self._think(context, iterations)
-            print(f"💭 THINKING: {thinking}")
-            
-            # Yield thinking immediately for live display
-            yield {
-                "type": "thinking",
-                "iteration": i + 1,
-                "thinking": thinking
-            }
-            
-            # ACT (force list generation on last iteration if not done)
-            if i == self.max_iterations - 1 and not context.get("final_list"):
+            # Terminal turn: on the last iteration, or once everything is gathered, generate the
+            # list straight away instead of spending a think and a decide call to arrive there
+            if not context.get("final_list") and (
+                i == self.max_iterations - 1
+                or _rule_based_action(iterations) == ("generate_shopping_list", {})
+            ):
+                thinking = "Finalizing shopping list"
+                yield {
+                    "type": "thinking",
+                    "iteration": i + 1,
+                    "thinking": thinking
+                }
                 action = "generate_shopping_list"
                 action_input = {}
-                print(f"⚡ ACTION (FORCED FINAL): {action}")
+                print(f"⚡ ACTION (FINAL): {action}")
             else:
+                # THINK, streaming the thought to the client as Gemini produces it
+                thinking = ""
+                async for delta in self._think(context, iterations):
+                    thinking += delta
+                    yield {
+                        "type": "thinking_delta",
+                        "iteration": i + 1,
+                        "delta": delta
+                    }
+                thinking = thinking.strip()
+                print(f"💭 THINKING: {thinking}")
+                
+                # Then the complete thought
+                yield {
+                    "type": "thinking",
+                    "iteration": i + 1,
+                    "thinking": thinking
+                }
+                
+                # ACT
                 action, action_input = await self._decide_action(thinking, context, iterations)
                 print(f"⚡ ACTION: {action}")
             
             # OBSERVE
             observation = await self._execute_action(action, action_input, user_id, context)
-            print(f"👁️ OBSERVATION: {observation[:200]}...")
             
-            iterations.append({
+            # Update context with observations; the log only ever grows at the end
+            _record_iteration(context, {
                 "iteration": i + 1,
                 "thinking": thinking,
                 "action": action,
                 "action_input": action_input,
                 "observation": observation
             })
-            
-            # Update context with observations
-            context["past_iterations"] = iterations
+            print(f"👁️ OBSERVATION: {iterations[-1]['observation'][:200]}...")
             
             # Check if finished
             if action == "generate_shopping_list":
@@ -88,95 +233,81 @@ class ShoppingAgent:
             "iterations": iterations
         }
     
-    async def _think(self, context: Dict, iterations: List[Dict]) -> str:
-        """Generate thinking step using LLM"""
+    async def _think(self, context: Dict, iterations: List[Dict]) -> AsyncIterator[str]:
+        """Generate thinking step using LLM, yielding the thought as it streams in"""
         
-        prompt = f"""You are an AI shopping assistant agent. Based on the context, decide what you need to think about next.
+        prompt = f"""User Request: {context['user_input']}
 
-User Request: {context['user_input']}
+Already gathered: {', '.join(it['action'] for it in iterations)}
 
-IMPORTANT: The user will NOT provide a detailed shopping list. Your job is to suggest sustainable items based on:
-- Their purchase history
-- Their commitments to alternatives
-- Seasonal produce
-- General sustainable shopping principles
-
-Previous iterations:
-{json.dumps(iterations[-2:] if len(iterations) > 1 else iterations, indent=2)}
-
-What should you think about next? Consider:
-- What information do you still need from their history/commitments?
-- Have you gathered enough data to make recommendations?
-- Should you generate the shopping list now?
-
-Respond with ONE clear thought (max 1 sentence, ~10 words)."""
+Recent iterations:
+{context.get('iteration_log_text', '')[-2000:]}"""
+        
+        cache_key = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+        cached = _thought_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
         
+        thought = ""
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            return response.content.strip()
+            async for chunk in self.llm.astream([_THINK_SYSTEM, HumanMessage(content=prompt)]):
+                if chunk.text:
+                    thought += chunk.text
+                    yield chunk.text
         except Exception as e:
             print(f"❌ Error in thinking: {e}")
-            return "Gathering user purchase history"
+            if not thought:
+                yield "Gathering user purchase history"
+            return
+        
+        _thought_cache.set(cache_key, thought.strip())
     
     async def _decide_action(self, thinking: str, context: Dict, iterations: List[Dict]) -> tuple:
         """Decide which action to take based on thinking"""
         
-        available_tools = """
-Available tools:
-1. query_past_receipts - Get user's purchase history
-2. query_commitments - Check sustainable alternatives they committed to
-3. search_seasonal_produce - Find what's in season (LLM call)
-4. query_user_profile - Get user preferences
-5. calculate_carbon_impact - Estimate CO2 for items
-6. generate_shopping_list - Create the final shopping list
-"""
+        # Most steps follow directly from what's been gathered, so only ask the LLM when they don't
+        ruled = _rule_based_action(iterations)
+        if ruled is not None:
+            print(f"⚡ Decided by rule: {ruled[0]}")
+            return ruled
+        print("⚡ Asking the LLM to decide")
         
-        prompt = f"""Based on your thinking, choose the BEST tool to use next.
-
-Thinking: {thinking}
-
-{available_tools}
+        prompt = f"""Thinking: {thinking}
 
 Previous actions: {[it['action'] for it in iterations]}
-
-Respond with JSON:
-{{"action": "tool_name", "input": {{"param": "value"}}}}
-
-Choose wisely - you have limited iterations!"""
+Failed lookups: {[it['action'] for it in iterations if _is_failed_observation(it['observation'])]}"""
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            text = response.content.strip()
-            
-            # Extract JSON
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif "```" in text:
-                text = text.split("```")[1].split("```")[0].strip()
-            
-            decision = json.loads(text)
-            return decision["action"], decision.get("input", {})
+            # Schema-constrained, so the action is always one of the tool names
+            decision = await self._decision_llm.ainvoke([_DECIDE_SYSTEM, HumanMessage(content=prompt)])
+            return decision.action, decision.input.model_dump()
         except Exception as e:
             print(f"❌ Error deciding action: {e}")
-            # Default to query receipts if haven't done it yet
-            if not any(it["action"] == "query_past_receipts" for it in iterations):
-                return "query_past_receipts", {"limit": 10}
+            # Everything else was prefetched, so finishing is the only useful step left
             return "generate_shopping_list", {}
     
     async def _execute_action(self, action: str, action_input: Dict, user_id: str, context: Dict) -> str:
         """Execute the chosen action"""
         
+        # Lookups return the same data within a run, so reuse an earlier observation instead of repeating one.
+        # Failed lookups are run again; that retry is what the think/decide turns are for
+        if action not in ("generate_shopping_list", "calculate_carbon_impact"):
+            for past, full_observation in zip(context.get("past_iterations", []), context.get("full_observations", [])):
+                if past["action"] == action and not _is_failed_observation(full_observation):
+                    return full_observation
+        
         if action == "query_past_receipts":
-            return await self._query_past_receipts(user_id, action_input.get("limit", 10))
+            return await self._query_past_receipts(user_id, context)
         
         elif action == "query_commitments":
-            return await self._query_commitments(user_id)
+            return await self._query_commitments(user_id, context)
         
         elif action == "search_seasonal_produce":
             return await self._search_seasonal_produce(context.get("location", "Texas"))
         
         elif action == "query_user_profile":
-            return await self._query_user_profile(user_id)
+            return await self._query_user_profile(user_id, context)
         
         elif action == "calculate_carbon_impact":
             return await self._calculate_carbon_impact(action_input.get("items", []))
@@ -189,53 +320,50 @@ Choose wisely - you have limited iterations!"""
     
     # Tool implementations
     
-    async def _query_past_receipts(self, user_id: str, limit: int) -> str:
+    async def _db_snapshot(self, user_id: str, context: Dict) -> Dict:
+        """
+        Receipts, commitments and profile from one agent_context RPC call
+        
+        The call is started once per run and kept on the context, so the
+        three database tools share it even when they run concurrently. A
+        failed call is started again, so a retried lookup doesn't reuse it.
+        """
+        snapshot = context.get("db_snapshot")
+        if snapshot is None or (snapshot.done() and snapshot.exception() is not None):
+            context["db_snapshot"] = asyncio.ensure_future(asyncio.to_thread(
+                supabase.rpc("agent_context", {"p_user_id": user_id, "p_receipt_limit": _AGENT_RECEIPT_LIMIT}).execute
+            ))
+        response = await context["db_snapshot"]
+        return response.data
+    
+    async def _query_past_receipts(self, user_id: str, context: Dict) -> str:
         """Query user's past receipt scans"""
         try:
-            # Get recent receipt scans
-            receipts = supabase.table("receipt_scans")\
-                .select("*, receipt_items(*)")\
-                .eq("user_id", user_id)\
-                .order("created_at", desc=True)\
-                .limit(limit)\
-                .execute()
+            # Item frequencies over the recent scans are counted by agent_context
+            snapshot = await self._db_snapshot(user_id, context)
             
-            if not receipts.data:
+            if not snapshot["receipt_count"]:
                 return "No past receipts found. User is new to receipt scanning."
             
-            # Summarize items
-            item_counts = {}
-            for receipt in receipts.data:
-                for item in receipt.get("receipt_items", []):
-                    name = item["item_name"]
-                    item_counts[name] = item_counts.get(name, 0) + 1
-            
-            # Get most frequent items
-            frequent = sorted(item_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-            
-            summary = f"User bought {len(receipts.data)} receipts. Most frequent items:\n"
-            for item, count in frequent:
-                summary += f"- {item} ({count}x)\n"
+            summary = f"User bought {snapshot['receipt_count']} receipts. Most frequent items:\n"
+            for item in snapshot["frequent_items"]:
+                summary += f"- {item['item_name']} ({item['freq']}x)\n"
             
             return summary
         except Exception as e:
             return f"Error querying receipts: {str(e)}"
     
-    async def _query_commitments(self, user_id: str) -> str:
+    async def _query_commitments(self, user_id: str, context: Dict) -> str:
         """Query user's commitments to sustainable alternatives"""
         try:
-            commitments = supabase.table("user_commitments")\
-                .select("*, receipt_items(alternative_name, item_name)")\
-                .eq("user_id", user_id)\
-                .eq("is_completed", False)\
-                .execute()
+            commitments = (await self._db_snapshot(user_id, context))["commitments"]
             
-            if not commitments.data:
+            if not commitments:
                 return "No active commitments found."
             
-            summary = f"User has {len(commitments.data)} pending commitments:\n"
-            for c in commitments.data[:5]:
-                item_info = c.get("receipt_items", {})
+            summary = f"User has {len(commitments)} pending commitments:\n"
+            for c in commitments[:5]:
+                item_info = c.get("receipt_items") or {}
                 alt = item_info.get("alternative_name", "unknown")
                 orig = item_info.get("item_name", "unknown")
                 summary += f"- Try {alt} instead of {orig}\n"
@@ -245,72 +373,60 @@ Choose wisely - you have limited iterations!"""
             return f"Error querying commitments: {str(e)}"
     
     async def _search_seasonal_produce(self, location: str) -> str:
-        """Search for seasonal produce using LLM"""
+        """Search for seasonal produce using LLM (cached per location and month)"""
+        now = datetime.now()
         try:
-            month = datetime.now().strftime("%B")
-            prompt = f"What fruits and vegetables are in peak season in {location} during {month}? List 5-7 items with brief notes on sustainability benefits. Be concise."
-            
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            return response.content.strip()
+            return await _seasonal_produce_cache.get_or_set(
+                (location, now.strftime("%Y-%m")),
+                lambda: self._request_seasonal_produce(location, now.strftime("%B"))
+            )
         except Exception as e:
             return f"Error searching seasonal produce: {str(e)}"
     
-    async def _query_user_profile(self, user_id: str) -> str:
+    async def _request_seasonal_produce(self, location: str, month: str) -> str:
+        """Ask Gemini what's in season; raises on failure so errors aren't cached"""
+        prompt = f"What fruits and vegetables are in peak season in {location} during {month}? List 5-7 items with brief notes on sustainability benefits. Be concise."
+        
+        response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+        return response.content.strip()
+    
+    async def _query_user_profile(self, user_id: str, context: Dict) -> str:
         """Query user profile for preferences"""
         try:
-            profile = supabase.table("user_profiles")\
-                .select("*")\
-                .eq("user_id", user_id)\
-                .execute()
+            p = (await self._db_snapshot(user_id, context))["profile"]
             
-            if not profile.data:
+            if not p:
                 return "No profile data found."
             
-            p = profile.data[0]
-            return f"User preferences: Level {p.get('level', 1)}, {p.get('total_xp', 0)} XP, saved {p.get('total_co2_saved_kg', 0)} kg CO2"
+            return f"User preferences: Level {p.get('current_level', 1)}, {p.get('total_xp', 0)} XP, saved {p.get('total_co2_saved', 0)} kg CO2"
         except Exception as e:
             return f"Error querying profile: {str(e)}"
     
     async def _calculate_carbon_impact(self, items: List[str]) -> str:
         """Calculate estimated carbon impact"""
-        # Simple estimation
-        total = len(items) * 0.5  # Rough estimate
+        # Keyword-table estimates: no Climatiq or Gemini round trip per item
+        total = sum(climatiq_service.estimate_item_carbon(item) for item in items)
         return f"Estimated CO2 impact: {total:.1f} kg for {len(items)} items"
     
     async def _generate_shopping_list(self, context: Dict) -> str:
         """Generate the final shopping list using all gathered context"""
         try:
-            prompt = f"""Generate a personalized sustainable shopping list based on this context:
-
-User request: {context['user_input']}
+            prompt = f"""User request: {context['user_input']}
 
 Context from previous iterations:
-{json.dumps(context.get('past_iterations', []), indent=2)}
-
-Create a JSON array of shopping list items with this structure:
-[
-  {{
-    "name": "item name",
-    "category": "commitment_reminder|seasonal|smart_swap|other",
-    "original_item": "what they used to buy (for swaps)",
-    "reason": "why recommend this",
-    "carbon_saved_kg": 0.0,
-    "emoji": "appropriate emoji"
-  }}
-]
-
-Include 8-12 items. Prioritize commitment reminders, then seasonal items, then smart swaps."""
-            
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            text = response.content.strip()
+{context.get('iteration_log_text', '')}"""
             
-            # Extract JSON
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif "```" in text:
-                text = text.split("```")[1].split("```")[0].strip()
+            async def request_list() -> List[Dict]:
+                result = await self._list_llm.ainvoke([_SHOPPING_LIST_SYSTEM, HumanMessage(content=prompt)])
+                return [item.model_dump() for item in result.items]
             
-            shopping_list = json.loads(text)
+            fingerprint = _shopping_list_fingerprint(context)
+            if fingerprint is None:
+                shopping_list = await request_list()
+            else:
+                shopping_list = await _shopping_list_cache.get_or_set(fingerprint, request_list)
+            # Copies, so callers can't alter the cached list
+            shopping_list = [dict(item) for item in shopping_list]
             
             # Store in context
             context["final_list"] = shopping_list
@@ -332,5 +448,80 @@ Include 8-12 items. Prioritize commitment reminders, then seasonal items, then s
             return "Generated basic shopping list (fallback)"
 
 
+def _rule_based_action(iterations: List[Dict]) -> Optional[tuple]:
+    """
+    The next action when it follows from the iterations so far, else None
+    
+    A lookup whose latest attempt failed leaves the state unsettled, so the
+    agent thinks and decides whether to retry it or go on without it.
+    """
+    attempted = {it["action"] for it in iterations}
+    if "generate_shopping_list" in attempted:
+        return None
+    
+    for action, action_input in _DATA_GATHERING_ACTIONS:
+        if action not in attempted:
+            return action, action_input
+    
+    latest = {it["action"]: it["observation"] for it in iterations}
+    if any(_is_failed_observation(latest[action]) for action, _ in _DATA_GATHERING_ACTIONS):
+        return None
+    
+    # Everything's gathered; the list is the only step left
+    return "generate_shopping_list", {}
+
+
+def _is_failed_observation(observation: str) -> bool:
+    """Whether a tool reported an error instead of data (the tools return errors as text)"""
+    return observation.startswith("Error")
+
+
+def _shopping_list_fingerprint(context: Dict) -> Optional[str]:
+    """
+    Hash of what a shopping list is built from: the request, frequent items,
+    open commitments, profile level and month. XP and CO2 totals are left out
+    since every run changes them. None when the user's data couldn't be loaded.
+    """
+    snapshot_task = context.get("db_snapshot")
+    if snapshot_task is None or not snapshot_task.done() or snapshot_task.exception() is not None:
+        return None
+    
+    snapshot = snapshot_task.result().data
+    profile = snapshot.get("profile") or {}
+    key = orjson.dumps({
+        "user_input": context["user_input"].strip().lower(),
+        "location": context.get("location"),
+        "frequent_items": snapshot.get("frequent_items"),
+        "commitments": snapshot.get("commitments"),
+        "level": profile.get("current_level"),
+        "month": datetime.now().strftime("%Y-%m"),
+    }, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+def _record_iteration(context: Dict, iteration: Dict) -> None:
+    """
+    Append an iteration to the run's history
+    
+    The prompt log and full_observations keep the whole observation; the
+    record itself (streamed to the client and saved with the list) keeps
+    at most _MAX_RECORDED_OBSERVATION_CHARS of it.
+    """
+    observation = iteration["observation"]
+    context["iteration_log_text"] += _iteration_log_line(iteration)
+    context["full_observations"].append(observation)
+    iteration["observation"] = observation[:_MAX_RECORDED_OBSERVATION_CHARS]
+    context["past_iterations"].append(iteration)
+
+
+def _iteration_log_line(iteration: Dict) -> str:
+    """One compact, deterministic log entry per iteration for the agent's prompts"""
+    action_input = orjson.dumps(iteration["action_input"], option=orjson.OPT_SORT_KEYS).decode()
+    return (
+        f"[iter {iteration['iteration']}] thinking={iteration['thinking']} "
+        f"action={iteration['action']} input={action_input}\nobs={iteration['observation']}\n"
+    )
+
+
 # Singleton instance
 shopping_agent = ShoppingAgent()
@@ -0,0 +1,47 @@
+-- Lifetime CO2 per category plus the top 5 actions in each, for /impact/projections.
+-- Categories outside the four tracked ones (and NULL) are counted as energy,
+-- matching the fallback the API used when it aggregated rows itself.
+create or replace function public.impact_breakdown(uid uuid)
+returns table (category text, total_co2 double precision, top jsonb)
+language sql
+stable
+as $$
+    with normalized as (
+        select
+            case
+                when detected_category in ('transportation', 'food', 'shopping', 'energy')
+                    then detected_category
+                else 'energy'
+            end as category,
+            coalesce(co2_saved_kg, 0)::double precision as co2,
+            ai_summary as name
+        from public.user_activities
+        where user_id = uid
+    ),
+    actions as (
+        select
+            category,
+            name,
+            sum(co2) as co2,
+            count(*) as count,
+            row_number() over (partition by category order by sum(co2) desc) as rank
+        from normalized
+        group by category, name
+    )
+    select
+        n.category,
+        sum(n.co2) as total_co2,
+        coalesce(
+            (
+                select jsonb_agg(
+                    jsonb_build_object('name', a.name, 'co2', a.co2, 'count', a.count)
+                    order by a.co2 desc
+                )
+                from actions a
+                where a.category = n.category and a.rank <= 5
+            ),
+            '[]'::jsonb
+        ) as top
+    from normalized n
+    group by n.category;
+$$;
@@ -0,0 +1,10 @@
+-- Per-user activity lookups (feed pagination, freeform daily/duplicate checks,
+-- 30-day impact window) all filter on user_id and range or sort on created_at.
+-- The INCLUDE columns let the feed be served from the index alone.
+create index if not exists user_activities_user_created_idx
+    on public.user_activities (user_id, created_at desc)
+    include (activity_type, ai_summary, emoji, xp_earned, co2_saved_kg, money_saved);
+
+-- Available missions for a user, highest impact first.
+create index if not exists user_missions_user_status_co2_idx
+    on public.user_missions (user_id, status, co2_saved_kg desc);
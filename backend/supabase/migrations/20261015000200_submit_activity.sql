@@ -0,0 +1,84 @@
+-- Insert an activity and apply it to the owner's profile stats in one transaction.
+-- Mirrors update_user_stats in app/routers/activities.py; the level math must
+-- stay in sync with app/game_mechanics.py (XP_MULTIPLIER = 60).
+create or replace function public.submit_activity(
+    uid uuid,
+    activity jsonb,
+    missions_completed integer default 0
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    inserted public.user_activities;
+    profile public.user_profiles;
+    updated public.user_profiles;
+    xp integer := coalesce((activity->>'xp_earned')::integer, 0);
+    co2 double precision := coalesce((activity->>'co2_saved_kg')::double precision, 0);
+    money double precision := coalesce((activity->>'money_saved')::double precision, 0);
+    new_total_xp bigint;
+    new_level integer;
+    level_threshold bigint;
+    next_level_threshold bigint;
+    last_date date;
+    new_streak integer;
+begin
+    insert into public.user_activities (
+        user_id, activity_type, mission_id, user_input, ai_summary,
+        detected_category, xp_earned, co2_saved_kg, money_saved, emoji
+    )
+    select
+        uid, a.activity_type, a.mission_id, a.user_input, a.ai_summary,
+        a.detected_category, a.xp_earned, a.co2_saved_kg, a.money_saved, a.emoji
+    from jsonb_populate_record(null::public.user_activities, activity) a
+    returning * into inserted;
+
+    select * into profile from public.user_profiles where user_id = uid for update;
+    if not found then
+        return jsonb_build_object('activity', to_jsonb(inserted), 'profile', null, 'previous_level', null);
+    end if;
+
+    -- Level L starts at XP_MULTIPLIER * (L * (L + 1) / 2 - 1)
+    new_total_xp := coalesce(profile.total_xp, 0) + xp;
+    new_level := (floor(sqrt(8 * (new_total_xp / 60 + 1) + 1))::integer - 1) / 2;
+    level_threshold := case when new_level < 2 then 0 else 60 * (new_level * (new_level + 1) / 2 - 1) end;
+    next_level_threshold := 60 * ((new_level + 1) * (new_level + 2) / 2 - 1);
+
+    -- Same day keeps the streak, the next day extends it, anything else restarts it
+    last_date := profile.last_activity_date::date;
+    new_streak := case
+        when last_date = current_date then coalesce(profile.current_streak_days, 0)
+        when last_date = current_date - 1 then coalesce(profile.current_streak_days, 0) + 1
+        else 1
+    end;
+
+    update public.user_profiles set
+        total_xp = new_total_xp,
+        current_level = new_level,
+        xp_current_level = new_total_xp - level_threshold,
+        xp_to_next_level = next_level_threshold - new_total_xp,
+        total_co2_saved = coalesce(total_co2_saved, 0) + co2,
+        total_missions_completed = coalesce(total_missions_completed, 0) + missions_completed,
+        total_money_saved = coalesce(total_money_saved, 0) + money,
+        last_activity_date = current_date,
+        current_streak_days = new_streak,
+        longest_streak_days = greatest(coalesce(longest_streak_days, 0), new_streak),
+        plant_stage = case
+            when new_level <= 2 then 1
+            when new_level <= 4 then 2
+            when new_level <= 7 then 3
+            when new_level <= 10 then 4
+            when new_level <= 15 then 5
+            when new_level <= 20 then 6
+            else 7
+        end
+    where user_id = uid
+    returning * into updated;
+
+    return jsonb_build_object(
+        'activity', to_jsonb(inserted),
+        'profile', to_jsonb(updated),
+        'previous_level', profile.current_level
+    );
+end;
+$$;
@@ -0,0 +1,8 @@
+-- Case-insensitive duplicate detection for freeform activities without
+-- pulling every recent row back to the API.
+alter table public.user_activities
+    add column if not exists user_input_lower text
+    generated always as (lower(user_input)) stored;
+
+create index if not exists user_activities_user_input_lower_idx
+    on public.user_activities (user_id, user_input_lower, created_at);
@@ -0,0 +1,19 @@
+-- Daily freeform count and recent-duplicate flag for a submission, in one query.
+create or replace function public.freeform_submission_status(
+    uid uuid,
+    input_lower text,
+    day_start timestamptz,
+    duplicate_since timestamptz
+)
+returns table (daily_count bigint, is_duplicate boolean)
+language sql
+stable
+as $$
+    select
+        count(*) filter (where created_at >= day_start),
+        coalesce(bool_or(user_input_lower = input_lower and created_at >= duplicate_since), false)
+    from public.user_activities
+    where user_id = uid
+        and activity_type = 'freeform'
+        and created_at >= least(day_start, duplicate_since);
+$$;
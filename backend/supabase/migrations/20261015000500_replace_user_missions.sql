@@ -0,0 +1,21 @@
+-- Swap a user's mission set in one transaction so there is never a window
+-- where they have no missions, and regeneration costs a single round trip.
+create or replace function public.replace_user_missions(p_user_id uuid, p_missions jsonb)
+returns setof public.user_missions
+language plpgsql
+as $$
+begin
+    delete from public.user_missions where user_id = p_user_id;
+
+    return query
+    insert into public.user_missions (
+        user_id, title, description, category, co2_saved_kg,
+        money_saved, xp_reward, mission_type, tips, status
+    )
+    select
+        p_user_id, m.title, m.description, m.category, m.co2_saved_kg,
+        m.money_saved, m.xp_reward, m.mission_type, m.tips, coalesce(m.status, 'available')
+    from jsonb_populate_recordset(null::public.user_missions, p_missions) m
+    returning *;
+end;
+$$;
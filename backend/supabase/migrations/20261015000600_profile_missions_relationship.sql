@@ -0,0 +1,9 @@
+-- Computed relationship so PostgREST can embed a profile's missions
+-- (select=*,missions(*)) without a foreign key between the two tables.
+create or replace function public.missions(public.user_profiles)
+returns setof public.user_missions
+language sql
+stable
+as $$
+    select * from public.user_missions where user_id = $1.user_id;
+$$;
@@ -0,0 +1,32 @@
+-- Receipt scans look up earlier commitments by alternative name. Store the
+-- normalized name of the committed alternative so that lookup is an index
+-- equality match instead of an unanchored ILIKE over commitment_text.
+alter table public.user_commitments
+    add column if not exists alternative_key text;
+
+create or replace function public.set_commitment_alternative_key()
+returns trigger
+language plpgsql
+as $$
+begin
+    select lower(trim(ri.alternative_name))
+      into new.alternative_key
+      from public.receipt_items ri
+     where ri.id = new.item_id;
+    return new;
+end;
+$$;
+
+drop trigger if exists user_commitments_alternative_key on public.user_commitments;
+create trigger user_commitments_alternative_key
+    before insert or update of item_id on public.user_commitments
+    for each row execute function public.set_commitment_alternative_key();
+
+update public.user_commitments uc
+   set alternative_key = lower(trim(ri.alternative_name))
+  from public.receipt_items ri
+ where ri.id = uc.item_id
+   and uc.alternative_key is null;
+
+create index if not exists user_commitments_user_alternative_key_idx
+    on public.user_commitments (user_id, alternative_key, created_at desc);
@@ -0,0 +1,31 @@
+-- Store a fully analyzed receipt (scan row with its totals plus every line
+-- item) in one round trip and one transaction, so a scan never exists
+-- without its items.
+create or replace function public.create_receipt_scan(p_scan jsonb, p_items jsonb)
+returns setof public.receipt_items
+language plpgsql
+as $$
+begin
+    insert into public.receipt_scans (
+        id, user_id, store_name, scan_date, total_items,
+        total_co2_kg, comparison_metric, xp_earned
+    )
+    select
+        s.id, s.user_id, s.store_name, s.scan_date, s.total_items,
+        s.total_co2_kg, s.comparison_metric, s.xp_earned
+    from jsonb_populate_record(null::public.receipt_scans, p_scan) s;
+
+    return query
+    insert into public.receipt_items (
+        receipt_scan_id, item_name, price, carbon_footprint_kg, impact_level,
+        has_alternative, alternative_name, alternative_carbon_kg,
+        carbon_savings_percent, price_difference, alternative_note
+    )
+    select
+        i.receipt_scan_id, i.item_name, i.price, i.carbon_footprint_kg, i.impact_level,
+        i.has_alternative, i.alternative_name, i.alternative_carbon_kg,
+        i.carbon_savings_percent, i.price_difference, i.alternative_note
+    from jsonb_populate_recordset(null::public.receipt_items, p_items) i
+    returning *;
+end;
+$$;
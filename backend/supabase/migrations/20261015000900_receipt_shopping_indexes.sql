@@ -0,0 +1,15 @@
+-- Receipt history and the shopping agent's past-receipts tool list a user's
+-- latest scans; shopping history does the same for shopping lists.
+create index if not exists receipt_scans_user_created_idx
+    on public.receipt_scans (user_id, created_at desc);
+
+create index if not exists shopping_lists_user_created_idx
+    on public.shopping_lists (user_id, created_at desc);
+
+-- A user's commitments, newest first.
+create index if not exists user_commitments_user_created_idx
+    on public.user_commitments (user_id, created_at desc);
+
+-- Items are always fetched (or embedded) by their scan.
+create index if not exists receipt_items_scan_idx
+    on public.receipt_items (receipt_scan_id);
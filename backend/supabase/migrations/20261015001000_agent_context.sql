@@ -0,0 +1,47 @@
+-- Everything the shopping agent reads about a user in one round trip: item
+-- names from their latest receipt scans, their open commitments (with the
+-- committed item and its alternative) and their profile row.
+create or replace function public.agent_context(p_user_id uuid, p_receipt_limit int default 10)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'receipts', coalesce((
+            select json_agg(
+                       json_build_object('receipt_items', coalesce(items.list, '[]'::json))
+                       order by rs.created_at desc
+                   )
+              from (
+                    select id, created_at
+                      from public.receipt_scans
+                     where user_id = p_user_id
+                     order by created_at desc
+                     limit p_receipt_limit
+                   ) rs
+              left join lateral (
+                    select json_agg(json_build_object('item_name', ri.item_name)) as list
+                      from public.receipt_items ri
+                     where ri.receipt_scan_id = rs.id
+                   ) items on true
+        ), '[]'::json),
+        'commitments', coalesce((
+            select json_agg(json_build_object(
+                       'receipt_items', case when ri.id is null then null else json_build_object(
+                           'alternative_name', ri.alternative_name,
+                           'item_name', ri.item_name
+                       ) end
+                   ))
+              from public.user_commitments uc
+              left join public.receipt_items ri on ri.id = uc.item_id
+             where uc.user_id = p_user_id
+               and uc.is_completed = false
+        ), '[]'::json),
+        'profile', (
+            select row_to_json(up)
+              from public.user_profiles up
+             where up.user_id = p_user_id
+             limit 1
+        )
+    );
+$$;
@@ -0,0 +1,48 @@
+-- The shopping agent only ever summarized its receipts as "N receipts, most
+-- frequent items", so count item names in the database and return the top
+-- ones instead of every item name from every recent scan.
+create or replace function public.agent_context(p_user_id uuid, p_receipt_limit int default 10)
+returns json
+language sql
+stable
+as $$
+    with recent_scans as (
+        select id
+          from public.receipt_scans
+         where user_id = p_user_id
+         order by created_at desc
+         limit p_receipt_limit
+    )
+    select json_build_object(
+        'receipt_count', (select count(*) from recent_scans),
+        'frequent_items', coalesce((
+            select json_agg(json_build_object('item_name', f.item_name, 'freq', f.freq) order by f.freq desc, f.item_name)
+              from (
+                    select ri.item_name, count(*) as freq
+                      from public.receipt_items ri
+                      join recent_scans rs on rs.id = ri.receipt_scan_id
+                     group by ri.item_name
+                     order by freq desc, ri.item_name
+                     limit 10
+                   ) f
+        ), '[]'::json),
+        'commitments', coalesce((
+            select json_agg(json_build_object(
+                       'receipt_items', case when ri.id is null then null else json_build_object(
+                           'alternative_name', ri.alternative_name,
+                           'item_name', ri.item_name
+                       ) end
+                   ))
+              from public.user_commitments uc
+              left join public.receipt_items ri on ri.id = uc.item_id
+             where uc.user_id = p_user_id
+               and uc.is_completed = false
+        ), '[]'::json),
+        'profile', (
+            select row_to_json(up)
+              from public.user_profiles up
+             where up.user_id = p_user_id
+             limit 1
+        )
+    );
+$$;
@@ -0,0 +1,65 @@
+-- Keep game rules out of SQL. submit_activity now only inserts the activity
+-- and adds its XP, CO2, money, missions and streak to the profile; the level,
+-- XP progress and plant stage are derived from the returned total_xp by
+-- app/game_mechanics.py, so the curve lives in one place.
+-- Streak days are UTC dates, the same as update_user_stats uses.
+create or replace function public.submit_activity(
+    uid uuid,
+    activity jsonb,
+    missions_completed integer default 0
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    inserted public.user_activities;
+    profile public.user_profiles;
+    updated public.user_profiles;
+    xp integer := coalesce((activity->>'xp_earned')::integer, 0);
+    co2 double precision := coalesce((activity->>'co2_saved_kg')::double precision, 0);
+    money double precision := coalesce((activity->>'money_saved')::double precision, 0);
+    today date := (now() at time zone 'utc')::date;
+    last_date date;
+    new_streak integer;
+begin
+    insert into public.user_activities (
+        user_id, activity_type, mission_id, user_input, ai_summary,
+        detected_category, xp_earned, co2_saved_kg, money_saved, emoji
+    )
+    select
+        uid, a.activity_type, a.mission_id, a.user_input, a.ai_summary,
+        a.detected_category, a.xp_earned, a.co2_saved_kg, a.money_saved, a.emoji
+    from jsonb_populate_record(null::public.user_activities, activity) a
+    returning * into inserted;
+
+    select * into profile from public.user_profiles where user_id = uid for update;
+    if not found then
+        return jsonb_build_object('activity', to_jsonb(inserted), 'profile', null, 'previous_level', null);
+    end if;
+
+    -- Same day keeps the streak, the next day extends it, anything else restarts it
+    last_date := profile.last_activity_date::date;
+    new_streak := case
+        when last_date = today then coalesce(profile.current_streak_days, 0)
+        when last_date = today - 1 then coalesce(profile.current_streak_days, 0) + 1
+        else 1
+    end;
+
+    update public.user_profiles set
+        total_xp = coalesce(total_xp, 0) + xp,
+        total_co2_saved = coalesce(total_co2_saved, 0) + co2,
+        total_missions_completed = coalesce(total_missions_completed, 0) + missions_completed,
+        total_money_saved = coalesce(total_money_saved, 0) + money,
+        last_activity_date = today,
+        current_streak_days = new_streak,
+        longest_streak_days = greatest(coalesce(longest_streak_days, 0), new_streak)
+    where user_id = uid
+    returning * into updated;
+
+    return jsonb_build_object(
+        'activity', to_jsonb(inserted),
+        'profile', to_jsonb(updated),
+        'previous_level', profile.current_level
+    );
+end;
+$$;
@@ -4,7 +4,7 @@ import os
 # Add the parent directory to sys.path to import app
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app.game_mechanics import calculate_level, get_level_threshold
+from app.game_mechanics import calculate_level, calculate_level_batch, get_level_threshold
 
 def verify():
     print("--- Verification ---")
@@ -25,5 +25,18 @@ def verify():
     level_300 = calculate_level(300)
     print(f"Level at 300 XP: {level_300} (Expected: 3)")
 
+    # Sweep the whole curve: levels never go down as XP grows, and every
+    # threshold is exactly where its level starts
+    sweep_xp = 1_000_000
+    levels = calculate_level_batch(range(sweep_xp))
+    monotonic = all(a <= b for a, b in zip(levels, levels[1:]))
+    print(f"Levels non-decreasing over 0-{sweep_xp - 1} XP: {monotonic} (Expected: True)")
+
+    boundary_errors = [
+        level for level in range(2, levels[-1] + 1)
+        if levels[get_level_threshold(level)] != level or levels[get_level_threshold(level) - 1] != level - 1
+    ]
+    print(f"Level boundaries off their thresholds: {boundary_errors} (Expected: [])")
+
 if __name__ == "__main__":
     verify()
@@ -124,33 +124,27 @@ export default function DashboardPage() {
         return;
       }
 
-      // Fetch both missions and stats in parallel
-      const [missionsResponse, statsResponse] = await Promise.all([
-        fetch('http://localhost:8000/missions/', {
-          headers: { 'Authorization': `Bearer ${token}` },
-        }),
-        fetch('http://localhost:8000/missions/stats', {
-          headers: { 'Authorization': `Bearer ${token}` },
-        })
-      ]);
+      // Fetch missions and stats together in one request
+      const dashboardResponse = await fetch('http://localhost:8000/missions/dashboard', {
+        headers: { 'Authorization': `Bearer ${token}` },
+      });
 
-      if (!missionsResponse.ok || !statsResponse.ok) {
+      if (!dashboardResponse.ok) {
         throw new Error('Failed to fetch dashboard data');
       }
 
-      const missionsData = await missionsResponse.json();
-      const statsData = await statsResponse.json();
+      const dashboardData = await dashboardResponse.json();
       
-      if (missionsData.success && missionsData.missions) {
-        const sortedMissions = missionsData.missions
+      if (dashboardData.success && dashboardData.missions) {
+        const sortedMissions = dashboardData.missions
           .filter((m: Mission) => m.status === 'available') // Only show active missions on dashboard
           .sort((a: Mission, b: Mission) => b.xp_reward - a.xp_reward)
           .slice(0, 5);
         setMissions(sortedMissions);
       }
 
-      if (statsData.success && statsData.stats) {
-        setStats(statsData.stats);
+      if (dashboardData.success && dashboardData.stats) {
+        setStats(dashboardData.stats);
       }
       
       setLoading(false);
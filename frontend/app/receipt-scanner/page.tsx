@@ -28,6 +28,23 @@ interface ScanResult {
   items: ReceiptItem[];
 }
 
+// Longest side sent to the parser; receipts stay legible well below phone-camera resolution
+const MAX_RECEIPT_DIMENSION = 1600;
+
+// Decode (EXIF-oriented), shrink to MAX_RECEIPT_DIMENSION and re-encode as JPEG; returns bare base64
+async function downscaleReceiptImage(file: File): Promise<string> {
+  const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+  const scale = Math.min(1, MAX_RECEIPT_DIMENSION / Math.max(bitmap.width, bitmap.height));
+
+  const canvas = document.createElement('canvas');
+  canvas.width = Math.round(bitmap.width * scale);
+  canvas.height = Math.round(bitmap.height * scale);
+  canvas.getContext('2d')?.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+  bitmap.close();
+
+  return canvas.toDataURL('image/jpeg', 0.8).split(',')[1];
+}
+
 export default function ReceiptScannerPage() {
   const router = useRouter();
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
@@ -197,42 +214,31 @@ export default function ReceiptScannerPage() {
     setLoadingMessage('Analyzing your receipt...');
 
     try {
-      const reader = new FileReader();
-      reader.readAsDataURL(selectedFile);
-      
-      reader.onload = async () => {
-        const base64 = reader.result as string;
-        const base64Data = base64.split(',')[1];
-
-        const token = localStorage.getItem('supabase_token');
-        const response = await fetch('http://localhost:8000/receipts/scan-and-analyze', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-            'Authorization': `Bearer ${token}`
-          },
-          body: JSON.stringify({
-            image_base64: base64Data
-          })
-        });
-
-        if (!response.ok) {
-          throw new Error('Failed to scan receipt');
-        }
+      const base64Data = await downscaleReceiptImage(selectedFile);
 
-        const data = await response.json();
-        setScanResult(data);
-        setIsScanning(false);
-        
-        // Refresh recent scans and stats
-        fetchRecentScans();
-        fetchStats();
-      };
-
-      reader.onerror = () => {
-        setIsScanning(false);
-        alert('Error reading file');
-      };
+      const token = localStorage.getItem('supabase_token');
+      const response = await fetch('http://localhost:8000/receipts/scan-and-analyze', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`
+        },
+        body: JSON.stringify({
+          image_base64: base64Data
+        })
+      });
+
+      if (!response.ok) {
+        throw new Error('Failed to scan receipt');
+      }
+
+      const data = await response.json();
+      setScanResult(data);
+      setIsScanning(false);
+      
+      // Refresh recent scans and stats
+      fetchRecentScans();
+      fetchStats();
     } catch (error) {
       console.error('Error scanning receipt:', error);
       setIsScanning(false);
@@ -71,19 +71,31 @@ export default function ShoppingAssistantPage() {
 
       const reader = response.body.getReader();
       const decoder = new TextDecoder();
+      // Reads can end mid-event, so keep the trailing partial line for the next read
+      let buffered = '';
+      let thinkingIteration: number | null = null;
 
       while (true) {
         const { done, value } = await reader.read();
         if (done) break;
 
-        const chunk = decoder.decode(value);
-        const lines = chunk.split('\n');
+        buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = lines.pop() ?? '';
 
         for (const line of lines) {
           if (line.startsWith('data: ')) {
             const data = JSON.parse(line.slice(6));
 
-            if (data.type === 'thinking') {
+            if (data.type === 'thinking_delta') {
+              // Start over on each new iteration's thought, then append as it streams
+              if (data.iteration !== thinkingIteration) {
+                thinkingIteration = data.iteration;
+                setThinkingStep(data.delta);
+              } else {
+                setThinkingStep(prev => prev + data.delta);
+              }
+            } else if (data.type === 'thinking') {
               setThinkingStep(data.thinking);
             } else if (data.type === 'complete') {
               setShoppingList(data.shopping_list);